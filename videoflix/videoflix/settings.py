@@ -196,22 +196,40 @@ CONTACT_EMAIL_1 = env("CONTACT_EMAIL_1")
 CONTACT_EMAIL_2 = env("CONTACT_EMAIL_2")
 
 
-# Windows rqworker:
-# python manage.py rqworker --worker-class videoflix.simpleworker.SimpleWorker default
+# Windows workers (no fork), one per pool in RQ_WORKER_POOLS:
+# python manage.py run_worker_pool transcode --worker-class videoflix.simpleworker.SimpleWorker
+# python manage.py run_worker_pool io --worker-class videoflix.simpleworker.SimpleWorker
 
-# Mac rqworker:
+# Mac workers:
 # export DJANGO_SETTINGS_MODULE=videoflix.settings
-# OBJC_DISABLE_INITIALIZE_FORK_SAFETY=YES python manage.py rqworker
+# OBJC_DISABLE_INITIALIZE_FORK_SAFETY=YES python manage.py run_worker_pool transcode
+# OBJC_DISABLE_INITIALIZE_FORK_SAFETY=YES python manage.py run_worker_pool io
+RQ_CONNECTION = {
+    "HOST": "localhost",
+    "PORT": 6379,
+    "DB": 0,
+    # "PASSWORD": "foobared",
+}
+
+# One queue per kind of work, so short jobs never wait behind a long encode.
+# Timeouts are the fallback for jobs enqueued without their own job_timeout.
 RQ_QUEUES = {
-    "default": {
-        "HOST": "localhost",
-        "PORT": 6379,
-        "DB": 0,
-        # "PASSWORD": "foobared",
-        "DEFAULT_TIMEOUT": 360,
-    },
+    "default": {**RQ_CONNECTION, "DEFAULT_TIMEOUT": 360},
+    "transcode": {**RQ_CONNECTION, "DEFAULT_TIMEOUT": 7200},  # convert_to_hls, encode_rendition
+    "upload": {**RQ_CONNECTION, "DEFAULT_TIMEOUT": 900},  # finalize_hls, master playlist
+    "metadata": {**RQ_CONNECTION, "DEFAULT_TIMEOUT": 120},  # posters, catalog manifest, cache refresh
+    "maintenance": {**RQ_CONNECTION, "DEFAULT_TIMEOUT": 1800},  # GCS and local cleanup
 }
 
+# Worker pools started with `python manage.py run_worker_pool <name>`. A worker takes jobs from
+# its queues in the listed order, which is how queue priority is expressed in RQ.
+RQ_WORKER_POOLS = {
+    "transcode": ["transcode"],
+    "io": ["metadata", "upload", "maintenance", "default"],
+}
+# Imported once by PreforkWorkerPool before it forks its workers (`run_worker_pool <pool> --processes N`)
+RQ_PREFORK_PRELOAD = ["videostore.tasks", "videostore.catalog", "videostore.gcs"]
+
 
 # Redis Cache configuration
 CACHES = {
@@ -240,6 +258,75 @@ GS_CREDENTIALS = service_account.Credentials.from_service_account_file(
     os.path.join(BASE_DIR, 'service-account-file.json')
 )
 
+# Single JSON object holding the whole video catalog, rebuilt on every Video save/delete
+CATALOG_MANIFEST_PATH = 'catalog/manifest.json'
+
+# HLS conversion: "single_pass" decodes once and writes every rendition from a single ffmpeg process.
+# "fan_out" enqueues one RQ job per rendition plus a master playlist finalizer; it decodes the source once
+# per rendition and needs every transcode worker to share MEDIA_ROOT, so only use it with several such workers
+HLS_ENCODE_MODE = 'single_pass'
+# "mpegts": numbered .ts segments, "fmp4": one byte-range addressed fragmented MP4 per rendition
+HLS_SEGMENT_FORMAT = 'mpegts'
+# x264 settings per encoding profile. rate_control is "crf", "capped_crf" (crf with a VBV cap) or
+# "vbr" (target bitrate from BITRATES in videostore/tasks.py). maxrate_factor and bufsize_factor scale
+# that per-resolution bitrate, gop_seconds is turned into frames using the source fps, threads 0 = auto.
+HLS_ENCODING_PROFILE = 'balanced'
+HLS_ENCODING_PROFILES = {
+    'fast': {'preset': 'veryfast', 'tune': None, 'rate_control': 'capped_crf', 'crf': 23, 'maxrate_factor': 1.5, 'bufsize_factor': 2.0, 'gop_seconds': 2, 'threads': 0},
+    'balanced': {'preset': 'medium', 'tune': None, 'rate_control': 'capped_crf', 'crf': 21, 'maxrate_factor': 1.5, 'bufsize_factor': 2.0, 'gop_seconds': 2, 'threads': 0},
+    'quality': {'preset': 'slow', 'tune': 'film', 'rate_control': 'capped_crf', 'crf': 20, 'maxrate_factor': 1.5, 'bufsize_factor': 2.0, 'gop_seconds': 2, 'threads': 0},
+    'bandwidth': {'preset': 'medium', 'tune': None, 'rate_control': 'vbr', 'crf': None, 'maxrate_factor': 1.1, 'bufsize_factor': 1.5, 'gop_seconds': 2, 'threads': 0},
+}
+HLS_SEGMENT_POLL_INTERVAL = 0.5  # seconds between scans for finished segments to upload during an encode
+# Transcode job timeout: HLS_CONVERSION_TIMEOUT_FACTOR seconds per second of video, at least
+# HLS_CONVERSION_TIMEOUT_MIN; HLS_CONVERSION_TIMEOUT when the duration is not known yet
+HLS_CONVERSION_TIMEOUT = 7200
+HLS_CONVERSION_TIMEOUT_FACTOR = 3
+HLS_CONVERSION_TIMEOUT_MIN = 600
+HLS_CONVERSION_RETRIES = 2  # a retried job resumes from the checkpoints in VideoConversion
+HLS_SOURCE_READY_TIMEOUT = 60  # seconds to wait for the uploaded source to exist with a stable size
+HLS_SOURCE_POLL_INTERVAL = 1
+# prepare_video job timeout: hashing reads the whole source, so PREPARE_TIMEOUT plus one second
+# per PREPARE_HASH_BYTES_PER_SECOND of source
+PREPARE_TIMEOUT = 120
+PREPARE_HASH_BYTES_PER_SECOND = 20 * 1024 * 1024
+HLS_PROGRESS_TTL = 86400  # seconds the per-rendition ffmpeg progress stays in Redis after the last update
+FFMPEG_STDERR_LINES = 200  # stderr lines kept per ffmpeg run for error messages
+
+# Poster frame and trickplay thumbnails: one keyframe every THUMBNAIL_INTERVAL seconds, tiled into
+# COLUMNS x ROWS sprite sheets uploaded with a WebVTT index to thumbnails/<video>/
+POSTER_TIME = 10  # seconds into the video, capped at half its duration
+THUMBNAIL_INTERVAL = 10
+THUMBNAIL_WIDTH = 160
+THUMBNAIL_SPRITE_COLUMNS = 5
+THUMBNAIL_SPRITE_ROWS = 5
+
+# Catalog keys in Redis (poster_urls, gcs_video_text_data, my_films_subfolders)
+CATALOG_CACHE_TTL = 3600
+CATALOG_CACHE_STALE_TTL = 86400  # gcs_video_text_data keeps serving this long past CATALOG_CACHE_TTL while an RQ job refreshes it
+CATALOG_REBUILD_LOCK_TIMEOUT = 120  # seconds a single rebuild may hold the lock
+CATALOG_REBUILD_WAIT = 10  # seconds other workers wait for that rebuild when nothing stale is cached
+
+# Concurrent small-blob downloads used when rebuilding the catalog from text/
+GCS_FETCH_MAX_WORKERS = 16
+GCS_FETCH_TIMEOUT = 10  # seconds per blob
+
+# Concurrent uploads of HLS segments, playlists and posters from the transcoding jobs
+GCS_UPLOAD_MAX_WORKERS = 8
+GCS_UPLOAD_TIMEOUT = 60  # seconds per request
+GCS_UPLOAD_RETRIES = 3
+GCS_UPLOAD_BACKOFF = 0.5  # seconds before the first retry, doubled on every further attempt
+
+# manage.py ingest_videos: parallel ffprobe calls and conversions allowed in flight at once on this node
+INGEST_PROBE_WORKERS = 8
+INGEST_MAX_CONCURRENT_CONVERSIONS = 2
+INGEST_POLL_INTERVAL = 5  # seconds between checks for finished conversions
+
+# Batched deletes used by the purge job after a video is deleted
+GCS_DELETE_BATCH_SIZE = 100  # deletes per batch HTTP request, the GCS maximum
+GCS_DELETE_RETRIES = 3  # retries of the failed deletes inside the purge job, which itself is not retried
+GCS_DELETE_BACKOFF = 0.5  # seconds before the first retry, doubled on every further attempt
+
 # pg_dump:
 #     cd .git\hooks
 #     echo #!/bin/sh > post-merge
@@ -1,4 +1,11 @@
+import importlib
+from multiprocessing import Process
+from django.conf import settings
+from django.db import connections
 from rq import Worker
+from rq.timeouts import UnixSignalDeathPenalty
+from rq.worker import SimpleWorker as InProcessWorker
+from rq.worker_pool import WorkerPool, run_worker
 
 
 # To start rqworker:
@@ -26,4 +33,66 @@ class SimpleWorker(Worker):
 
     def execute_job(self, *args, **kwargs):
         """Execute job in same thread/process, do not fork()"""
-        return self.perform_job(*args, **kwargs)
\ No newline at end of file
+        return self.perform_job(*args, **kwargs)
+
+
+# To start a pre-forked pool on Linux:
+# python manage.py run_worker_pool io --processes 4
+
+
+class PreforkedWorker(InProcessWorker):
+    """Runs jobs in its own long-lived process, keeping imports and connections warm; SIGALRM timeouts, so Unix only."""
+    death_penalty_class = UnixSignalDeathPenalty
+
+    def perform_job(self, job, queue):
+        refresh_db_connections()
+        try:
+            return super().perform_job(job, queue)
+        finally:
+            refresh_db_connections()
+
+
+def refresh_db_connections():
+    """Keep healthy connections open across jobs, drop the ones a job broke or left in a failed state."""
+    for connection in connections.all(initialized_only=True):
+        if connection.connection is None:
+            continue
+        if connection.errors_occurred or not connection.get_autocommit() or not connection.is_usable():
+            connection.close()
+
+
+class PreforkWorkerPool(WorkerPool):
+    """rq's WorkerPool, with the application imported once before the workers are forked."""
+
+    def __init__(self, queues, connection, num_workers=1, preload=None, **kwargs):
+        kwargs.setdefault('worker_class', PreforkedWorker)
+        super().__init__(queues, connection, num_workers=num_workers, **kwargs)
+        self.preload = settings.RQ_PREFORK_PRELOAD if preload is None else preload
+
+    def start(self, burst=False, logging_level="INFO"):
+        for module in self.preload:
+            importlib.import_module(module)
+        # Children must not share the parent's sockets; each opens its own after the fork
+        connections.close_all()
+        super().start(burst=burst, logging_level=logging_level)
+
+    def get_worker_process(self, name, burst, _sleep=0, logging_level="INFO"):
+        return Process(
+            target=run_preforked_worker,
+            args=(name, self._queue_names, self._connection_class, self._pool_class, self._pool_kwargs),
+            kwargs={
+                '_sleep': _sleep,
+                'burst': burst,
+                'logging_level': logging_level,
+                'worker_class': self.worker_class,
+                'job_class': self.job_class,
+                'serializer': self.serializer,
+            },
+            name=f'Worker {name} (PreforkWorkerPool {self.name})',
+        )
+
+
+def run_preforked_worker(*args, **kwargs):
+    from videostore.gcs import get_gcs_client
+    get_gcs_client()
+    run_worker(*args, **kwargs)
@@ -28,7 +28,7 @@ from .views import ContactView
 
 from users.views import UserLoginView, UserCreateView, UserResetPasswordView, ValidateResetTokenView, user_update_username
 from profiles.views import ProfileViewSet
-from videostore.views import get_poster_and_text, get_preview_video, get_full_video, create_gcs_myFilms, get_myFilms
+from videostore.views import get_poster_and_text, get_preview_video, get_full_video, create_gcs_myFilms, get_myFilms, get_video_progress, VideoCatalogView
 
 
 def home_view(response):
@@ -56,8 +56,10 @@ api_patterns = [
     path('password_reset/confirm/<str:uidb64>/<str:token>/', UserResetPasswordView.as_view(), name='password_reset_confirm'),
     
     path('video/info/', get_poster_and_text, name='video_info'),
+    path('video/catalog/', VideoCatalogView.as_view(), name='video_catalog'),
     path('video/playlist/', get_myFilms, name='get_myFilms'),
     path('video/preview/', get_preview_video, name='get_preview_video'),
+    path('video/progress/<int:video_id>/', get_video_progress, name='video_progress'),
 
     path('', include(router.urls)),
 ]
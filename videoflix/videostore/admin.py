@@ -1,8 +1,41 @@
+import redis
 from django.contrib import admin
-from .models import Video
+from .models import Video, VideoConversion
+from .progress import get_progress_many
 
 
 class VideoAdmin(admin.ModelAdmin):
-    list_display = ('id', 'title','category','video_file','video_duration', 'description','age', 'resolution','release_date','created_at','hls_playlist')
+    list_display = ('id', 'title','category','video_file','video_duration', 'description','age', 'resolution','release_date','created_at','hls_playlist', 'conversion_progress')
+
+    def get_changelist_instance(self, request):
+        changelist = super().get_changelist_instance(request)
+        videos = list(changelist.result_list)
+        # One pipelined Redis round trip for the whole page instead of one per row
+        try:
+            progress = get_progress_many([video.id for video in videos])
+        except redis.RedisError:
+            progress = {}
+        for video in videos:
+            video.transcoding_progress = progress.get(video.id, {})
+        return changelist
+
+    @admin.display(description='Transcoding')
+    def conversion_progress(self, obj):
+        renditions = getattr(obj, 'transcoding_progress', {})
+        return ', '.join(format_rendition_progress(rendition, progress) for rendition, progress in renditions.items()) or '-'
+
+
+def format_rendition_progress(rendition, progress):
+    if progress['state'] != 'running':
+        return f"{rendition}p {progress['state']}"
+    percent = f"{progress['percent']:.0f}%" if progress['percent'] is not None else '?'
+    speed = f" {progress['speed']}x" if progress['speed'] is not None else ''
+    return f"{rendition}p {percent}{speed}"
+
+
+class VideoConversionAdmin(admin.ModelAdmin):
+    list_display = ('video', 'status', 'completed_stages', 'attempts', 'job_id', 'updated_at')
+    readonly_fields = ('completed_stages', 'source_info', 'resolutions', 'job_id', 'attempts', 'error', 'updated_at')
 
 admin.site.register(Video, VideoAdmin)
+admin.site.register(VideoConversion, VideoConversionAdmin)
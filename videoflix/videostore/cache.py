@@ -0,0 +1,163 @@
+import json
+import gzip
+import time
+import hashlib
+import logging
+import brotli
+import redis
+import django_rq
+from django.conf import settings
+from redis.exceptions import LockError
+
+
+logger = logging.getLogger(__name__)
+
+
+redis_client = redis.StrictRedis(host='localhost', port=6379, db=0)
+
+
+CATALOG_CACHE_KEYS = ['poster_urls', 'my_films_subfolders']
+CATALOG_REVALIDATED_KEYS = ['gcs_video_text_data']
+
+
+def get_stale_key(cache_key):
+    return f'{cache_key}:stale'
+
+
+def make_etag(content):
+    if isinstance(content, str):
+        content = content.encode('utf-8')
+    return f'"{hashlib.blake2b(content, digest_size=16).hexdigest()}"'
+
+
+def set_cached(cache_key, value):
+    payload = json.dumps(value)
+    pipe = redis_client.pipeline()
+    pipe.setex(cache_key, settings.CATALOG_CACHE_TTL, payload)
+    pipe.set(get_stale_key(cache_key), payload)
+    pipe.execute()
+    return payload
+
+
+def get_or_rebuild(cache_key, rebuild):
+    return json.loads(get_or_rebuild_raw(cache_key, rebuild))
+
+
+def get_or_rebuild_raw(cache_key, rebuild):
+    """Return the cached JSON text for `cache_key`; only the lock holder rebuilds, others serve the last value or wait."""
+    cached = redis_client.get(cache_key)
+    if cached is not None:
+        return cached
+
+    lock = redis_client.lock(f'{cache_key}:lock', timeout=settings.CATALOG_REBUILD_LOCK_TIMEOUT)
+    if lock.acquire(blocking=False):
+        try:
+            return set_cached(cache_key, rebuild())
+        finally:
+            release_lock(lock)
+
+    stale = redis_client.get(get_stale_key(cache_key))
+    if stale is not None:
+        return stale
+    return wait_for_rebuild(cache_key, rebuild)
+
+
+def wait_for_rebuild(cache_key, rebuild):
+    deadline = time.monotonic() + settings.CATALOG_REBUILD_WAIT
+    while time.monotonic() < deadline:
+        time.sleep(0.1)
+        cached = redis_client.get(cache_key)
+        if cached is not None:
+            return cached
+    logger.error(f"Timed out waiting for {cache_key} rebuild, rebuilding in this worker")
+    return set_cached(cache_key, rebuild())
+
+
+def release_lock(lock):
+    try:
+        lock.release()
+    except LockError:
+        logger.error(f"Lock {lock.name} expired before the rebuild finished")
+
+
+def encode_variants(payload):
+    return {
+        'identity': payload,
+        'gzip': gzip.compress(payload, compresslevel=9),
+        'br': brotli.compress(payload, quality=11),
+    }
+
+
+def set_revalidated(cache_key, payload):
+    entry = encode_variants(payload)
+    entry['etag'] = make_etag(payload)
+    previous_etag, previous_last_modified = redis_client.hmget(cache_key, 'etag', 'last_modified')
+    if previous_etag is not None and previous_etag.decode() == entry['etag'] and previous_last_modified is not None:
+        entry['last_modified'] = int(previous_last_modified)
+    else:
+        entry['last_modified'] = int(time.time())
+    pipe = redis_client.pipeline()
+    pipe.hset(cache_key, mapping={**entry, 'soft_expires_at': time.time() + settings.CATALOG_CACHE_TTL})
+    pipe.expire(cache_key, settings.CATALOG_CACHE_STALE_TTL)
+    pipe.delete(f'{cache_key}:refreshing')
+    pipe.execute()
+    return entry
+
+
+def get_revalidated_validators(cache_key, refresh):
+    """Return the (etag, last_modified) of a cached entry without touching its payload."""
+    etag, last_modified, soft_expires_at = redis_client.hmget(cache_key, 'etag', 'last_modified', 'soft_expires_at')
+    if etag is None or last_modified is None:
+        return None, None
+    if float(soft_expires_at or 0) <= time.time():
+        schedule_refresh(cache_key, refresh)
+    return etag.decode(), int(last_modified)
+
+
+def get_stale_while_revalidate(cache_key, rebuild, refresh, content_encoding='identity'):
+    """Return (payload, etag, last_modified) in `content_encoding`, enqueueing one background refresh once the entry goes stale."""
+    payload, etag, last_modified, soft_expires_at = redis_client.hmget(cache_key, content_encoding, 'etag', 'last_modified', 'soft_expires_at')
+    if payload is not None and etag is not None:
+        if float(soft_expires_at or 0) <= time.time():
+            schedule_refresh(cache_key, refresh)
+        return payload, etag.decode(), int(last_modified)
+
+    lock = redis_client.lock(f'{cache_key}:lock', timeout=settings.CATALOG_REBUILD_LOCK_TIMEOUT)
+    if lock.acquire(blocking_timeout=settings.CATALOG_REBUILD_WAIT):
+        try:
+            payload, etag, last_modified = redis_client.hmget(cache_key, content_encoding, 'etag', 'last_modified')
+            if payload is not None and etag is not None:
+                return payload, etag.decode(), int(last_modified)
+            entry = set_revalidated(cache_key, rebuild())
+            return entry[content_encoding], entry['etag'], entry['last_modified']
+        finally:
+            release_lock(lock)
+    logger.error(f"Timed out waiting for {cache_key} rebuild, rebuilding in this worker")
+    payload = rebuild()
+    return encode_variants(payload)[content_encoding], make_etag(payload), int(time.time())
+
+
+def schedule_refresh(cache_key, refresh):
+    if redis_client.set(f'{cache_key}:refreshing', 1, nx=True, ex=settings.CATALOG_REBUILD_LOCK_TIMEOUT):
+        queue = django_rq.get_queue('metadata', autocommit=True)
+        queue.enqueue(refresh)
+        logger.info(f"Enqueued background refresh of {cache_key}")
+
+
+# Mark a revalidated entry stale only if it exists; a bare HSET would create a hash with no payload and no TTL
+SOFT_EXPIRE_SCRIPT = """
+if redis.call('EXISTS', KEYS[1]) == 1 then
+    return redis.call('HSET', KEYS[1], 'soft_expires_at', 0)
+end
+return 0
+"""
+
+
+def invalidate_catalog_cache():
+    pipe = redis_client.pipeline()
+    # The :stale copy of a revalidated key is left over from before it moved to a hash
+    pipe.delete(*CATALOG_CACHE_KEYS, *(get_stale_key(cache_key) for cache_key in CATALOG_REVALIDATED_KEYS))
+    for cache_key in CATALOG_REVALIDATED_KEYS:
+        pipe.eval(SOFT_EXPIRE_SCRIPT, 1, cache_key)
+    pipe.execute()
+    logger.info(f"Invalidated catalog cache keys: {', '.join(CATALOG_CACHE_KEYS + CATALOG_REVALIDATED_KEYS)}")
@@ -0,0 +1,55 @@
+import json
+import time
+import logging
+from datetime import datetime, timezone
+from django.conf import settings
+from .models import Video
+from .gcs import get_gcs_bucket
+from .serializers import VideoCatalogSerializer
+from .cache import invalidate_catalog_cache, set_revalidated
+
+
+logger = logging.getLogger(__name__)
+
+
+CATALOG_MANIFEST_SCHEMA = 1
+
+
+def get_catalog_queryset():
+    return Video.objects.exclude(video_file='').exclude(video_file__isnull=True)
+
+
+def build_catalog_entry(video):
+    return dict(VideoCatalogSerializer(video).data)
+
+
+def build_catalog_manifest():
+    videos = get_catalog_queryset().order_by('id')
+    return {
+        'schema': CATALOG_MANIFEST_SCHEMA,
+        'version': int(time.time() * 1000),
+        'generated_at': datetime.now(timezone.utc).isoformat(),
+        'videos': [build_catalog_entry(video) for video in videos],
+    }
+
+
+def rebuild_catalog_manifest():
+    manifest = build_catalog_manifest()
+    blob = get_gcs_bucket().blob(settings.CATALOG_MANIFEST_PATH)
+    blob.cache_control = 'no-cache'
+    blob.upload_from_string(json.dumps(manifest), content_type='application/json')
+    logger.info(f"Published catalog manifest version {manifest['version']} with {len(manifest['videos'])} videos")
+    invalidate_catalog_cache()
+    set_revalidated('gcs_video_text_data', json.dumps(manifest['videos']).encode('utf-8'))
+    return manifest['version']
+
+
+def load_catalog_manifest(gcs_bucket):
+    blob = gcs_bucket.get_blob(settings.CATALOG_MANIFEST_PATH)
+    if not blob:
+        return None
+    manifest = json.loads(blob.download_as_bytes())
+    if manifest.get('schema') != CATALOG_MANIFEST_SCHEMA:
+        logger.error(f"Unsupported catalog manifest schema: {manifest.get('schema')}")
+        return None
+    return manifest
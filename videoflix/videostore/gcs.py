@@ -0,0 +1,228 @@
+import os
+import time
+import base64
+import logging
+import threading
+import google_crc32c
+from dataclasses import dataclass, field
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from google.cloud import storage
+from google.cloud.storage.batch import Batch
+from google.api_core.exceptions import NotFound
+
+
+logger = logging.getLogger(__name__)
+
+
+gcs_clients = {}
+gcs_clients_lock = threading.Lock()
+
+
+def get_gcs_client():
+    """Storage client of the current process, keyed by pid because a client must not be reused across fork."""
+    pid = os.getpid()
+    client = gcs_clients.get(pid)
+    if client is None:
+        with gcs_clients_lock:
+            client = gcs_clients.get(pid)
+            if client is None:
+                client = storage.Client(credentials=settings.GS_CREDENTIALS, project=settings.GS_PROJECT_ID)
+                gcs_clients.clear()
+                gcs_clients[pid] = client
+    return client
+
+
+def get_gcs_bucket():
+    return get_gcs_client().bucket(settings.GS_BUCKET_NAME)
+
+
+@dataclass
+class FetchResult:
+    texts: dict = field(default_factory=dict)
+    missing: list = field(default_factory=list)
+    failed: dict = field(default_factory=dict)
+
+
+def fetch_blob_texts(gcs_bucket, blob_paths, max_workers=None, timeout=None):
+    """Download small text blobs with at most `max_workers` in flight, reporting missing and failed ones instead of raising."""
+    max_workers = max_workers or settings.GCS_FETCH_MAX_WORKERS
+    timeout = timeout or settings.GCS_FETCH_TIMEOUT
+    result = FetchResult()
+    blob_paths = list(dict.fromkeys(blob_paths))
+    if not blob_paths:
+        return result
+
+    def download(blob_path):
+        return gcs_bucket.blob(blob_path).download_as_text(timeout=timeout)
+
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(blob_paths))) as executor:
+        futures = {blob_path: executor.submit(download, blob_path) for blob_path in blob_paths}
+        for blob_path, future in futures.items():
+            try:
+                result.texts[blob_path] = future.result()
+            except NotFound:
+                result.missing.append(blob_path)
+            except Exception as e:
+                result.failed[blob_path] = str(e)
+
+    if result.failed:
+        logger.error(f"Failed to fetch {len(result.failed)} of {len(blob_paths)} blobs: {result.failed}")
+    return result
+
+
+@dataclass
+class UploadResult:
+    uploaded: list = field(default_factory=list)
+    failed: dict = field(default_factory=dict)
+    uploaded_bytes: int = 0
+    seconds: float = 0.0
+
+    def merge(self, other):
+        self.uploaded += [gcs_path for gcs_path in other.uploaded if gcs_path not in self.uploaded]
+        self.failed.update(other.failed)
+        for gcs_path in other.uploaded:
+            self.failed.pop(gcs_path, None)
+        self.uploaded_bytes += other.uploaded_bytes
+        self.seconds += other.seconds
+
+    def as_dict(self):
+        megabytes_per_second = self.uploaded_bytes / self.seconds / 1e6 if self.seconds else 0.0
+        return {
+            'uploaded': len(self.uploaded),
+            'failed': len(self.failed),
+            'bytes': self.uploaded_bytes,
+            'seconds': round(self.seconds, 3),
+            'megabytes_per_second': round(megabytes_per_second, 2),
+        }
+
+
+def file_crc32c(local_path):
+    checksum = google_crc32c.Checksum()
+    with open(local_path, 'rb') as local_file:
+        for chunk in iter(lambda: local_file.read(1024 * 1024), b''):
+            checksum.update(chunk)
+    return base64.b64encode(checksum.digest()).decode('ascii')
+
+
+def upload_file(gcs_bucket, local_path, gcs_path, retries=None):
+    """Upload one file, retrying with exponential backoff until GCS reports the local crc32c back."""
+    retries = settings.GCS_UPLOAD_RETRIES if retries is None else retries
+    expected_crc32c = file_crc32c(local_path)
+    for attempt in range(retries + 1):
+        try:
+            blob = gcs_bucket.blob(gcs_path)
+            blob.upload_from_filename(local_path, checksum='crc32c', timeout=settings.GCS_UPLOAD_TIMEOUT)
+            if blob.crc32c == expected_crc32c:
+                return
+            error = f"crc32c mismatch: local {expected_crc32c}, remote {blob.crc32c}"
+        except Exception as e:
+            error = str(e)
+        if attempt < retries:
+            delay = settings.GCS_UPLOAD_BACKOFF * 2 ** attempt
+            logger.warning(f"Upload of {gcs_path} failed ({error}), retrying in {delay:.1f}s")
+            time.sleep(delay)
+    raise IOError(f"Upload of {local_path} to {gcs_path} failed after {retries + 1} attempts: {error}")
+
+
+def upload_files(uploads, max_workers=None, gcs_bucket=None):
+    """Upload `(local_path, gcs_path)` pairs concurrently, collecting failures in the result instead of raising."""
+    max_workers = max_workers or settings.GCS_UPLOAD_MAX_WORKERS
+    gcs_bucket = gcs_bucket or get_gcs_bucket()
+    result = UploadResult()
+    if not uploads:
+        return result
+
+    start = time.monotonic()
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(uploads))) as executor:
+        futures = {gcs_path: (local_path, executor.submit(upload_file, gcs_bucket, local_path, gcs_path)) for local_path, gcs_path in uploads}
+        for gcs_path, (local_path, future) in futures.items():
+            try:
+                future.result()
+                result.uploaded.append(gcs_path)
+                result.uploaded_bytes += os.path.getsize(local_path)
+            except Exception as e:
+                result.failed[gcs_path] = str(e)
+    result.seconds = time.monotonic() - start
+
+    if result.failed:
+        logger.error(f"Failed to upload {len(result.failed)} of {len(uploads)} files: {result.failed}")
+    return result
+
+
+@dataclass
+class DeleteResult:
+    deleted: list = field(default_factory=list)
+    failed: dict = field(default_factory=dict)
+    requests: int = 0
+    seconds: float = 0.0
+
+    def as_dict(self):
+        return {
+            'deleted': len(self.deleted),
+            'failed': len(self.failed),
+            'requests': self.requests,
+            'seconds': round(self.seconds, 3),
+        }
+
+
+class RecordingBatch(Batch):
+    """A storage Batch that keeps the per-request responses returned by finish()."""
+    responses = ()
+
+    def finish(self, raise_exception=True):
+        self.responses = super().finish(raise_exception=raise_exception)
+        return self.responses
+
+
+def delete_blobs(blob_names, gcs_client=None, batch_size=None, retries=None, on_progress=None):
+    """Delete blobs in batches of `batch_size`, retrying failed deletes and reporting what is left instead of raising."""
+    gcs_client = gcs_client or get_gcs_client()
+    batch_size = batch_size or settings.GCS_DELETE_BATCH_SIZE
+    retries = settings.GCS_DELETE_RETRIES if retries is None else retries
+    gcs_bucket = gcs_client.bucket(settings.GS_BUCKET_NAME)
+    result = DeleteResult()
+    pending = list(dict.fromkeys(blob_names))
+    total = len(pending)
+
+    start = time.monotonic()
+    for attempt in range(retries + 1):
+        failed = {}
+        for offset in range(0, len(pending), batch_size):
+            chunk = pending[offset:offset + batch_size]
+            chunk_failed = delete_blob_batch(gcs_client, gcs_bucket, chunk)
+            result.requests += 1
+            failed.update(chunk_failed)
+            result.deleted += [blob_name for blob_name in chunk if blob_name not in chunk_failed]
+            if on_progress is not None:
+                on_progress(result, total)
+        pending = list(failed)
+        result.failed = failed
+        if not pending:
+            break
+        if attempt < retries:
+            delay = settings.GCS_DELETE_BACKOFF * 2 ** attempt
+            logger.warning(f"{len(pending)} deletes failed, retrying in {delay:.1f}s")
+            time.sleep(delay)
+    result.seconds = time.monotonic() - start
+
+    if result.failed:
+        logger.error(f"Failed to delete {len(result.failed)} of {total} blobs: {result.failed}")
+    return result
+
+
+def delete_blob_batch(gcs_client, gcs_bucket, blob_names):
+    """Send one batch request; return {blob_name: error} for the deletes that did not succeed."""
+    try:
+        batch = RecordingBatch(gcs_client, raise_exception=False)
+        with batch:
+            for blob_name in blob_names:
+                gcs_bucket.blob(blob_name).delete()
+    except Exception as e:
+        return {blob_name: str(e) for blob_name in blob_names}
+    failed = {}
+    for blob_name, response in zip(blob_names, batch.responses):
+        # 404 means a previous attempt or another purge already removed it
+        if not 200 <= response.status_code < 300 and response.status_code != 404:
+            failed[blob_name] = f"HTTP {response.status_code}"
+    return failed
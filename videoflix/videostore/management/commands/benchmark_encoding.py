@@ -0,0 +1,95 @@
+import os
+import re
+import time
+import tempfile
+import subprocess
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from videostore.tasks import BITRATES, get_encoding_profile, build_encoder_options, build_video_encoder_options
+
+try:
+    import resource
+except ImportError:  # Windows workers have no rusage; CPU time is reported as n/a there
+    resource = None
+
+
+RESOLUTION_SIZES = {'360': '640x360', '480': '854x480', '720': '1280x720', '1080': '1920x1080'}
+
+
+class Command(BaseCommand):
+    help = "Encode a synthetic lavfi test source under each HLS encoding profile and compare speed, size and quality"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--profiles', nargs='+', default=None, help="Profiles from HLS_ENCODING_PROFILES (default: all)")
+        parser.add_argument('--resolution', default='720', choices=sorted(BITRATES, key=int))
+        parser.add_argument('--duration', type=int, default=10, help="Seconds of test source")
+        parser.add_argument('--fps', type=float, default=30)
+
+    def handle(self, *args, **options):
+        profile_names = options['profiles'] or list(settings.HLS_ENCODING_PROFILES)
+        resolution = options['resolution']
+        quality_filter = 'libvmaf' if has_filter('libvmaf') else 'psnr'
+
+        with tempfile.TemporaryDirectory() as work_directory:
+            reference = os.path.join(work_directory, 'reference.mkv')
+            create_reference(reference, RESOLUTION_SIZES[resolution], options['fps'], options['duration'])
+            self.stdout.write(f"Source: testsrc2 {RESOLUTION_SIZES[resolution]} @ {options['fps']} fps, {options['duration']}s")
+            self.stdout.write(f"{'profile':<12}{'wall s':>9}{'cpu s':>9}{'size kB':>10}{'kbit/s':>9}{quality_filter:>10}")
+
+            for profile_name in profile_names:
+                output = os.path.join(work_directory, f'{profile_name}.mp4')
+                wall_seconds, cpu_seconds = encode(reference, output, resolution, options['fps'], get_encoding_profile(profile_name))
+                size = os.path.getsize(output)
+                quality = measure_quality(output, reference, quality_filter)
+                self.stdout.write(
+                    f"{profile_name:<12}{wall_seconds:>9.2f}{format_optional(cpu_seconds):>9}{size / 1000:>10.0f}"
+                    f"{size * 8 / options['duration'] / 1000:>9.0f}{format_optional(quality):>10}"
+                )
+
+
+def has_filter(name):
+    result = subprocess.run(['ffmpeg', '-hide_banner', '-filters'], capture_output=True, text=True)
+    return re.search(rf'\s{name}\s', result.stdout) is not None
+
+
+def create_reference(reference, size, fps, duration):
+    cmd = [
+        'ffmpeg', '-y', '-v', 'error',
+        '-f', 'lavfi', '-i', f'testsrc2=size={size}:rate={fps}:duration={duration}',
+        '-c:v', 'libx264', '-preset', 'ultrafast', '-qp', '0', reference,
+    ]
+    subprocess.run(cmd, check=True)
+
+
+def get_children_cpu_seconds():
+    if resource is None:
+        return None
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+
+def encode(reference, output, resolution, fps, profile):
+    cmd = [
+        'ffmpeg', '-y', '-v', 'error', '-i', reference,
+        *build_encoder_options(fps, profile),
+        *build_video_encoder_options(resolution, profile),
+        output,
+    ]
+    cpu_before = get_children_cpu_seconds()
+    start = time.perf_counter()
+    subprocess.run(cmd, check=True)
+    wall_seconds = time.perf_counter() - start
+    cpu_after = get_children_cpu_seconds()
+    return wall_seconds, None if cpu_before is None else cpu_after - cpu_before
+
+
+def measure_quality(output, reference, quality_filter):
+    cmd = ['ffmpeg', '-hide_banner', '-i', output, '-i', reference, '-lavfi', quality_filter, '-f', 'null', '-']
+    result = subprocess.run(cmd, capture_output=True, text=True)
+    pattern = r'VMAF score[:=]\s*([\d.]+)' if quality_filter == 'libvmaf' else r'PSNR .*average:([\d.]+|inf)'
+    match = re.search(pattern, result.stderr)
+    return float(match.group(1)) if match else None
+
+
+def format_optional(value):
+    return f'{value:.2f}' if value is not None else 'n/a'
@@ -0,0 +1,35 @@
+import time
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from videostore.views import build_poster_index, get_poster_url
+
+
+class Command(BaseCommand):
+    help = "Compare the old substring poster scan with the exact poster index on a synthetic catalog"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--titles', type=int, default=10000)
+
+    def handle(self, *args, **options):
+        titles = options['titles']
+        subfolders = [f'video{i}' for i in range(titles)]
+        expected = [f'https://storage.googleapis.com/{settings.GS_BUCKET_NAME}/video-posters/{subfolder}.jpg' for subfolder in subfolders]
+        # Reverse name order puts "video10.jpg" ahead of "video1.jpg", exposing substring collisions
+        poster_urls = sorted(expected, reverse=True)
+
+        start = time.perf_counter()
+        scanned = [next((url for url in poster_urls if subfolder in url), None) for subfolder in subfolders]
+        scan_seconds = time.perf_counter() - start
+
+        start = time.perf_counter()
+        poster_index = build_poster_index(poster_urls)
+        indexed = [get_poster_url(subfolder, poster_index) for subfolder in subfolders]
+        index_seconds = time.perf_counter() - start
+
+        self.stdout.write(f"Titles: {titles}")
+        self.stdout.write(f"Substring scan: {scan_seconds:.3f}s ({count_wrong(scanned, expected)} wrong posters)")
+        self.stdout.write(f"Exact index:    {index_seconds:.3f}s ({count_wrong(indexed, expected)} wrong posters)")
+
+
+def count_wrong(urls, expected):
+    return sum(1 for url, expected_url in zip(urls, expected) if url != expected_url)
@@ -0,0 +1,47 @@
+import time
+import django_rq
+from django.core.management.base import BaseCommand
+from rq import Queue, Worker
+from videoflix.simpleworker import SimpleWorker, PreforkWorkerPool
+from videostore.gcs import get_gcs_client
+from videostore.models import Video
+
+
+BENCHMARK_QUEUE = 'benchmark'
+
+
+def benchmark_job():
+    """A typical light job: one query and a GCS client lookup, no actual transfer."""
+    get_gcs_client()
+    return Video.objects.count()
+
+
+class Command(BaseCommand):
+    help = "Drain the same batch of light jobs with the forking, simple and pre-forked workers and compare throughput"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--jobs', type=int, default=200)
+        parser.add_argument('--processes', type=int, default=4, help="Worker processes for the pre-forked pool")
+
+    def handle(self, *args, **options):
+        connection = django_rq.get_connection('default')
+        queue = Queue(BENCHMARK_QUEUE, connection=connection)
+        runners = {
+            'forking': lambda: Worker([queue], connection=connection).work(burst=True),
+            'simple': lambda: SimpleWorker([queue], connection=connection).work(burst=True),
+            f"prefork x{options['processes']}": lambda: PreforkWorkerPool(
+                [BENCHMARK_QUEUE], connection=connection, num_workers=options['processes']
+            ).start(burst=True),
+        }
+        self.stdout.write(f"{'worker':<14}{'jobs':>7}{'failed':>8}{'wall s':>9}{'jobs/s':>9}")
+        for name, run in runners.items():
+            queue.empty()
+            jobs = [queue.enqueue(benchmark_job) for _ in range(options['jobs'])]
+            start = time.perf_counter()
+            run()
+            wall_seconds = time.perf_counter() - start
+            failed = sum(1 for job in jobs if job.get_status(refresh=True) != 'finished')
+            self.stdout.write(
+                f"{name:<14}{len(jobs):>7}{failed:>8}{wall_seconds:>9.2f}{(len(jobs) - failed) / wall_seconds:>9.1f}"
+            )
+        queue.empty()
@@ -0,0 +1,224 @@
+import os
+import csv
+import json
+import time
+import shutil
+from datetime import timedelta
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+from videostore.models import Video, VideoConversion, get_hls_playlist_url
+from videostore.signals import enqueue_catalog_manifest_rebuild, enqueue_metadata_publish, format_duration
+from videostore.tasks import enqueue_conversion, find_converted_duplicate, get_transcode_timeout, hash_source, parse_duration, probe_source, reuse_converted_outputs
+
+
+METADATA_FIELDS = ['title', 'description', 'category', 'age', 'resolution', 'release_date']
+ACTIVE_JOB_STATUSES = ('queued', 'started', 'deferred', 'scheduled')
+
+
+class Command(BaseCommand):
+    help = "Create Video rows in bulk from a directory of .mp4 files or a JSON/CSV manifest and convert them with a concurrency cap"
+
+    def add_arguments(self, parser):
+        parser.add_argument('source', help="Directory of .mp4 files, or a .json/.csv manifest with a 'file' column plus optional " + ', '.join(METADATA_FIELDS))
+        parser.add_argument('--probe-workers', type=int, default=None, help="Parallel ffprobe calls (default: INGEST_PROBE_WORKERS)")
+        parser.add_argument('--max-concurrent', type=int, default=None, help="Conversions running at once on this node (default: INGEST_MAX_CONCURRENT_CONVERSIONS)")
+        parser.add_argument('--no-convert', action='store_true', help="Only create the rows and publish metadata, do not enqueue conversions")
+
+    def handle(self, *args, **options):
+        start = time.monotonic()
+        entries = read_entries(options['source'])
+        entries, skipped = drop_existing(entries)
+        self.stdout.write(f"{len(entries)} new titles, {skipped} already ingested")
+        if not entries:
+            return
+
+        probe_start = time.monotonic()
+        probe_workers = options['probe_workers'] or settings.INGEST_PROBE_WORKERS
+        with ThreadPoolExecutor(max_workers=min(probe_workers, len(entries))) as executor:
+            inspected = list(executor.map(inspect_source, [entry['file'] for entry in entries]))
+        probe_seconds = time.monotonic() - probe_start
+
+        videos = []
+        for entry, (source_info, content_hash) in zip(entries, inspected):
+            video = build_video(entry, source_info, content_hash)
+            try:
+                # A backfill may not have descriptions yet; they can be filled in through the admin later
+                video.full_clean(exclude=['video_file'] if video.description else ['video_file', 'description'])
+            except ValidationError as e:
+                self.stderr.write(f"Skipping {entry['file']}: {e}")
+                continue
+            if place_source(entry['file'], video.video_key) is None:
+                self.stderr.write(f"Skipping {entry['file']}: a different file named {video.video_key}.mp4 is already in media/videos")
+                continue
+            videos.append(video)
+
+        with transaction.atomic():
+            videos = Video.objects.bulk_create(videos, batch_size=500)
+        if not videos:
+            return
+        reused = [video for video in videos if reuse_duplicate(video)]
+        # bulk_create sends no post_save, so publish what the signals would have
+        for video in videos:
+            enqueue_metadata_publish(video)
+        enqueue_catalog_manifest_rebuild()
+        self.stdout.write(
+            f"Created {len(videos)} videos in {time.monotonic() - start:.1f}s, "
+            f"probed and hashed {len(entries)} sources in {probe_seconds:.1f}s ({len(entries) / probe_seconds:.1f}/s), "
+            f"{len(reused)} reuse the outputs of an identical source"
+        )
+        if options['no_convert']:
+            return
+
+        max_concurrent = options['max_concurrent'] or settings.INGEST_MAX_CONCURRENT_CONVERSIONS
+        convert_start = time.monotonic()
+        converted = [video for video in videos if video not in reused]
+        results = schedule_conversions(converted, max_concurrent, self.stdout)
+        convert_seconds = time.monotonic() - convert_start
+        source_seconds = sum(parse_duration(video.video_duration) or 0 for video in converted)
+        self.stdout.write(
+            f"Converted {results['finished']} videos, {results['failed']} failed, {results['reused']} reused, "
+            f"in {convert_seconds:.0f}s with at most {max_concurrent} at once: "
+            f"{results['finished'] / convert_seconds * 3600:.1f} videos/hour, "
+            f"{source_seconds / 3600:.1f}h of video at {source_seconds / convert_seconds:.2f}x realtime"
+        )
+
+
+def read_entries(source):
+    if os.path.isdir(source):
+        return [
+            {'file': os.path.join(source, name), 'title': os.path.splitext(name)[0]}
+            for name in sorted(os.listdir(source)) if name.lower().endswith('.mp4')
+        ]
+    if not os.path.isfile(source):
+        raise CommandError(f"{source} is neither a directory nor a manifest file")
+    with open(source, newline='', encoding='utf-8') as manifest:
+        entries = list(csv.DictReader(manifest)) if source.lower().endswith('.csv') else json.load(manifest)
+    manifest_directory = os.path.dirname(os.path.abspath(source))
+    for number, entry in enumerate(entries, start=1):
+        unknown = set(entry) - {'file', *METADATA_FIELDS}
+        if not entry.get('file') or unknown:
+            raise CommandError(f"Manifest entry {number} needs a 'file' and only {', '.join(METADATA_FIELDS)}, got {sorted(entry)}")
+        entry['file'] = os.path.join(manifest_directory, entry['file'])
+        if not entry['file'].lower().endswith('.mp4') or not os.path.isfile(entry['file']):
+            raise CommandError(f"Manifest entry {number}: {entry['file']} is not an existing .mp4 file")
+    return entries
+
+
+def get_video_name(path):
+    return os.path.splitext(os.path.basename(path))[0]
+
+
+def drop_existing(entries):
+    """Skip sources whose video name is already in the database, or repeated in the input, so a backfill can be re-run."""
+    names = {get_video_name(entry['file']) for entry in entries}
+    stored = Video.objects.filter(video_file__in=[*names, *(f'videos/{name}.mp4' for name in names), *(f'{name}.mp4' for name in names)])
+    seen = {get_video_name(name) for name in stored.values_list('video_file', flat=True)}
+    new_entries = []
+    for entry in entries:
+        video_name = get_video_name(entry['file'])
+        if video_name not in seen:
+            seen.add(video_name)
+            new_entries.append(entry)
+    return new_entries, len(entries) - len(new_entries)
+
+
+def inspect_source(source):
+    return probe_source(source), hash_source(source)
+
+
+def build_video(entry, source_info, content_hash=None):
+    video_name = get_video_name(entry['file'])
+    fields = {name: entry.get(name) or None for name in METADATA_FIELDS}
+    fields['title'] = fields['title'] or video_name
+    fields['description'] = fields['description'] or ""
+    fields['resolution'] = fields['resolution'] or ("4K" if (source_info['height'] or 0) >= 2160 else "HD")
+    return Video(
+        video_file=f'videos/{video_name}.mp4',
+        hls_playlist=get_hls_playlist_url(video_name),
+        video_duration=format_duration(source_info['duration']) if source_info['duration'] else None,
+        content_hash=content_hash,
+        **fields,
+    )
+
+
+def place_source(source_path, video_name):
+    """Hard-link (or copy, across filesystems) the source to media/videos/<name>.mp4, where convert_to_hls expects it."""
+    destination = os.path.join(settings.MEDIA_ROOT, 'videos', f'{video_name}.mp4')
+    if os.path.exists(destination):
+        return destination if os.path.samefile(source_path, destination) else None
+    os.makedirs(os.path.dirname(destination), exist_ok=True)
+    try:
+        os.link(source_path, destination)
+    except OSError:
+        shutil.copy2(source_path, destination)
+    return destination
+
+
+def reuse_duplicate(video):
+    original = find_converted_duplicate(video)
+    if original is None:
+        return False
+    reuse_converted_outputs(video, original)
+    return True
+
+
+def count_other_running_conversions(own_video_ids):
+    # Conversions started elsewhere (e.g. admin uploads) share the node; rows left "running" by a dead worker stop counting after the timeout
+    since = timezone.now() - timedelta(seconds=settings.HLS_CONVERSION_TIMEOUT)
+    return VideoConversion.objects.filter(status="running", updated_at__gte=since).exclude(video_id__in=own_video_ids).count()
+
+
+def get_conversion_state(video_id, job, started_at, timeout):
+    """Whether a conversion this command enqueued is "finished", "failed" or still "running"."""
+    status = VideoConversion.objects.filter(video_id=video_id).values_list('status', flat=True).first()
+    if status == "finished":
+        return "finished"
+    job_status = job.get_status(refresh=True)
+    if job_status in ACTIVE_JOB_STATUSES:
+        return "running"
+    if status == "failed" or job_status in ('failed', 'canceled', 'stopped'):
+        return "failed"
+    # In fan_out mode the convert job is done while rendition jobs still encode
+    if status == "running" and time.monotonic() - started_at < timeout:
+        return "running"
+    return "failed"
+
+
+def schedule_conversions(videos, max_concurrent, stdout):
+    """Feed conversions to the transcode queue, never letting more than `max_concurrent` run on the node at once."""
+    pending = list(videos)
+    in_flight = {}
+    results = {'finished': 0, 'failed': 0, 'reused': 0}
+    while pending or in_flight:
+        for video_id, (video, job, started_at) in list(in_flight.items()):
+            state = get_conversion_state(video_id, job, started_at, get_transcode_timeout(parse_duration(video.video_duration)))
+            if state != "running":
+                del in_flight[video_id]
+                results[state] += 1
+                stdout.write(f"{video.video_key}: {state} after {time.monotonic() - started_at:.0f}s")
+        busy = len(in_flight) + count_other_running_conversions(list(in_flight))
+        hashes_in_flight = {video.content_hash for video, _, _ in in_flight.values() if video.content_hash}
+        for video in list(pending):
+            if busy >= max_concurrent:
+                break
+            if video.content_hash and video.content_hash in hashes_in_flight:
+                # An identical source is converting right now; wait for it and reuse its outputs
+                continue
+            pending.remove(video)
+            if reuse_duplicate(video):
+                enqueue_metadata_publish(video)
+                results['reused'] += 1
+                stdout.write(f"{video.video_key}: reusing the outputs of {video.asset_key}")
+                continue
+            job = enqueue_conversion(video.id, video.video_key, parse_duration(video.video_duration))
+            in_flight[video.id] = (video, job, time.monotonic())
+            if video.content_hash:
+                hashes_in_flight.add(video.content_hash)
+            busy += 1
+        if pending or in_flight:
+            time.sleep(settings.INGEST_POLL_INTERVAL)
+    return results
@@ -0,0 +1,34 @@
+import os
+import django_rq
+from django.conf import settings
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+
+
+class Command(BaseCommand):
+    help = "Start an RQ worker for one of the pools in RQ_WORKER_POOLS, listening to its queues in priority order"
+
+    def add_arguments(self, parser):
+        parser.add_argument('pool', help=f"One of: {', '.join(settings.RQ_WORKER_POOLS)}")
+        parser.add_argument('--with-scheduler', action='store_true', help="Also run the RQ scheduler (needed for retries with intervals)")
+        parser.add_argument('--processes', type=int, default=None, help="Run N pre-forked worker processes under one supervisor (Unix only)")
+        parser.add_argument('--burst', action='store_true', help="Exit once the queues are empty")
+        parser.add_argument('--worker-class', default=None, help="Dotted path of the RQ worker class, e.g. videoflix.simpleworker.SimpleWorker on Windows")
+
+    def handle(self, *args, **options):
+        queues = settings.RQ_WORKER_POOLS.get(options['pool'])
+        if queues is None:
+            raise CommandError(f"Unknown worker pool {options['pool']!r}, expected one of: {', '.join(settings.RQ_WORKER_POOLS)}")
+        if options['processes'] is None:
+            self.stdout.write(f"Starting {options['pool']} worker on queues: {', '.join(queues)}")
+            worker_options = {'worker_class': options['worker_class']} if options['worker_class'] else {}
+            call_command('rqworker', *queues, with_scheduler=options['with_scheduler'], burst=options['burst'], **worker_options)
+            return
+        if options['worker_class']:
+            raise CommandError("--worker-class cannot be combined with --processes, which always runs pre-forked workers")
+        if not hasattr(os, 'fork'):
+            raise CommandError("--processes needs fork(); use the plain worker on this platform")
+        from videoflix.simpleworker import PreforkWorkerPool
+        self.stdout.write(f"Starting {options['processes']} pre-forked {options['pool']} workers on queues: {', '.join(queues)}")
+        pool = PreforkWorkerPool(queues, connection=django_rq.get_connection(queues[0]), num_workers=options['processes'])
+        pool.start(burst=options['burst'])
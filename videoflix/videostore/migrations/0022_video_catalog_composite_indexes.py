@@ -0,0 +1,33 @@
+# Generated by Django 5.0.6 on 2026-10-18 17:08
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('videostore', '0021_video_catalog_indexes'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='video',
+            name='video_category_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='video',
+            name='video_age_idx',
+        ),
+        migrations.AddIndex(
+            model_name='video',
+            index=models.Index(fields=['category', '-id'], name='video_category_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='video',
+            index=models.Index(fields=['category', '-release_date', '-id'], name='video_category_release_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='video',
+            index=models.Index(fields=['age', 'category'], name='video_age_category_idx'),
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 5.0.6 on 2026-10-18 17:15
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('videostore', '0022_video_catalog_composite_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='VideoConversion',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('job_id', models.CharField(blank=True, max_length=100, null=True)),
+                ('status', models.CharField(choices=[('pending', 'pending'), ('running', 'running'), ('finished', 'finished'), ('failed', 'failed')], default='pending', max_length=20)),
+                ('source_info', models.JSONField(blank=True, default=dict)),
+                ('resolutions', models.JSONField(blank=True, default=list)),
+                ('completed_stages', models.JSONField(blank=True, default=list)),
+                ('attempts', models.IntegerField(default=0)),
+                ('error', models.TextField(blank=True, default='')),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('video', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='conversion', to='videostore.video')),
+            ],
+        ),
+    ]
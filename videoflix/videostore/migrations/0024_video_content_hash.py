@@ -0,0 +1,31 @@
+# Generated by Django 5.0.6 on 2026-10-18 17:31
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('videostore', '0023_videoconversion_checkpoints'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='video',
+            name='asset_key',
+            field=models.CharField(blank=True, editable=False, max_length=100, null=True),
+        ),
+        migrations.AddField(
+            model_name='video',
+            name='content_hash',
+            field=models.CharField(blank=True, editable=False, max_length=64, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='video',
+            index=models.Index(fields=['content_hash'], name='video_content_hash_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='video',
+            index=models.Index(fields=['asset_key'], name='video_asset_key_idx'),
+        ),
+    ]
@@ -1,8 +1,9 @@
 import os
-from google.cloud import storage
+import tempfile
 from django.conf import settings
 from datetime import date
-from django.db import models
+from django.db import models, transaction
+from .gcs import upload_files
 import logging
 
 
@@ -48,68 +49,124 @@ class Video(models.Model):
     resolution = models.CharField(choices=RESOLUTION_CHOICES,max_length=20, blank=True, null=True)
     release_date = models.CharField(choices=RELEASE_CHOICES,max_length=4, blank=True, null=True)
     video_duration = models.CharField(max_length=20, blank=True, null=True)
+    content_hash = models.CharField(max_length=64, blank=True, null=True, editable=False)
+    asset_key = models.CharField(max_length=100, blank=True, null=True, editable=False)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['category', '-id'], name='video_category_id_idx'),
+            models.Index(fields=['category', '-release_date', '-id'], name='video_category_release_idx'),
+            models.Index(fields=['age', 'category'], name='video_age_category_idx'),
+            models.Index(fields=['resolution'], name='video_resolution_idx'),
+            models.Index(fields=['release_date'], name='video_release_date_idx'),
+            models.Index(fields=['content_hash'], name='video_content_hash_idx'),
+            models.Index(fields=['asset_key'], name='video_asset_key_idx'),
+        ]
+
+    @property
+    def video_key(self):
+        return os.path.splitext(os.path.basename(self.video_file.name))[0]
+
+    @property
+    def output_key(self):
+        """Name of the hls/, video-posters/ and thumbnails/ outputs; duplicates of an already converted source share the original's."""
+        return self.asset_key or self.video_key
+
+    @property
+    def poster_url(self):
+        return f"https://storage.googleapis.com/{settings.GS_BUCKET_NAME}/video-posters/{self.output_key}.jpg"
 
     def save(self, *args, **kwargs):
         if self.video_file and not self.hls_playlist:
             video_name = os.path.splitext(os.path.basename(self.video_file.name))[0]
-            gcs_url = f"https://storage.googleapis.com/{settings.GS_BUCKET_NAME}/hls/{video_name}/master.m3u8"
-            self.hls_playlist = gcs_url
+            self.hls_playlist = get_hls_playlist_url(video_name)
        
         if self.video_file:
             self.video_file.name = os.path.basename(self.video_file.name)
     
         super().save(*args, **kwargs)
 
-        if self.video_file:
-            self.upload_text_to_gcs()
-
-
-def upload_text_to_gcs(self):
-    gcs_client = create_gcs_client()
-    gcs_bucket = gcs_client.bucket(settings.GS_BUCKET_NAME)
-    gcs_base_path = get_gcs_base_path(self.video_file.name)
-    self.video_duration = self.get_video_duration_if_needed() 
+    def get_text_metadata(self):
+        return {
+            'hlsPlaylist.txt': self.hls_playlist or "",
+            'title.txt': self.title or "",
+            'description.txt': self.description or "",
+            'category.txt': self.category or "",
+            'age.txt': self.age or "0",
+            'resolution.txt': self.resolution or "HD",
+            'release_date.txt': self.release_date or "2020",
+            'video_duration.txt': self.video_duration or "00:00:00",
+            'asset_key.txt': self.output_key,
+        }
+
+    def upload_text_to_gcs(self):
+        """Publish the text/<video>/ metadata blobs concurrently over the worker's shared client. Runs in a job, never on the admin request."""
+        gcs_base_path = get_gcs_base_path(self.video_file.name)
+        with tempfile.TemporaryDirectory() as text_dir:
+            uploads = []
+            for filename, content in self.get_text_metadata().items():
+                local_path = os.path.join(text_dir, filename)
+                with open(local_path, 'w', encoding='utf-8') as text_file:
+                    text_file.write(content)
+                uploads.append((local_path, gcs_base_path + filename))
+            result = upload_files(uploads)
+        if result.failed:
+            raise IOError(f"Could not publish text metadata of video id {self.id}: {sorted(result.failed)}")
+        logger.debug(f"Published {len(result.uploaded)} text blobs of video id {self.id}")
+
+    def __str__(self):
+        return self.title
+
+
+CONVERSION_STATUS_CHOICES = [
+    ("pending", "pending"),
+    ("running", "running"),
+    ("finished", "finished"),
+    ("failed", "failed"),
+]
 
-    paths_and_contents = {
-        'hlsPlaylist.txt': self.hls_playlist or "",
-        'title.txt': self.title or "",
-        'description.txt': self.description or "",
-        'category.txt': self.category or "",
-        'age.txt': self.age or "0",
-        'resolution.txt': self.resolution or "HD",
-        'release_date.txt': self.release_date or "2020",
-        'video_duration.txt': self.video_duration or "00:00:00"
-    }
-    upload_files_to_gcs(gcs_bucket, gcs_base_path, paths_and_contents)
 
+class VideoConversion(models.Model):
+    """Checkpoints ("probe", "poster", "encode:<res>", "upload:<res>", "master") so a retried conversion skips finished stages."""
+    video = models.OneToOneField(Video, on_delete=models.CASCADE, related_name='conversion')
+    job_id = models.CharField(max_length=100, blank=True, null=True)
+    status = models.CharField(choices=CONVERSION_STATUS_CHOICES, max_length=20, default="pending")
+    source_info = models.JSONField(default=dict, blank=True)
+    resolutions = models.JSONField(default=list, blank=True)
+    completed_stages = models.JSONField(default=list, blank=True)
+    attempts = models.IntegerField(default=0)
+    error = models.TextField(blank=True, default="")
+    updated_at = models.DateTimeField(auto_now=True)
 
-def create_gcs_client():  
-    return storage.Client(credentials=settings.GS_CREDENTIALS, project=settings.GS_PROJECT_ID)
+    def is_done(self, stage):
+        return stage in self.completed_stages
 
+    def mark_done(self, stage, **fields):
+        # Rendition jobs run in parallel, so append under a row lock instead of saving a stale list
+        with transaction.atomic():
+            conversion = VideoConversion.objects.select_for_update().get(pk=self.pk)
+            if stage not in conversion.completed_stages:
+                conversion.completed_stages.append(stage)
+            for name, value in fields.items():
+                setattr(conversion, name, value)
+            conversion.save(update_fields=['completed_stages', 'updated_at', *fields])
+        self.completed_stages = conversion.completed_stages
+        for name, value in fields.items():
+            setattr(self, name, value)
 
-def get_gcs_base_path(video_file_name):
-    video_name = os.path.splitext(os.path.basename(video_file_name))[0]
-    return f"text/{video_name}/"
+    def set_status(self, status, error=""):
+        self.status = status
+        self.error = error
+        self.save(update_fields=['status', 'error', 'updated_at'])
 
+    def __str__(self):
+        return f"{self.video_id}: {self.status}"
 
-def get_video_duration_if_needed(self):
-    if not self.video_duration:
-        from .signals import get_video_duration
-        return get_video_duration(self)
-    return self.video_duration
 
+def get_hls_playlist_url(video_name):
+    return f"https://storage.googleapis.com/{settings.GS_BUCKET_NAME}/hls/{video_name}/master.m3u8"
 
-def upload_files_to_gcs(gcs_bucket, gcs_base_path, paths_and_contents):
-    for filename, content in paths_and_contents.items():
-        gcs_path = os.path.join(gcs_base_path, filename)
-        _upload_to_gcs(gcs_bucket, gcs_path, content)
 
-
-def _upload_to_gcs(gcs_bucket, gcs_path, content):
-    blob = gcs_bucket.blob(gcs_path)
-    print(f"Uploading to GCS path: {gcs_path} with content: {content}")
-    blob.upload_from_string(content)
-
-
-def __str__(self):
-        return self.title
\ No newline at end of file
+def get_gcs_base_path(video_file_name):
+    video_name = os.path.splitext(os.path.basename(video_file_name))[0]
+    return f"text/{video_name}/"
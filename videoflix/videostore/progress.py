@@ -0,0 +1,104 @@
+import json
+import time
+import logging
+import threading
+import subprocess
+from collections import deque
+from django.conf import settings
+from .cache import redis_client
+
+
+logger = logging.getLogger(__name__)
+
+
+def get_progress_key(video_id):
+    return f'video_progress:{video_id}'
+
+
+def parse_speed(speed):
+    try:
+        return float(speed.rstrip('x'))
+    except (AttributeError, ValueError):
+        return None
+
+
+def summarize_progress(block, duration=None):
+    """Turn one `-progress` block (key=value pairs up to `progress=`) into percent, fps and speed."""
+    out_time_us = block.get('out_time_us') or block.get('out_time_ms')
+    try:
+        out_time = int(out_time_us) / 1e6
+    except (TypeError, ValueError):
+        out_time = None
+    percent = None
+    if block.get('progress') == 'end':
+        percent = 100.0
+    elif out_time is not None and duration:
+        percent = round(max(0.0, min(100.0, out_time / duration * 100)), 1)
+    try:
+        fps = float(block.get('fps'))
+    except (TypeError, ValueError):
+        fps = None
+    return {
+        'state': 'finished' if block.get('progress') == 'end' else 'running',
+        'percent': percent,
+        'fps': fps,
+        'speed': parse_speed(block.get('speed')),
+        'out_time': out_time,
+        'updated_at': time.time(),
+    }
+
+
+def publish_progress(video_id, renditions, progress):
+    payload = json.dumps(progress)
+    progress_key = get_progress_key(video_id)
+    try:
+        pipe = redis_client.pipeline()
+        pipe.hset(progress_key, mapping={rendition: payload for rendition in renditions})
+        pipe.expire(progress_key, settings.HLS_PROGRESS_TTL)
+        pipe.execute()
+    except Exception as e:
+        # Progress is informational; a Redis hiccup must not fail the encode
+        logger.error(f"Could not publish progress of video id {video_id}: {e}")
+
+
+def decode_progress(progress):
+    return {rendition.decode(): json.loads(payload) for rendition, payload in sorted(progress.items())}
+
+
+def get_progress(video_id):
+    return decode_progress(redis_client.hgetall(get_progress_key(video_id)))
+
+
+def get_progress_many(video_ids):
+    pipe = redis_client.pipeline(transaction=False)
+    for video_id in video_ids:
+        pipe.hgetall(get_progress_key(video_id))
+    return {video_id: decode_progress(progress) for video_id, progress in zip(video_ids, pipe.execute())}
+
+
+def run_ffmpeg(cmd, video_id, renditions, duration=None):
+    """Run an ffmpeg command, publishing its `-progress` output to Redis per rendition; returns (returncode, stderr_tail)."""
+    cmd = [cmd[0], '-progress', 'pipe:1', '-nostats', *cmd[1:]]
+    process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True, bufsize=1)
+    stderr_tail = deque(maxlen=settings.FFMPEG_STDERR_LINES)
+    stderr_reader = threading.Thread(target=stderr_tail.extend, args=(process.stderr,), daemon=True)
+    stderr_reader.start()
+
+    block = {}
+    try:
+        for line in process.stdout:
+            key, _, value = line.strip().partition('=')
+            block[key] = value
+            if key == 'progress':
+                publish_progress(video_id, renditions, summarize_progress(block, duration))
+                block = {}
+        returncode = process.wait()
+    except BaseException:
+        # A job timeout or shutdown interrupts us here; do not leave ffmpeg running without its job
+        process.kill()
+        process.wait()
+        raise
+    stderr_reader.join()
+    if returncode != 0:
+        publish_progress(video_id, renditions, {'state': 'failed', 'percent': None, 'fps': None, 'speed': None, 'out_time': None, 'updated_at': time.time()})
+    return returncode, ''.join(stderr_tail)
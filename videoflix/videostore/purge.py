@@ -0,0 +1,90 @@
+import os
+import shutil
+import logging
+from django.conf import settings
+from rq import get_current_job
+from .gcs import get_gcs_client, delete_blobs
+from .models import Video
+
+
+logger = logging.getLogger(__name__)
+
+
+# Outputs of the conversion, possibly shared by videos with the same source, and per-title folders
+OUTPUT_PREFIXES = ['hls/{}/', 'thumbnails/{}/']
+TITLE_PREFIXES = ['text/{}/', 'myFilms/{}/']
+
+
+def list_prefixes(gcs_client, prefixes, key):
+    blob_names = []
+    for prefix in prefixes:
+        blobs = gcs_client.list_blobs(settings.GS_BUCKET_NAME, prefix=prefix.format(key), fields='items(name),nextPageToken')
+        blob_names += [blob.name for blob in blobs]
+    return blob_names
+
+
+def list_video_blob_names(gcs_client, base_path, asset_key=None):
+    """Every blob that belongs to one video: text metadata and myFilms folder, plus its HLS output, thumbnails and poster unless shared."""
+    asset_key = asset_key or base_path
+    blob_names = list_prefixes(gcs_client, TITLE_PREFIXES, base_path)
+    if is_shared_asset(asset_key):
+        print(f"Keeping the outputs of {asset_key}, other videos still use them")
+        return blob_names
+    return [f'video-posters/{asset_key}.jpg', *list_prefixes(gcs_client, OUTPUT_PREFIXES, asset_key), *blob_names]
+
+
+def is_shared_asset(asset_key):
+    # Checked when the job runs, after the deleted row is gone, so any remaining match is another user of the outputs
+    return Video.objects.filter(asset_key=asset_key).exists()
+
+
+def purge_video(base_path, video_path=None, asset_key=None):
+    """Delete the GCS assets and local files of a deleted video, recording progress in job.meta['purge']."""
+    job = get_current_job()
+    gcs_client = get_gcs_client()
+    blob_names = list_video_blob_names(gcs_client, base_path, asset_key)
+    print(f"Purging {len(blob_names)} blobs of {base_path}")
+
+    def record_progress(result, total):
+        if job is not None:
+            job.meta['purge'] = {'total': total, **result.as_dict()}
+            job.save_meta()
+
+    result = delete_blobs(blob_names, gcs_client=gcs_client, on_progress=record_progress)
+    delete_local_files(base_path, video_path)
+    print(f"Purged {base_path}: {result.as_dict()}")
+    if result.failed:
+        raise IOError(f"Could not delete {len(result.failed)} blobs of {base_path}: {result.failed}")
+    return result.as_dict()
+
+
+def delete_local_files(base_path, video_path=None):
+    delete_local_poster_files(base_path)
+    if not video_path:
+        return
+    video_dir = os.path.join(os.path.dirname(video_path), base_path)
+    if os.path.isfile(video_path):
+        try:
+            os.remove(video_path)
+            logger.info(f"Deleted video file: {video_path}")
+        except Exception as e:
+            logger.error(f"Error deleting video file {video_path}: {e}")
+    if os.path.isdir(video_dir):
+        try:
+            shutil.rmtree(video_dir)
+            logger.info(f"Deleted video directory: {video_dir}")
+        except Exception as e:
+            logger.error(f"Error deleting directory {video_dir}: {e}")
+
+
+def delete_local_poster_files(video_name):
+    """Remove the poster and trickplay sprites written under MEDIA_ROOT once GCS has them."""
+    videos_dir = os.path.join(settings.MEDIA_ROOT, 'videos')
+    poster_file = os.path.join(videos_dir, 'posters', f'{video_name}.jpg')
+    thumbnails_dir = os.path.join(videos_dir, 'thumbnails', video_name)
+    try:
+        if os.path.isfile(poster_file):
+            os.remove(poster_file)
+        shutil.rmtree(thumbnails_dir, ignore_errors=True)
+    except OSError as e:
+        logger.error(f"Error deleting local poster files of {video_name}: {e}")
@@ -0,0 +1,32 @@
+from rest_framework import serializers
+
+from .models import Video
+
+
+CATALOG_DEFAULTS = {
+    'title': "",
+    'description': "",
+    'category': "",
+    'hlsPlaylistUrl': "",
+    'age': "0",
+    'resolution': "HD",
+    'release_date': "2020",
+    'video_duration': "00:00:00",
+}
+
+
+class VideoCatalogSerializer(serializers.ModelSerializer):
+    subfolder = serializers.CharField(source='video_key', read_only=True)
+    hlsPlaylistUrl = serializers.CharField(source='hls_playlist', read_only=True)
+    posterUrlGcs = serializers.CharField(source='poster_url', read_only=True)
+
+    class Meta:
+        model = Video
+        fields = ['subfolder', 'title', 'description', 'category', 'hlsPlaylistUrl', 'posterUrlGcs', 'age', 'resolution', 'release_date', 'video_duration']
+        read_only_fields = fields
+
+    def to_representation(self, instance):
+        data = super().to_representation(instance)
+        for field, default in CATALOG_DEFAULTS.items():
+            data[field] = data[field] or default
+        return data
@@ -5,8 +5,6 @@ from django.dispatch import receiver
 from django.db.models.signals import post_save, post_delete
 import django_rq
 from django.conf import settings
-from google.cloud import storage
-import shutil
 import subprocess
 import json
 from django.db import transaction
@@ -16,9 +14,37 @@ logger = logging.getLogger(__name__)
 
 
 @receiver(post_save, sender=Video)
-def video_post_save(sender, instance, created, **kwargs):
+def video_post_save(sender, instance, created, update_fields=None, **kwargs):
     if created:
         transaction.on_commit(lambda: enqueue_video_task(instance))
+    elif update_fields is None and instance.video_file:
+        # Saves with update_fields come from jobs that publish the metadata themselves
+        transaction.on_commit(lambda: enqueue_metadata_publish(instance))
+
+
+# Model fields the catalog manifest is built from; saves touching none of them leave it as it is
+CATALOG_FIELDS = {'title', 'description', 'category', 'hls_playlist', 'age', 'resolution', 'release_date', 'video_duration', 'video_file', 'asset_key'}
+CATALOG_REBUILD_JOB_ID = 'rebuild-catalog-manifest'
+
+
+@receiver(post_save, sender=Video)
+@receiver(post_delete, sender=Video)
+def video_catalog_changed(sender, instance, update_fields=None, **kwargs):
+    if update_fields is not None and not CATALOG_FIELDS.intersection(update_fields):
+        return
+    transaction.on_commit(enqueue_catalog_manifest_rebuild)
+
+
+def enqueue_catalog_manifest_rebuild():
+    queue = django_rq.get_queue('metadata', autocommit=True)
+    job = queue.fetch_job(CATALOG_REBUILD_JOB_ID)
+    if job is not None and job.get_status(refresh=False) == 'queued':
+        # The waiting rebuild reads the database when it starts, so it already covers this change
+        logger.debug("Catalog manifest rebuild already queued")
+        return
+    from .catalog import rebuild_catalog_manifest
+    queue.enqueue(rebuild_catalog_manifest, job_id=CATALOG_REBUILD_JOB_ID)
+    logger.debug("Catalog manifest rebuild enqueued")
 
 
 def enqueue_video_task(instance):
@@ -26,93 +52,47 @@ def enqueue_video_task(instance):
         logger.error(f"No video file associated with instance {instance.id}")
         return  
 
-    queue = django_rq.get_queue('default', autocommit=True)
     logger.info(f"Enqueuing video id {instance.id} for conversion")
     print(f"Enqueuing video id {instance.id} for conversion")
-    video_name, _ = os.path.splitext(os.path.basename(instance.video_file.path))   
-    get_video_duration(instance)
-    instance.save()
+    # Probing and the metadata upload happen in the job, so the admin request returns right away
+    queue = django_rq.get_queue('metadata', autocommit=True)
+    from .tasks import prepare_video, get_prepare_timeout
+    queue.enqueue(prepare_video, instance.id, job_timeout=get_prepare_timeout(get_source_size(instance)))
+    logger.debug(f"Video enqueued for probing and HLS conversion: ID {instance.id}")
 
-    from .tasks import convert_to_hls
-    queue.enqueue(convert_to_hls, instance.id, video_name=video_name)
-    logger.debug(f"Video enqueued for HLS conversion: ID {instance.id}, Name {video_name}")
 
+def get_source_size(instance):
+    try:
+        return os.path.getsize(instance.video_file.path)
+    except (OSError, ValueError):
+        return None
 
-@receiver(post_delete, sender=Video)
-def delete_django_admin_video(sender, instance, **kwargs):
-    if instance.video_file:
-        video_path = instance.video_file.path   
-        video_name = os.path.splitext(os.path.basename(video_path))[0] 
-        video_dir = os.path.join(os.path.dirname(video_path), video_name)
-        if os.path.isfile(video_path):
-            try:
-                os.remove(video_path)
-                logger.info(f"Deleted video file: {video_path}")
-            except Exception as e:
-                logger.error(f"Error deleting video file {video_path}: {e}")
-        if os.path.isdir(video_dir):
-            try:
-                shutil.rmtree(video_dir)
-                logger.info(f"Deleted video directory: {video_dir}")
-            except Exception as e:
-                logger.error(f"Error deleting directory {video_dir}: {e}")
-
-
-def delete_hls_folder(bucket, base_path):
-    hls_folder_path = f"hls/{base_path}/"
-    hls_blobs_to_delete = bucket.list_blobs(prefix=hls_folder_path)
-    for blob in hls_blobs_to_delete:
-        blob.delete()
-        logger.info(f"Deleted {blob.name} from Google Cloud Storage")
-    logger.info(f"Deleted all files in folder {hls_folder_path} from Google Cloud Storage")
-
-
-def delete_video_poster(bucket, base_path):
-    poster_path = f"video-posters/{base_path}.jpg"
-    poster_blob = bucket.blob(poster_path)
-    if poster_blob.exists():
-        poster_blob.delete()
-        logger.info(f"Deleted poster {poster_path} from Google Cloud Storage")
-    else:
-        logger.info(f"Poster {poster_path} not found in Google Cloud Storage")
-
-
-def delete_text_subfolder(bucket, base_path):
-    text_folder_path = f"text/{base_path}/"
-    text_blobs_to_delete = bucket.list_blobs(prefix=text_folder_path)
-    for blob in text_blobs_to_delete:
-        blob.delete()
-        logger.info(f"Deleted {blob.name} from Google Cloud Storage")
-    logger.info(f"Deleted all files in subfolder {text_folder_path} from Google Cloud Storage")
-
-
-def delete_myfilms_subfolder(bucket, base_path):
-    myfilms_folder_path = f"myFilms/{base_path}/"
-    myfilms_blobs_to_delete = bucket.list_blobs(prefix=myfilms_folder_path)
-    for blob in myfilms_blobs_to_delete:
-        blob.delete()
-        logger.info(f"Deleted {blob.name} from Google Cloud Storage")
-    logger.info(f"Deleted all files in subfolder {myfilms_folder_path} from Google Cloud Storage")
+
+def enqueue_metadata_publish(instance):
+    queue = django_rq.get_queue('metadata', autocommit=True)
+    from .tasks import publish_video_metadata
+    queue.enqueue(publish_video_metadata, instance.id)
+    logger.debug(f"Metadata publish enqueued for video id {instance.id}")
 
 
 @receiver(post_delete, sender=Video)
 def delete_gcs_video(sender, instance, **kwargs):
-    try:
-        logger.info(f"Connecting to Google Cloud Storage with credentials: {settings.GS_CREDENTIALS}")
-        client = storage.Client(credentials=settings.GS_CREDENTIALS)
-        bucket = client.bucket(settings.GS_BUCKET_NAME)
-        
-        _, filename = os.path.split(instance.video_file.name)
-        base_path = os.path.splitext(filename)[0]
-
-        delete_hls_folder(bucket, base_path)
-        delete_video_poster(bucket, base_path)
-        delete_text_subfolder(bucket, base_path)
-        delete_myfilms_subfolder(bucket, base_path)
-
-    except Exception as e:
-        logger.error(f"Error deleting files from Google Cloud Storage: {e}")
-        
+    if not instance.video_file:
+        return
+    base_path = os.path.splitext(os.path.basename(instance.video_file.name))[0]
+    video_path = instance.video_file.path
+    asset_key = instance.output_key
+    # Purging runs in a job so deleting (many) titles in the admin returns immediately
+    transaction.on_commit(lambda: enqueue_video_purge(base_path, video_path, asset_key))
+
+
+def enqueue_video_purge(base_path, video_path=None, asset_key=None):
+    queue = django_rq.get_queue('maintenance', autocommit=True)
+    from .purge import purge_video
+    # delete_blobs retries failed deletes itself, so the job gets no rq Retry on top
+    queue.enqueue(purge_video, base_path, video_path, asset_key, job_id=f'purge-{base_path}')
+    logger.debug(f"Purge of {base_path} enqueued")
+
 
 def get_video_duration(video):
     video_path = video.video_file.path
@@ -173,5 +153,5 @@ def format_duration(duration):
 
 def save_video_duration(video, video_duration_str):
     video.video_duration = video_duration_str
-    video.save()
+    video.save(update_fields=['video_duration'])
     logger.info(f"Videodauer {video_duration_str} wurde im Video-Objekt gespeichert.")
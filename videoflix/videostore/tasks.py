@@ -1,10 +1,20 @@
 import os
+import hashlib
 import subprocess
 import glob
+import json
+import math
 import logging
+import threading
+import django_rq
 from django.conf import settings
-from google.cloud import storage
-from videostore.models import Video
+from rq import Retry, get_current_job
+from rq.job import Dependency, Job
+from videostore.models import Video, VideoConversion
+from videostore.gcs import UploadResult, get_gcs_bucket, upload_file, upload_files
+from videostore.cache import invalidate_catalog_cache
+from videostore.progress import run_ffmpeg
+from videostore.purge import delete_local_poster_files
 import time
 
 
@@ -14,25 +24,75 @@ logger = logging.getLogger(__name__)
 
 def upload_to_gcs(local_file_name, gcs_file_path):
     try:
-        client = storage.Client(credentials=settings.GS_CREDENTIALS, project=settings.GS_PROJECT_ID)
-        bucket = client.bucket(settings.GS_BUCKET_NAME)
-        blob = bucket.blob(gcs_file_path)       
-        blob.upload_from_filename(local_file_name)           
+        upload_file(get_gcs_bucket(), local_file_name, gcs_file_path)
         logger.info(f"Uploaded {local_file_name} to {gcs_file_path}")
+        return True
     except Exception as e:
         error_msg = f"Error uploading {local_file_name} to GCS: {e}"
         logger.error(error_msg)
+        return False
 
 
-def create_master_playlist(base_path, resolutions):
+class SegmentShipper(threading.Thread):
+    """Upload finished segments (ffmpeg's temp_file flag hides partial ones) while the encoder is still running."""
+
+    def __init__(self, video_name, output_directory, patterns):
+        super().__init__(daemon=True)
+        self.video_name = video_name
+        self.output_directory = output_directory
+        self.patterns = patterns
+        self.shipped = {}
+        self.result = UploadResult()
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.wait(settings.HLS_SEGMENT_POLL_INTERVAL):
+            self.ship_ready_segments()
+
+    def ship_ready_segments(self):
+        ready = {}
+        for pattern in self.patterns:
+            for ts_file in sorted(glob.glob(os.path.join(self.output_directory, pattern))):
+                try:
+                    modified = os.stat(ts_file).st_mtime_ns
+                except FileNotFoundError:
+                    continue
+                if self.shipped.get(ts_file) != modified:
+                    ready[f"hls/{self.video_name}/{os.path.basename(ts_file)}"] = (ts_file, modified)
+        if not ready:
+            return
+        result = upload_files([(ts_file, gcs_path) for gcs_path, (ts_file, _) in ready.items()])
+        for gcs_path in result.uploaded:
+            ts_file, modified = ready[gcs_path]
+            self.shipped[ts_file] = modified
+        self.result.merge(result)
+
+    def finish(self):
+        """Stop polling and upload whatever the encoder left behind. Returns the accumulated UploadResult."""
+        self.stopped.set()
+        self.join()
+        self.ship_ready_segments()
+        return self.result
+
+
+def start_segment_shipper(video_name, output_directory, resolutions):
+    shipper = SegmentShipper(video_name, output_directory, [f'{resolution}p_*.ts' for resolution in resolutions])
+    shipper.start()
+    return shipper
+
+
+def create_master_playlist(base_path, resolutions, source_info=None):
     master_playlist_path = os.path.join(base_path, 'master.m3u8')
     
     with open(master_playlist_path, 'w') as master_playlist:
         write_master_playlist_header(master_playlist)
         
         for resolution in resolutions:
-            bandwidth, width, height = get_bandwidth_and_resolution(resolution)
-            write_stream_info(master_playlist, resolution, bandwidth, width, height)
+            stream_info = measure_rendition(base_path, resolution, source_info)
+            if stream_info is None:
+                bandwidth, width, height = get_bandwidth_and_resolution(resolution)
+                stream_info = {'BANDWIDTH': bandwidth, 'RESOLUTION': f'{width}x{height}'}
+            write_stream_info(master_playlist, resolution, stream_info)
     
     return master_playlist_path
 
@@ -55,43 +115,394 @@ def get_bandwidth_and_resolution(resolution):
         raise ValueError(f"Unsupported resolution: {resolution}")
 
 
-def write_stream_info(master_playlist, resolution, bandwidth, width, height):
+def write_stream_info(master_playlist, resolution, stream_info):
     playlist_filename = f"{resolution}p.m3u8"
-    master_playlist.write(f"#EXT-X-STREAM-INF:BANDWIDTH={bandwidth},RESOLUTION={width}x{height}\n")
+    attributes = ','.join(f'{name}={value}' for name, value in stream_info.items())
+    master_playlist.write(f"#EXT-X-STREAM-INF:{attributes}\n")
     master_playlist.write(f"{playlist_filename}\n\n")
 
 
+def read_media_segments(playlist_path):
+    """(uri, duration, byte_length) per segment; byte_length is None unless the playlist uses EXT-X-BYTERANGE."""
+    segments = []
+    duration = None
+    byte_length = None
+    with open(playlist_path) as playlist:
+        for line in playlist:
+            line = line.strip()
+            if line.startswith('#EXTINF:'):
+                duration = float(line[len('#EXTINF:'):].split(',')[0])
+            elif line.startswith('#EXT-X-BYTERANGE:'):
+                byte_length = int(line[len('#EXT-X-BYTERANGE:'):].split('@')[0])
+            elif line and not line.startswith('#') and duration is not None:
+                segments.append((line, duration, byte_length))
+                duration = None
+                byte_length = None
+    return segments
 
-def check_video_file(video_name):
-    video_path = os.path.join(settings.MEDIA_ROOT, 'videos', f'{video_name}.mp4')
-    
-    if os.path.isfile(video_path):
-        print(f"Die Datei existiert: {video_path}")
+
+def get_segment_size(output_directory, uri, byte_length):
+    if byte_length is not None:
+        return byte_length
+    return os.path.getsize(os.path.join(output_directory, uri))
+
+
+def measure_rendition(output_directory, resolution, source_info=None):
+    """Peak and average bitrate of a finished rendition, taken from its segment files, plus codec details."""
+    playlist_path = os.path.join(output_directory, f'{resolution}p.m3u8')
+    if not os.path.exists(playlist_path):
+        return None
+    segments = read_media_segments(playlist_path)
+    if not segments:
+        return None
+    try:
+        segment_bits = [(get_segment_size(output_directory, uri, byte_length) * 8, duration) for uri, duration, byte_length in segments if duration > 0]
+    except OSError as e:
+        logger.error(f"Cannot measure {resolution}p rendition in {output_directory}: {e}")
+        return None
+    if not segment_bits:
+        return None
+    peak = max(bits / duration for bits, duration in segment_bits)
+    average = sum(bits for bits, _ in segment_bits) / sum(duration for _, duration in segment_bits)
+    stream_info = {'BANDWIDTH': int(peak), 'AVERAGE-BANDWIDTH': int(average)}
+    segment_info = probe_streams(os.path.join(output_directory, segments[0][0]))
+    video_stream = segment_info.get('video')
+    if video_stream:
+        stream_info['RESOLUTION'] = f"{video_stream['width']}x{video_stream['height']}"
+    codecs = get_codecs(segment_info)
+    if codecs:
+        stream_info['CODECS'] = f'"{codecs}"'
+    if source_info and source_info.get('fps'):
+        stream_info['FRAME-RATE'] = f"{source_info['fps']:.3f}"
+    return stream_info
+
+
+AVC_PROFILES = {'Constrained Baseline': '42e0', 'Baseline': '4200', 'Main': '4d40', 'High': '6400'}
+
+
+def get_codecs(stream_info):
+    codecs = []
+    video_stream = stream_info.get('video')
+    if video_stream and video_stream.get('codec_name') == 'h264' and video_stream.get('profile') in AVC_PROFILES:
+        codecs.append(f"avc1.{AVC_PROFILES[video_stream['profile']]}{int(video_stream['level']):02x}")
+    audio_stream = stream_info.get('audio')
+    if audio_stream and audio_stream.get('codec_name') == 'aac':
+        codecs.append('mp4a.40.2')
+    return ','.join(codecs)
+
+
+def wait_for_source_file(source):
+    """Wait until the uploaded source exists and its size stops changing, instead of sleeping blindly."""
+    deadline = time.monotonic() + settings.HLS_SOURCE_READY_TIMEOUT
+    last_size = None
+    while time.monotonic() < deadline:
+        size = os.path.getsize(source) if os.path.isfile(source) else None
+        if size and size == last_size:
+            return True
+        last_size = size
+        time.sleep(settings.HLS_SOURCE_POLL_INTERVAL)
+    print(f"Source file {source} not ready after {settings.HLS_SOURCE_READY_TIMEOUT}s")
+    return False
+
+
+def conversion_job_id(video_id, stage=None):
+    return f'convert-{video_id}' if stage is None else f'convert-{video_id}-{stage}'
+
+
+def parse_duration(duration):
+    """Seconds in an "HH:MM:SS" video_duration string, or None."""
+    try:
+        hours, minutes, seconds = duration.split(':')
+        return int(hours) * 3600 + int(minutes) * 60 + float(seconds)
+    except (AttributeError, ValueError):
+        return None
+
+
+def get_transcode_timeout(duration=None):
+    if not duration:
+        return settings.HLS_CONVERSION_TIMEOUT
+    return max(settings.HLS_CONVERSION_TIMEOUT_MIN, int(duration * settings.HLS_CONVERSION_TIMEOUT_FACTOR))
+
+
+def get_prepare_timeout(source_size=None):
+    return settings.PREPARE_TIMEOUT + int((source_size or 0) / settings.PREPARE_HASH_BYTES_PER_SECOND)
+
+
+def find_active_conversion_job(queue, video_id):
+    """A waiting or running job of this video's conversion: convert_to_hls itself, or one of its fanned-out stages."""
+    conversion = VideoConversion.objects.filter(video_id=video_id).first()
+    stages = [None, 'poster', *(conversion.resolutions if conversion else []), 'finalize']
+    job_ids = [conversion_job_id(video_id, stage) for stage in stages]
+    for job in Job.fetch_many(job_ids, connection=queue.connection):
+        if job is not None and job.get_status(refresh=False) in ('queued', 'started', 'deferred', 'scheduled'):
+            return job
+    return None
+
+
+def enqueue_conversion(video_id, video_name, duration=None):
+    """Enqueue convert_to_hls unless a job for this video is already waiting or running."""
+    queue = django_rq.get_queue('transcode', autocommit=True)
+    job = find_active_conversion_job(queue, video_id)
+    if job is not None:
+        print(f"Conversion of video id {video_id} already {job.get_status(refresh=False)} as {job.id}, not enqueuing again")
+        return job
+    return queue.enqueue(
+        convert_to_hls, video_id, video_name=video_name,
+        job_id=conversion_job_id(video_id), job_timeout=get_transcode_timeout(duration), retry=Retry(max=settings.HLS_CONVERSION_RETRIES),
+    )
+
+
+def prepare_video(video_id):
+    """Hash and probe a new upload, reuse the outputs of an identical converted source or enqueue its HLS conversion."""
+    video = get_video_instance(video_id)
+    if video is None or not video.video_file:
+        return
+    if not video.content_hash and os.path.isfile(video.video_file.path):
+        video.content_hash = hash_source(video.video_file.path)
+        video.save(update_fields=['content_hash'])
+    original = find_converted_duplicate(video)
+    if original is not None:
+        reuse_converted_outputs(video, original)
+    elif not video.video_duration:
+        from .signals import get_video_duration
+        get_video_duration(video)
+    video.upload_text_to_gcs()
+    if original is None:
+        enqueue_conversion(video.id, video.video_key, parse_duration(video.video_duration))
+
+
+def hash_source(source, chunk_size=1024 * 1024):
+    """SHA-256 of a source file, read in chunks so multi-GB uploads never sit in memory."""
+    digest = hashlib.sha256()
+    with open(source, 'rb') as source_file:
+        for chunk in iter(lambda: source_file.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def find_converted_duplicate(video):
+    if not video.content_hash:
+        return None
+    duplicates = Video.objects.filter(content_hash=video.content_hash, conversion__status="finished").exclude(pk=video.pk)
+    return duplicates.select_related('conversion').order_by('id').first()
+
+
+def reuse_converted_outputs(video, original):
+    """Point `video` at the HLS output, poster and thumbnails of an identical, already converted source."""
+    asset_key = original.output_key
+    if not original.asset_key:
+        # Mark the original as sharing its outputs, so the purge of either video keeps them while the other exists
+        original.asset_key = asset_key
+        original.save(update_fields=['asset_key'])
+    video.asset_key = asset_key
+    video.hls_playlist = original.hls_playlist
+    video.video_duration = video.video_duration or original.video_duration
+    video.save(update_fields=['asset_key', 'hls_playlist', 'video_duration'])
+    conversion = original.conversion
+    VideoConversion.objects.update_or_create(video=video, defaults={
+        'status': "finished",
+        'error': "",
+        'source_info': conversion.source_info,
+        'resolutions': conversion.resolutions,
+        'completed_stages': conversion.completed_stages,
+    })
+    print(f"Video id {video.id} has the same source as video id {original.id}, reusing the outputs of {asset_key}")
+
+
+def publish_video_metadata(video_id):
+    video = get_video_instance(video_id)
+    if video is None or not video.video_file:
+        return
+    video.upload_text_to_gcs()
+
+
+def start_conversion(video):
+    conversion, _ = VideoConversion.objects.get_or_create(video=video)
+    job = get_current_job()
+    conversion.job_id = job.id if job else None
+    conversion.attempts += 1
+    conversion.status = "running"
+    conversion.error = ""
+    conversion.save(update_fields=['job_id', 'attempts', 'status', 'error', 'updated_at'])
+    return conversion
+
+
+def get_conversion(video_id):
+    return VideoConversion.objects.get(video_id=video_id)
+
+
+def fail_conversion(conversion, error):
+    conversion.set_status("failed", error)
+    raise RuntimeError(error)
+
+
+def run_probe_stage(conversion, source):
+    if not conversion.is_done('probe'):
+        source_info = probe_source(source)
+        conversion.mark_done('probe', source_info=source_info, resolutions=select_resolutions(source_info))
+    return conversion.source_info, conversion.resolutions
+
+
+def run_poster_stage(video_id, video_name, base_path):
+    conversion = get_conversion(video_id)
+    if conversion.is_done('poster'):
+        return conversion.video.poster_url
+    poster_url = extract_and_upload_poster_for_video(video_name, base_path, conversion.source_info)
+    if poster_url:
+        conversion.mark_done('poster')
     else:
-        print(f"Die Datei existiert nicht: {video_path}")
+        print("Failed to extract and upload poster")
+    return poster_url
+
+
+def rendition_encoded(conversion, output_directory, resolution):
+    return conversion.is_done(f'encode:{resolution}') and os.path.exists(os.path.join(output_directory, f'{resolution}p.m3u8'))
+
+
+def finish_rendition_upload(conversion, video_name, output_directory, resolution, uploads):
+    """Upload the rendition playlist once all of its segments are in GCS, then checkpoint the rendition."""
+    segment_prefix = f"hls/{video_name}/{resolution}p_"
+    if any(gcs_path.startswith(segment_prefix) for gcs_path in uploads.failed):
+        return False
+    media_files = rendition_media_files(output_directory, resolution)
+    if media_files:
+        media_uploads = upload_files([(media_file, f"hls/{video_name}/{os.path.basename(media_file)}") for media_file in media_files])
+        uploads.merge(media_uploads)
+        if media_uploads.failed:
+            return False
+    if not upload_rendition_playlist(video_name, output_directory, resolution, conversion.video_id):
+        return False
+    conversion.mark_done(f'upload:{resolution}')
+    return True
 
 
 def convert_to_hls(video_id, video_name=None):
     print(f"Starting conversion for video id {video_id}")
-    time.sleep(3)
-    check_video_file(video_name)
     if video_name is None:
         video_name = str(video_id)
     base_path = os.path.join(settings.MEDIA_ROOT, 'videos', video_name)
     video = get_video_instance(video_id)
     if not video:
         return
+    conversion = start_conversion(video)
+    if not wait_for_source_file(f'{base_path}.mp4'):
+        fail_conversion(conversion, f"Source file for video id {video_id} is missing or still being written")
     output_directory = create_output_directory(base_path)
-    poster_url = extract_and_upload_poster_for_video(video_name, base_path)
-    if not poster_url:
-        print("Failed to extract and upload poster")
-    resolutions = ['360', '480', '720', '1080']
+    source_info, resolutions = run_probe_stage(conversion, f'{base_path}.mp4')
+    print(f"Source {source_info['width']}x{source_info['height']} at {source_info['fps']} fps, encoding {resolutions}")
+    if settings.HLS_ENCODE_MODE == 'fan_out':
+        enqueue_rendition_jobs(video_id, video_name, base_path, resolutions, source_info)
+        return
+    run_poster_stage(video_id, video_name, base_path)
+    pending = [resolution for resolution in resolutions if not conversion.is_done(f'upload:{resolution}')]
+    uploads = UploadResult()
+    if pending:
+        uploads = encode_and_ship(conversion, video_id, video_name, base_path, output_directory, pending, source_info)
+    incomplete = [resolution for resolution in resolutions if not conversion.is_done(f'upload:{resolution}')]
+    if incomplete:
+        fail_conversion(conversion, f"Renditions {incomplete} of video id {video_id} were not converted and uploaded")
+    publish_master_playlist(conversion, video_name, output_directory, resolutions, source_info)
+    print(f"Finished convert_to_hls function for video id {video_id}, uploads: {uploads.as_dict()}")
+    return uploads.as_dict()
+
+
+def encode_and_ship(conversion, video_id, video_name, base_path, output_directory, resolutions, source_info):
+    to_encode = [resolution for resolution in resolutions if not rendition_encoded(conversion, output_directory, resolution)]
+    shipper = start_segment_shipper(video_name, output_directory, resolutions)
+    try:
+        if to_encode and convert_all_resolutions(video_id, base_path, output_directory, to_encode, source_info):
+            for resolution in to_encode:
+                conversion.mark_done(f'encode:{resolution}')
+        elif to_encode:
+            print("Single-pass conversion failed, converting each resolution separately")
+            for resolution in to_encode:
+                if convert_to_resolution(video_id, video_name, base_path, output_directory, resolution, source_info):
+                    conversion.mark_done(f'encode:{resolution}')
+    finally:
+        uploads = shipper.finish()
     for resolution in resolutions:
-        convert_to_resolution(video_id, video_name, base_path, output_directory, resolution)
-    create_and_upload_master_playlist(video_name, output_directory, resolutions)
+        if conversion.is_done(f'encode:{resolution}'):
+            finish_rendition_upload(conversion, video_name, output_directory, resolution, uploads)
+    return uploads
+
+
+def publish_master_playlist(conversion, video_name, output_directory, resolutions, source_info):
+    if not conversion.is_done('master'):
+        create_master_playlist(output_directory, resolutions, source_info)
+        if not upload_master_playlist(video_name, output_directory):
+            fail_conversion(conversion, f"Master playlist of video id {conversion.video_id} could not be uploaded")
+        conversion.mark_done('master')
+        invalidate_catalog_cache()
+    conversion.set_status("finished")
+
+
+def enqueue_rendition_jobs(video_id, video_name, base_path, resolutions, source_info=None):
+    retry = Retry(max=settings.HLS_CONVERSION_RETRIES)
+    transcode_timeout = get_transcode_timeout((source_info or {}).get('duration'))
+    metadata_queue = django_rq.get_queue('metadata', autocommit=True)
+    transcode_queue = django_rq.get_queue('transcode', autocommit=True)
+    upload_queue = django_rq.get_queue('upload', autocommit=True)
+    # The sprite pass decodes every keyframe of the source, so the poster job needs the duration-based timeout too
+    jobs = [metadata_queue.enqueue(
+        run_poster_stage, video_id, video_name, base_path,
+        job_id=conversion_job_id(video_id, 'poster'), job_timeout=transcode_timeout, retry=retry,
+    )]
     for resolution in resolutions:
-        upload_resolution_files(video_name, output_directory, resolution, video_id)
-    print(f"Finished convert_to_hls function for video id {video_id}")
+        jobs.append(transcode_queue.enqueue(
+            encode_rendition, video_id, video_name, resolution,
+            job_id=conversion_job_id(video_id, resolution), job_timeout=transcode_timeout, retry=retry,
+        ))
+    # allow_failure: a rendition that used up its retries must still reach the finalizer, which then marks the conversion failed
+    upload_queue.enqueue(
+        finalize_hls, video_id, video_name, resolutions, source_info,
+        depends_on=Dependency(jobs=[job.id for job in jobs], allow_failure=True), job_id=conversion_job_id(video_id, 'finalize'), retry=retry,
+    )
+    print(f"Enqueued poster, {len(resolutions)} rendition jobs and finalizer for video id {video_id}")
+
+
+def encode_rendition(video_id, video_name, resolution):
+    conversion = get_conversion(video_id)
+    if conversion.is_done(f'upload:{resolution}'):
+        print(f"{resolution}p of video id {video_id} already uploaded, skipping")
+        return {'resolution': resolution, **UploadResult().as_dict()}
+    base_path = os.path.join(settings.MEDIA_ROOT, 'videos', video_name)
+    output_directory = create_output_directory(base_path)
+    shipper = start_segment_shipper(video_name, output_directory, [resolution])
+    try:
+        converted = rendition_encoded(conversion, output_directory, resolution) or convert_to_resolution(
+            video_id, video_name, base_path, output_directory, resolution, conversion.source_info)
+    finally:
+        uploads = shipper.finish()
+    if not converted:
+        raise RuntimeError(f"Conversion of video id {video_id} to {resolution}p failed")
+    conversion.mark_done(f'encode:{resolution}')
+    if not finish_rendition_upload(conversion, video_name, output_directory, resolution, uploads):
+        raise RuntimeError(f"Upload of {resolution}p for video id {video_id} failed")
+    return {'resolution': resolution, **uploads.as_dict()}
+
+
+def finalize_hls(video_id, video_name, resolutions, source_info=None):
+    output_directory = os.path.join(settings.MEDIA_ROOT, 'videos', video_name)
+    conversion = get_conversion(video_id)
+    incomplete = [resolution for resolution in resolutions if not conversion.is_done(f'upload:{resolution}')]
+    if incomplete:
+        fail_conversion(conversion, f"Renditions {incomplete} of video id {video_id} were not converted and uploaded")
+    publish_master_playlist(conversion, video_name, output_directory, resolutions, source_info)
+    uploads = collect_rendition_uploads(get_current_job())
+    print(f"Finished HLS fan-out for video id {video_id}, uploads: {uploads}")
+    return uploads
+
+
+def collect_rendition_uploads(job):
+    """Upload stats returned by the encode_rendition jobs the finalizer waited on, keyed by resolution."""
+    if job is None:
+        return {}
+    uploads = {}
+    for dependency in job.fetch_dependencies():
+        stats = dependency.return_value()
+        if isinstance(stats, dict) and 'resolution' in stats:
+            uploads[stats['resolution']] = stats
+    return uploads
 
 
 def get_video_instance(video_id):
@@ -110,101 +521,322 @@ def create_output_directory(base_path):
     return output_directory
 
 
-def extract_and_upload_poster_for_video(video_name, base_path):
+def extract_and_upload_poster_for_video(video_name, base_path, source_info=None):
     print(f"Extracting poster for video {video_name}...")
     source = f'{base_path}.mp4'
-    poster_url = extract_and_upload_poster(source, video_name)
+    poster_url = extract_and_upload_poster(source, video_name, source_info)
     if poster_url:
         print(f"Poster extracted and uploaded to {poster_url}")
     return poster_url
 
 
-def convert_to_resolution(video_id, video_name, base_path, output_directory, resolution):
+BITRATES = {'360': '800k', '480': '1400k', '720': '2800k', '1080': '5000k'}
+
+
+RESOLUTIONS = ['360', '480', '720', '1080']
+
+
+def probe_streams(video_path):
+    try:
+        result = subprocess.run(
+            ['ffprobe', '-v', 'error',
+             '-show_entries', 'stream=codec_type,codec_name,profile,level,width,height,avg_frame_rate,bit_rate:format=duration,bit_rate',
+             '-of', 'json', video_path],
+            capture_output=True, text=True
+        )
+    except OSError as e:
+        logger.error(f"Could not run ffprobe on {video_path}: {e}")
+        return {}
+    if result.returncode != 0:
+        logger.error(f"ffprobe failed for {video_path}: {result.stderr}")
+        return {}
+    probe = json.loads(result.stdout)
+    stream_info = {'format': probe.get('format', {})}
+    for stream in probe.get('streams', []):
+        stream_info.setdefault(stream.get('codec_type'), stream)
+    return stream_info
+
+
+def parse_frame_rate(frame_rate):
+    numerator, _, denominator = (frame_rate or '0/1').partition('/')
+    try:
+        return float(numerator) / float(denominator or 1)
+    except (ValueError, ZeroDivisionError):
+        return None
+
+
+def probe_source(video_path):
+    stream_info = probe_streams(video_path)
+    if not stream_info:
+        return {'width': None, 'height': None, 'fps': None, 'bit_rate': 0, 'duration': 0, 'has_audio': True}
+    video_stream = stream_info.get('video', {})
+    source_format = stream_info.get('format', {})
+    return {
+        'width': video_stream.get('width'),
+        'height': video_stream.get('height'),
+        'fps': parse_frame_rate(video_stream.get('avg_frame_rate')),
+        'bit_rate': int(source_format.get('bit_rate') or video_stream.get('bit_rate') or 0),
+        'duration': float(source_format.get('duration') or 0),
+        'has_audio': 'audio' in stream_info,
+    }
+
+
+def select_resolutions(source_info):
+    """Keep every rung whose nominal width or height the source reaches, so wide sources (e.g. 1920x800) keep 1080p."""
+    width, height = source_info.get('width'), source_info.get('height')
+    if not width or not height:
+        return list(RESOLUTIONS)
+    selected = []
+    for resolution in RESOLUTIONS:
+        _, rung_width, rung_height = get_bandwidth_and_resolution(resolution)
+        if max(width, height) >= rung_width or min(width, height) >= rung_height:
+            selected.append(resolution)
+    return selected or RESOLUTIONS[:1]
+
+
+def build_scale_filter(resolution):
+    """Fit the frame into the rung's nominal box, so a wide source is limited by width instead of upscaled to the rung height."""
+    _, width, height = get_bandwidth_and_resolution(resolution)
+    return f'scale={width}:{height}:force_original_aspect_ratio=decrease:force_divisible_by=2'
+
+
+def build_segment_options(output_directory, rendition_name):
+    """HLS muxer options: numbered .ts segments for "mpegts", one byte-range fMP4 file per rendition for "fmp4"."""
+    if settings.HLS_SEGMENT_FORMAT == 'fmp4':
+        return ['-hls_segment_type', 'fmp4', '-hls_flags', 'single_file',
+                '-hls_segment_filename', f'{output_directory}/{rendition_name}.mp4']
+    return ['-hls_flags', 'temp_file', '-hls_segment_filename', f'{output_directory}/{rendition_name}_%03d.ts']
+
+
+def rendition_media_files(output_directory, resolution):
+    """Media files uploaded after the encode instead of by the SegmentShipper."""
+    if settings.HLS_SEGMENT_FORMAT == 'fmp4':
+        return [os.path.join(output_directory, f'{resolution}p.mp4')]
+    return []
+
+
+def get_encoding_profile(name=None):
+    name = name or settings.HLS_ENCODING_PROFILE
+    if name not in settings.HLS_ENCODING_PROFILES:
+        raise ValueError(f"Unknown encoding profile: {name}")
+    return settings.HLS_ENCODING_PROFILES[name]
+
+
+def get_gop_size(fps, profile):
+    """Keyframe interval in frames, so every rendition has a keyframe each `gop_seconds` whatever the source fps."""
+    return max(1, round((fps or 24) * profile['gop_seconds']))
+
+
+def build_video_encoder_options(resolution, profile, stream_index=None):
+    """x264 options for one rendition; `stream_index` targets a single output stream of a multi-rendition encode."""
+    stream = f':v:{stream_index}' if stream_index is not None else ':v'
+    bitrate_kbps = int(BITRATES[resolution].rstrip('k'))
+    options = []
+    if profile['rate_control'] == 'crf':
+        options += [f'-crf{stream}', str(profile['crf'])]
+    elif profile['rate_control'] == 'capped_crf':
+        options += [f'-crf{stream}', str(profile['crf']), f'-maxrate{stream}', f"{int(bitrate_kbps * profile['maxrate_factor'])}k"]
+    elif profile['rate_control'] == 'vbr':
+        options += [f'-b{stream}', BITRATES[resolution], f'-maxrate{stream}', f"{int(bitrate_kbps * profile['maxrate_factor'])}k"]
+    else:
+        raise ValueError(f"Unsupported rate control mode: {profile['rate_control']}")
+    if profile['rate_control'] != 'crf':
+        options += [f'-bufsize{stream}', f"{int(bitrate_kbps * profile['bufsize_factor'])}k"]
+    return options
+
+
+def build_encoder_options(fps, profile):
+    """Options shared by every rendition: codec, preset, tune, GOP and threads."""
+    gop_size = str(get_gop_size(fps, profile))
+    options = ['-c:v', 'libx264', '-profile:v', 'main', '-preset', profile['preset']]
+    if profile.get('tune'):
+        options += ['-tune', profile['tune']]
+    options += ['-g', gop_size, '-keyint_min', gop_size, '-sc_threshold', '0']
+    if profile.get('threads'):
+        options += ['-threads', str(profile['threads'])]
+    return options
+
+
+AUDIO_OPTIONS = ['-c:a', 'aac', '-ar', '48000', '-b:a', '128k']
+
+
+def build_single_pass_command(source, output_directory, resolutions, with_audio=True, fps=None, profile=None):
+    """One decode of `source`, split by a filter graph into every resolution and written as HLS variants."""
+    profile = profile or get_encoding_profile()
+    split_outputs = ''.join(f'[v{index}]' for index in range(len(resolutions)))
+    scales = ';'.join(f'[v{index}]{build_scale_filter(resolution)}[v{index}out]' for index, resolution in enumerate(resolutions))
+    cmd = [
+        'ffmpeg', '-y',
+        '-i', source,
+        '-filter_complex', f'[0:v]split={len(resolutions)}{split_outputs};{scales}',
+    ]
+    stream_map = []
+    for index, resolution in enumerate(resolutions):
+        cmd += ['-map', f'[v{index}out]']
+        if with_audio:
+            cmd += ['-map', '0:a:0']
+        cmd += build_video_encoder_options(resolution, profile, stream_index=index)
+        stream_map.append(f'v:{index},a:{index},name:{resolution}p' if with_audio else f'v:{index},name:{resolution}p')
+    cmd += AUDIO_OPTIONS + build_encoder_options(fps, profile) + [
+        '-f', 'hls',
+        '-hls_time', '4',
+        '-hls_playlist_type', 'vod',
+        *build_segment_options(output_directory, '%v'),
+        '-var_stream_map', ' '.join(stream_map),
+        f'{output_directory}/%v.m3u8',
+    ]
+    return cmd
+
+
+def convert_all_resolutions(video_id, base_path, output_directory, resolutions, source_info):
+    source = f'{base_path}.mp4'
+    cmd = build_single_pass_command(source, output_directory, resolutions, with_audio=source_info['has_audio'], fps=source_info.get('fps'))
+    print(f"Running single-pass FFmpeg command: {' '.join(cmd)}")
+    returncode, stderr = run_ffmpeg(cmd, video_id, resolutions, source_info.get('duration'))
+    if returncode != 0:
+        print(f"Error converting video id {video_id} in a single pass: {stderr}")
+        return False
+    return True
+
+
+def convert_to_resolution(video_id, video_name, base_path, output_directory, resolution, source_info=None):
     print(f"Starting conversion to {resolution}p...")
-    
-    cmd_base = [
+    source_info = source_info or {}
+    profile = get_encoding_profile()
+    output_m3u8 = f'{output_directory}/{resolution}p.m3u8'
+    cmd = [
         'ffmpeg',
         '-i', f'{base_path}.mp4',
-        '-c:a', 'aac',
-        '-ar', '48000',
-        '-b:a', '128k',
-        '-c:v', 'h264',
-        '-profile:v', 'main',
-        '-crf', '20',
-        '-sc_threshold', '0',
-        '-g', '48',
-        '-keyint_min', '48',
+        '-vf', build_scale_filter(resolution),
+        *AUDIO_OPTIONS,
+        *build_encoder_options(source_info.get('fps'), profile),
+        *build_video_encoder_options(resolution, profile),
         '-hls_time', '4',
-        '-hls_playlist_type', 'vod'
+        '-hls_playlist_type', 'vod',
+        *build_segment_options(output_directory, f'{resolution}p'),
+        output_m3u8,
     ]
-    
-    bitrates = {'360': '800k', '480': '1400k', '720': '2800k', '1080': '5000k'}
-    scale = f'scale=-2:{resolution}'
-    bitrate = bitrates[resolution]
-    output_ts = f'{output_directory}/{resolution}p_%03d.ts'
-    output_m3u8 = f'{output_directory}/{resolution}p.m3u8'
-    cmd = cmd_base + ['-vf', scale, '-b:v', bitrate, '-hls_segment_filename', output_ts, output_m3u8]
     print(f"Running FFmpeg command for {resolution}p: {' '.join(cmd)}")
-    result = subprocess.run(cmd, capture_output=True, text=True)
-    if result.returncode != 0:
-        print(f"Error converting video id {video_id} for resolution {resolution}: {result.stderr}")
-        return
+    returncode, stderr = run_ffmpeg(cmd, video_id, [resolution], source_info.get('duration'))
+    if returncode != 0:
+        print(f"Error converting video id {video_id} for resolution {resolution}: {stderr}")
+        return False
+    return True
 
 
-def create_and_upload_master_playlist(video_name, output_directory, resolutions):
-    print("Creating master playlist...")
-    master_playlist_path = create_master_playlist(output_directory, resolutions)
+def upload_master_playlist(video_name, output_directory):
+    master_playlist_path = os.path.join(output_directory, 'master.m3u8')
     
     if os.path.exists(master_playlist_path):
         gcs_master_path = f"hls/{video_name}/master.m3u8"
         print(f"Uploading master playlist to GCS: {gcs_master_path}")
-        upload_to_gcs(master_playlist_path, gcs_master_path)
-    else:
-        print(f"Master playlist {master_playlist_path} does not exist. Skipping upload.")
+        return upload_to_gcs(master_playlist_path, gcs_master_path)
+    print(f"Master playlist {master_playlist_path} does not exist. Skipping upload.")
+    return False
 
 
-def upload_resolution_files(video_name, output_directory, resolution, video_id):
+def upload_rendition_playlist(video_name, output_directory, resolution, video_id):
     local_playlist = f"{output_directory}/{resolution}p.m3u8"
-    
     if os.path.exists(local_playlist):
         gcs_playlist_path = f"hls/{video_name}/{resolution}p.m3u8"
         print(f"Uploading {resolution}p playlist to GCS: {gcs_playlist_path}")
-        upload_to_gcs(local_playlist, gcs_playlist_path)
-        ts_files = glob.glob(f"{output_directory}/{resolution}p_*.ts")
-        for ts_file in ts_files:
-            if os.path.exists(ts_file):
-                gcs_ts_path = f"hls/{video_name}/{os.path.basename(ts_file)}"
-                print(f"Uploading TS file to GCS: {gcs_ts_path}")
-                upload_to_gcs(ts_file, gcs_ts_path)
-            else:
-                print(f"TS file {ts_file} does not exist for resolution {resolution} and video id {video_id}")
-    else:
-        print(f"Resolution {resolution} playlist {local_playlist} does not exist for video id {video_id}")
+        return upload_to_gcs(local_playlist, gcs_playlist_path)
+    print(f"Resolution {resolution} playlist {local_playlist} does not exist for video id {video_id}")
+    return False
 
 
-def extract_and_upload_poster(video_path, video_name):
+def extract_and_upload_poster(video_path, video_name, source_info=None):
+    """Grab the poster (input-seeked) and best-effort keyframe sprite sheets in one ffmpeg run and upload them together."""
     try:
+        source_info = source_info or probe_source(video_path)
         base_path = os.path.abspath(os.path.join(settings.MEDIA_ROOT, 'videos'))
         posters_dir = os.path.join(base_path, 'posters')
+        thumbnails_dir = os.path.join(base_path, 'thumbnails', video_name)
         os.makedirs(posters_dir, exist_ok=True)
+        os.makedirs(thumbnails_dir, exist_ok=True)
         local_file_name = os.path.abspath(os.path.join(posters_dir, f'{video_name}.jpg'))
-        cmd = [
-            'ffmpeg',
-            '-i', video_path,
-            '-ss', '00:00:10.000',
-            '-vframes', '1',
-            '-update', '1', 
-            local_file_name 
-        ]
+        thumbnail_size = get_thumbnail_size(source_info)
+        cmd = build_poster_and_sprite_command(video_path, local_file_name, thumbnails_dir, get_poster_time(source_info), thumbnail_size)
         result = subprocess.run(cmd, capture_output=True, text=True)
-        if result.returncode != 0:
-            error_msg = f"Error extracting poster for video {video_name}: {result.stderr}"
+        if result.returncode != 0 or not os.path.exists(local_file_name):
+            error_msg = f"Error extracting poster for video {video_name}: {result.stderr[-2000:]}"
             logger.error(error_msg)
             return None
         gcs_poster_path = f'video-posters/{video_name}.jpg'
-        upload_to_gcs(local_file_name, gcs_poster_path)        
+        uploads = [(local_file_name, gcs_poster_path)] + build_thumbnail_track(thumbnails_dir, video_name, source_info, thumbnail_size)
+        upload_result = upload_files(uploads)
+        if gcs_poster_path in upload_result.failed:
+            logger.error(f"Error uploading poster for video {video_name}: {upload_result.failed[gcs_poster_path]}")
+            return None
+        if upload_result.failed:
+            logger.warning(f"Could not upload trickplay sprites for video {video_name}: {sorted(upload_result.failed)}")
         return gcs_poster_path
     except Exception as e:
         error_msg = f"Error extracting and uploading poster for video {video_name}: {e}"
         logger.error(error_msg)
         return None
+    finally:
+        # A retry extracts everything again, so the local copies are never needed after this
+        delete_local_poster_files(video_name)
+
+
+def get_poster_time(source_info):
+    duration = source_info.get('duration')
+    if duration:
+        return min(settings.POSTER_TIME, duration / 2)
+    return settings.POSTER_TIME
+
+
+def get_thumbnail_size(source_info):
+    width = settings.THUMBNAIL_WIDTH
+    if source_info.get('width') and source_info.get('height'):
+        return width, max(2, round(width * source_info['height'] / source_info['width'] / 2) * 2)
+    return width, round(width * 9 / 16 / 2) * 2
+
+
+def build_poster_and_sprite_command(video_path, poster_file, thumbnails_dir, poster_time, thumbnail_size):
+    width, height = thumbnail_size
+    tile = f'{settings.THUMBNAIL_SPRITE_COLUMNS}x{settings.THUMBNAIL_SPRITE_ROWS}'
+    return [
+        'ffmpeg', '-y',
+        '-ss', f'{poster_time:.3f}', '-i', video_path,
+        '-skip_frame', 'nokey', '-i', video_path,
+        '-map', '0:v:0', '-frames:v', '1', '-update', '1', poster_file,
+        '-map', '1:v:0', '-vf', f'fps=1/{settings.THUMBNAIL_INTERVAL},scale={width}:{height},tile={tile}',
+        '-q:v', '5', os.path.join(thumbnails_dir, 'sprite_%03d.jpg'),
+    ]
+
+
+def format_vtt_timestamp(seconds):
+    hours, remainder = divmod(seconds, 3600)
+    minutes, seconds = divmod(remainder, 60)
+    return f'{int(hours):02d}:{int(minutes):02d}:{seconds:06.3f}'
+
+
+def build_thumbnail_vtt(sprite_names, duration, thumbnail_size):
+    width, height = thumbnail_size
+    columns = settings.THUMBNAIL_SPRITE_COLUMNS
+    per_sheet = columns * settings.THUMBNAIL_SPRITE_ROWS
+    interval = settings.THUMBNAIL_INTERVAL
+    count = min(math.ceil(duration / interval), len(sprite_names) * per_sheet)
+    cues = ['WEBVTT', '']
+    for index in range(count):
+        sheet, position = divmod(index, per_sheet)
+        row, column = divmod(position, columns)
+        start, end = index * interval, min((index + 1) * interval, duration)
+        cues.append(f'{format_vtt_timestamp(start)} --> {format_vtt_timestamp(end)}')
+        cues.append(f'{sprite_names[sheet]}#xywh={column * width},{row * height},{width},{height}')
+        cues.append('')
+    return '\n'.join(cues)
+
+
+def build_thumbnail_track(thumbnails_dir, video_name, source_info, thumbnail_size):
+    """Write thumbnails.vtt for the sprite sheets ffmpeg produced and return everything to upload."""
+    sprite_files = sorted(glob.glob(os.path.join(thumbnails_dir, 'sprite_*.jpg')))
+    if not sprite_files or not source_info.get('duration'):
+        logger.warning(f"No trickplay sprites for video {video_name}")
+        return []
+    vtt_file = os.path.join(thumbnails_dir, 'thumbnails.vtt')
+    with open(vtt_file, 'w') as vtt:
+        vtt.write(build_thumbnail_vtt([os.path.basename(sprite) for sprite in sprite_files], source_info['duration'], thumbnail_size))
+    return [(local_file, f'thumbnails/{video_name}/{os.path.basename(local_file)}') for local_file in sprite_files + [vtt_file]]
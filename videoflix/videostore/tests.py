@@ -1,135 +1,1257 @@
-from django.test import TestCase
-from unittest.mock import patch, MagicMock
+from django.conf import settings
+from django.test import RequestFactory, TestCase, override_settings
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APIClient
+from unittest.mock import patch, MagicMock, ANY, call
 from django.db.models.signals import post_save
 from django_rq import get_queue
-from videostore.models import Video
-from videostore.signals import video_post_save, enqueue_video_task
+from videostore.models import Video, VideoConversion
+from videostore.signals import video_post_save, enqueue_video_task, enqueue_catalog_manifest_rebuild
 from unittest import mock
+import os
+import json
+import time
+import gzip
+import hashlib
+import tempfile
 import pytest
-from videostore.signals import delete_hls_folder, delete_video_poster, delete_text_subfolder, delete_myfilms_subfolder, delete_gcs_video
+from videostore.signals import delete_gcs_video
+from videostore.purge import list_video_blob_names, purge_video
+from videostore.management.commands.ingest_videos import schedule_conversions
+from videostore.catalog import build_catalog_entry, load_catalog_manifest, rebuild_catalog_manifest
+from videostore.progress import get_progress_many, run_ffmpeg, summarize_progress
+from videostore.admin import VideoAdmin
+from django.contrib import admin
+from django.contrib.auth import get_user_model
+from videostore.gcs import UploadResult, delete_blobs, fetch_blob_texts, file_crc32c, gcs_clients, get_gcs_client, upload_file, upload_files
+from videostore.views import build_poster_index, create_video_data_from_texts, get_full_video, get_poster_url, select_content_encoding
+from videostore.cache import SOFT_EXPIRE_SCRIPT, invalidate_catalog_cache, get_or_rebuild, get_stale_while_revalidate, schedule_refresh, make_etag
+from videostore.tasks import get_transcode_timeout, parse_duration, build_poster_and_sprite_command, build_thumbnail_vtt, extract_and_upload_poster, build_encoder_options, build_video_encoder_options, SegmentShipper, finish_rendition_upload, build_single_pass_command, enqueue_rendition_jobs, encode_rendition, finalize_hls, run_poster_stage, enqueue_conversion, convert_to_hls, wait_for_source_file, select_resolutions, create_master_playlist, prepare_video, publish_video_metadata, hash_source
+from google.api_core.exceptions import NotFound
+from rq.timeouts import JobTimeoutException, UnixSignalDeathPenalty
+from videoflix.simpleworker import PreforkedWorker, refresh_db_connections
 
 class VideoSignalTests(TestCase):
-    @patch('videostore.signals.enqueue_video_task') 
-    def test_video_post_save_signal_created(self, mock_enqueue_task):
-        video_instance = Video.objects.create(
-            title="Test Video", 
-            video_file="test_video.mp4"
-        )
-
-        video_post_save(Video, instance=video_instance, created=True)
+    @patch('videostore.signals.django_rq')
+    @patch('videostore.signals.enqueue_video_task')
+    def test_video_post_save_signal_created(self, mock_enqueue_task, mock_django_rq):
+        with self.captureOnCommitCallbacks(execute=True):
+            video_instance = Video.objects.create(
+                title="Test Video",
+                video_file="test_video.mp4"
+            )
 
         mock_enqueue_task.assert_called_once_with(video_instance)
 
-    @patch('videostore.signals.enqueue_video_task')  
-    def test_video_post_save_signal_not_created(self, mock_enqueue_task):
+    @patch('videostore.signals.django_rq')
+    @patch('videostore.signals.enqueue_metadata_publish')
+    @patch('videostore.signals.enqueue_video_task')
+    def test_video_post_save_signal_not_created(self, mock_enqueue_task, mock_enqueue_metadata_publish, mock_django_rq):
         video_instance = Video.objects.create(
-            title="Test Video", 
+            title="Test Video",
             video_file="test_video.mp4"
         )
 
-        video_post_save(Video, instance=video_instance, created=False)
+        with self.captureOnCommitCallbacks(execute=True):
+            video_instance.save(update_fields=['video_duration'])
 
         mock_enqueue_task.assert_not_called()
+        # Saves with update_fields come from jobs that publish the metadata themselves
+        mock_enqueue_metadata_publish.assert_not_called()
+
+    @patch('videostore.signals.enqueue_catalog_manifest_rebuild')
+    def test_only_saves_of_catalog_fields_rebuild_the_manifest(self, mock_enqueue_rebuild):
+        video = Video.objects.bulk_create([Video(title="Intro", description="", video_file="intro.mp4")])[0]
+
+        with self.captureOnCommitCallbacks(execute=True):
+            video.save(update_fields=['content_hash'])
+        mock_enqueue_rebuild.assert_not_called()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            video.save(update_fields=['video_duration'])
+        mock_enqueue_rebuild.assert_called_once()
+
+    @patch('videostore.signals.django_rq')
+    def test_catalog_rebuild_collapses_into_the_queued_one(self, mock_django_rq):
+        mock_queue = mock_django_rq.get_queue.return_value
+        mock_queue.fetch_job.return_value.get_status.return_value = 'queued'
+
+        enqueue_catalog_manifest_rebuild()
 
-    @patch('videostore.signals.logger')  
-    @patch('videostore.signals.get_queue')  
-    def test_enqueue_video_task_no_video_file(self, mock_get_queue, mock_logger):
+        mock_queue.fetch_job.assert_called_once_with('rebuild-catalog-manifest')
+        mock_queue.enqueue.assert_not_called()
+
+    @patch('videostore.signals.django_rq')
+    def test_admin_edit_enqueues_one_metadata_publish(self, mock_django_rq):
+        video = Video.objects.create(title="Intro", video_file="intro.mp4")
+        video.title = "Intro (remastered)"
+
+        with self.captureOnCommitCallbacks(execute=True):
+            video.save()
+
+        mock_django_rq.get_queue.return_value.enqueue.assert_any_call(publish_video_metadata, video.id)
+
+    @patch('videostore.signals.logger')
+    @patch('videostore.signals.django_rq')
+    def test_enqueue_video_task_no_video_file(self, mock_django_rq, mock_logger):
         video_instance = MagicMock(video_file=None)
 
         enqueue_video_task(video_instance)
 
         mock_logger.error.assert_called_once_with(f"No video file associated with instance {video_instance.id}")
 
-        mock_get_queue.assert_not_called()
+        mock_django_rq.get_queue.assert_not_called()
 
-    @patch('videostore.signals.os.path.splitext')  
-    @patch('videostore.signals.get_video_duration')  
-    @patch('videostore.signals.get_queue')  
-    @patch('videostore.signals.convert_to_hls')  
-    def test_enqueue_video_task_success(self, mock_convert_to_hls, mock_get_queue, mock_get_video_duration, mock_splitext):
+    @patch('videostore.signals.get_video_duration')
+    @patch('videostore.signals.django_rq')
+    def test_enqueue_video_task_success(self, mock_django_rq, mock_get_video_duration):
         video_instance = MagicMock()
         video_instance.video_file.path = "/media/videos/test_video.mp4"
 
-        mock_queue = MagicMock()
-        mock_get_queue.return_value = mock_queue
+        enqueue_video_task(video_instance)
 
-        mock_splitext.return_value = ("test_video", ".mp4")
+        # Probing and publishing the metadata are left to prepare_video
+        mock_get_video_duration.assert_not_called()
+        mock_django_rq.get_queue.assert_called_once_with('metadata', autocommit=True)
+        mock_django_rq.get_queue.return_value.enqueue.assert_called_once_with(prepare_video, video_instance.id, job_timeout=settings.PREPARE_TIMEOUT)
 
-        enqueue_video_task(video_instance)
+    @override_settings(PREPARE_TIMEOUT=120, PREPARE_HASH_BYTES_PER_SECOND=20 * 1024 * 1024)
+    @patch('videostore.signals.os.path.getsize', return_value=10 * 1024 ** 3)
+    @patch('videostore.signals.django_rq')
+    def test_preparation_timeout_grows_with_the_source_size(self, mock_django_rq, mock_getsize):
+        enqueue_video_task(MagicMock())
+
+        self.assertEqual(mock_django_rq.get_queue.return_value.enqueue.call_args.kwargs['job_timeout'], 632)
+
+    @patch('videostore.tasks.enqueue_conversion')
+    @patch('videostore.models.upload_files', return_value=UploadResult())
+    @patch('videostore.signals.run_ffprobe')
+    @patch('videostore.signals.check_video_exists', return_value=True)
+    def test_preparation_probes_saves_and_publishes_once(self, mock_exists, mock_run_ffprobe, mock_upload_files, mock_enqueue_conversion):
+        video = Video.objects.create(title="Intro", video_file="intro.mp4")
+        mock_run_ffprobe.return_value = MagicMock(returncode=0, stdout=json.dumps({'format': {'duration': '90.4'}}))
+
+        with patch('videostore.signals.django_rq') as mock_django_rq:
+            with self.captureOnCommitCallbacks(execute=True):
+                prepare_video(video.id)
+
+        self.assertEqual(Video.objects.get(id=video.id).video_duration, "00:01:30")
+        mock_upload_files.assert_called_once()
+        gcs_paths = [gcs_path for _, gcs_path in mock_upload_files.call_args.args[0]]
+        self.assertEqual(len(gcs_paths), 9)
+        self.assertIn('text/intro/video_duration.txt', gcs_paths)
+        mock_enqueue_conversion.assert_called_once_with(video.id, "intro", 90)
+        # The duration save must not queue a second metadata publish
+        self.assertNotIn(call(publish_video_metadata, video.id), mock_django_rq.get_queue.return_value.enqueue.call_args_list)
+
+    @patch('videostore.models.upload_files')
+    def test_text_metadata_is_published_in_one_batch(self, mock_upload_files):
+        video = Video.objects.bulk_create([Video(title="Intro", description="", video_file="intro.mp4", video_duration="00:01:30")])[0]
+        published = {}
+
+        def read_uploads(uploads):
+            for local_path, gcs_path in uploads:
+                with open(local_path, encoding='utf-8') as text_file:
+                    published[gcs_path] = text_file.read()
+            return UploadResult(uploaded=list(published))
+
+        mock_upload_files.side_effect = read_uploads
+
+        video.upload_text_to_gcs()
+
+        self.assertEqual(published['text/intro/video_duration.txt'], "00:01:30")
+        self.assertEqual(published['text/intro/title.txt'], "Intro")
+
+    @patch('videostore.models.upload_files', return_value=UploadResult(failed={'text/intro/title.txt': 'timeout'}))
+    def test_failed_text_upload_fails_the_job(self, mock_upload_files):
+        video = Video.objects.bulk_create([Video(title="Intro", description="", video_file="intro.mp4")])[0]
+
+        with self.assertRaises(IOError):
+            video.upload_text_to_gcs()
+
+
+class CatalogManifestTests(TestCase):
+    def test_build_catalog_entry_uses_defaults(self):
+        video = Video(title="Intro", description="Desc", video_file="videos/intro.mp4")
+
+        entry = build_catalog_entry(video)
+
+        self.assertEqual(entry['subfolder'], "intro")
+        self.assertEqual(entry['posterUrlGcs'], f"https://storage.googleapis.com/{settings.GS_BUCKET_NAME}/video-posters/intro.jpg")
+        self.assertEqual(entry['age'], "0")
+        self.assertEqual(entry['resolution'], "HD")
+        self.assertEqual(entry['video_duration'], "00:00:00")
+
+    def test_load_catalog_manifest_missing(self):
+        mock_bucket = MagicMock()
+        mock_bucket.get_blob.return_value = None
+
+        self.assertIsNone(load_catalog_manifest(mock_bucket))
+
+    def test_load_catalog_manifest(self):
+        mock_bucket = MagicMock()
+        mock_bucket.get_blob.return_value.download_as_bytes.return_value = b'{"schema": 1, "version": 1, "videos": []}'
+
+        manifest = load_catalog_manifest(mock_bucket)
+
+        mock_bucket.get_blob.assert_called_once_with(settings.CATALOG_MANIFEST_PATH)
+        self.assertEqual(manifest['videos'], [])
+
+    @patch('videostore.catalog.set_revalidated')
+    @patch('videostore.catalog.invalidate_catalog_cache')
+    @patch('videostore.catalog.get_gcs_bucket')
+    def test_rebuild_publishes_over_the_shared_client(self, mock_get_gcs_bucket, mock_invalidate, mock_set_revalidated):
+        rebuild_catalog_manifest()
+
+        mock_get_gcs_bucket.return_value.blob.assert_called_once_with(settings.CATALOG_MANIFEST_PATH)
+        mock_get_gcs_bucket.return_value.blob.return_value.upload_from_string.assert_called_once()
+
+
+class VideoCatalogViewTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        Video.objects.bulk_create([
+            Video(title="Intro", description="First", video_file="intro.mp4", category="film", age="12"),
+            Video(title="Outro", description="Second", video_file="outro.mp4", category="serie"),
+            Video(title="No file", description="Skipped"),
+        ])
+
+    def test_catalog_lists_videos_with_files(self):
+        response = self.client.get(reverse('video_catalog'))
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([video['subfolder'] for video in response.data['results']], ["outro", "intro"])
+
+    def test_catalog_computes_poster_url_from_row(self):
+        response = self.client.get(reverse('video_catalog'))
+
+        self.assertEqual(response.data['results'][0]['posterUrlGcs'], f"https://storage.googleapis.com/{settings.GS_BUCKET_NAME}/video-posters/outro.jpg")
+        self.assertEqual(response.data['results'][0]['age'], "0")
+
+    def test_catalog_filters_by_field_values(self):
+        response = self.client.get(reverse('video_catalog'), {'category': 'film', 'age': '12,16'})
+
+        self.assertEqual([video['subfolder'] for video in response.data['results']], ["intro"])
+
+    def test_catalog_cursor_pagination(self):
+        response = self.client.get(reverse('video_catalog'), {'page_size': 1, 'ordering': 'title'})
+
+        self.assertEqual([video['subfolder'] for video in response.data['results']], ["intro"])
+        next_page = self.client.get(response.data['next'])
+        self.assertEqual([video['subfolder'] for video in next_page.data['results']], ["outro"])
+        self.assertIsNone(next_page.data['next'])
+
+    def test_cursor_pagination_breaks_ties_by_id(self):
+        Video.objects.bulk_create([Video(title=f"Episode {i}", description="", video_file=f"episode{i}.mp4", release_date="2023") for i in range(5)])
+        seen = []
+        response = self.client.get(reverse('video_catalog'), {'page_size': 2, 'ordering': '-release_date', 'category': ''})
+        while True:
+            seen += [video['subfolder'] for video in response.data['results']]
+            if not response.data['next']:
+                break
+            response = self.client.get(response.data['next'])
+
+        self.assertEqual([subfolder for subfolder in seen if subfolder.startswith('episode')], [f"episode{i}" for i in reversed(range(5))])
+        self.assertEqual(sorted(seen), sorted(set(seen)))
+        self.assertEqual(len(seen), 7)
+
+
+class FetchBlobTextsTests(TestCase):
+    def test_fetch_blob_texts_collects_missing_and_failed(self):
+        blobs = {
+            "text/a/title.txt": MagicMock(**{'download_as_text.return_value': "A"}),
+            "text/a/age.txt": MagicMock(**{'download_as_text.side_effect': NotFound("gone")}),
+            "text/a/category.txt": MagicMock(**{'download_as_text.side_effect': TimeoutError("slow")}),
+        }
+        mock_bucket = MagicMock()
+        mock_bucket.blob.side_effect = blobs.get
+
+        result = fetch_blob_texts(mock_bucket, list(blobs), max_workers=2, timeout=1)
+
+        self.assertEqual(result.texts, {"text/a/title.txt": "A"})
+        self.assertEqual(result.missing, ["text/a/age.txt"])
+        self.assertIn("text/a/category.txt", result.failed)
+        blobs["text/a/title.txt"].download_as_text.assert_called_once_with(timeout=1)
+
+
+class PosterIndexTests(TestCase):
+    def test_get_poster_url_matches_exact_video_key(self):
+        poster_urls = [
+            "https://storage.googleapis.com/bucket/video-posters/intro2.jpg",
+            "https://storage.googleapis.com/bucket/video-posters/intro.jpg",
+        ]
+
+        poster_index = build_poster_index(poster_urls)
+
+        self.assertEqual(get_poster_url("intro", poster_index), poster_urls[1])
+        self.assertEqual(get_poster_url("intro2", poster_index), poster_urls[0])
+        self.assertIsNone(get_poster_url("outro", poster_index))
+
+
+class CatalogCacheTests(TestCase):
+    @patch('videostore.cache.redis_client')
+    def test_get_or_rebuild_returns_cached_value(self, mock_redis):
+        mock_redis.get.return_value = b'["a"]'
+        rebuild = MagicMock()
+
+        self.assertEqual(get_or_rebuild('poster_urls', rebuild), ["a"])
+
+        rebuild.assert_not_called()
+
+    @patch('videostore.cache.redis_client')
+    def test_get_or_rebuild_rebuilds_when_lock_acquired(self, mock_redis):
+        mock_redis.get.return_value = None
+        mock_redis.lock.return_value.acquire.return_value = True
+        rebuild = MagicMock(return_value=["b"])
+
+        self.assertEqual(get_or_rebuild('poster_urls', rebuild), ["b"])
+
+        rebuild.assert_called_once()
+        mock_redis.pipeline.return_value.setex.assert_called_once_with('poster_urls', settings.CATALOG_CACHE_TTL, '["b"]')
+        mock_redis.lock.return_value.release.assert_called_once()
+
+    @patch('videostore.cache.redis_client')
+    def test_invalidate_only_soft_expires_existing_entries(self, mock_redis):
+        invalidate_catalog_cache()
+
+        pipe = mock_redis.pipeline.return_value
+        pipe.delete.assert_called_once_with('poster_urls', 'my_films_subfolders', 'gcs_video_text_data:stale')
+        pipe.hset.assert_not_called()
+        pipe.eval.assert_called_once_with(SOFT_EXPIRE_SCRIPT, 1, 'gcs_video_text_data')
+
+    @patch('videostore.cache.redis_client')
+    def test_get_or_rebuild_serves_stale_while_locked(self, mock_redis):
+        mock_redis.get.side_effect = lambda key: b'["stale"]' if key == 'poster_urls:stale' else None
+        mock_redis.lock.return_value.acquire.return_value = False
+        rebuild = MagicMock()
+
+        self.assertEqual(get_or_rebuild('poster_urls', rebuild), ["stale"])
+
+        rebuild.assert_not_called()
+
+    @patch('videostore.cache.schedule_refresh')
+    @patch('videostore.cache.redis_client')
+    def test_stale_while_revalidate_serves_stale_and_schedules_refresh(self, mock_redis, mock_schedule_refresh):
+        mock_redis.hmget.return_value = [b'[]', b'"abc"', b'1700000000', b'0']
+        rebuild, refresh = MagicMock(), MagicMock()
+
+        self.assertEqual(get_stale_while_revalidate('gcs_video_text_data', rebuild, refresh), (b'[]', '"abc"', 1700000000))
+
+        rebuild.assert_not_called()
+        mock_schedule_refresh.assert_called_once_with('gcs_video_text_data', refresh)
+
+    @patch('videostore.cache.schedule_refresh')
+    @patch('videostore.cache.redis_client')
+    def test_stale_while_revalidate_fresh_entry(self, mock_redis, mock_schedule_refresh):
+        mock_redis.hmget.return_value = [b'[]', b'"abc"', b'1700000000', str(time.time() + 60).encode()]
+
+        get_stale_while_revalidate('gcs_video_text_data', MagicMock(), MagicMock())
+
+        mock_schedule_refresh.assert_not_called()
+
+    @patch('videostore.cache.django_rq')
+    @patch('videostore.cache.redis_client')
+    def test_schedule_refresh_enqueues_once(self, mock_redis, mock_django_rq):
+        mock_redis.set.side_effect = [True, None]
+        refresh = MagicMock()
+
+        schedule_refresh('gcs_video_text_data', refresh)
+        schedule_refresh('gcs_video_text_data', refresh)
+
+        mock_django_rq.get_queue.return_value.enqueue.assert_called_once_with(refresh)
+
+
+class EncodedCatalogResponseTests(TestCase):
+    def test_select_content_encoding_prefers_brotli(self):
+        self.assertEqual(select_content_encoding("gzip, deflate, br"), "br")
+
+    def test_select_content_encoding_respects_quality(self):
+        self.assertEqual(select_content_encoding("br;q=0, gzip"), "gzip")
+        self.assertEqual(select_content_encoding(""), "identity")
+
+    @patch('videostore.views.get_revalidated_validators', return_value=(None, None))
+    @patch('videostore.views.get_stale_while_revalidate')
+    def test_get_poster_and_text_streams_cached_variant(self, mock_swr, mock_validators):
+        mock_swr.return_value = (gzip.compress(b'[]'), '"abc"', 1700000000)
+
+        response = APIClient().get(reverse('video_info'), HTTP_ACCEPT_ENCODING='gzip')
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertIn('Accept-Encoding', response['Vary'])
+        self.assertEqual(gzip.decompress(response.content), b'[]')
+        self.assertEqual(mock_swr.call_args.args[3], 'gzip')
+
+
+class ConditionalGetTests(TestCase):
+    @patch('videostore.views.get_stale_while_revalidate')
+    @patch('videostore.views.get_revalidated_validators', return_value=('"abc"', 1700000000))
+    def test_catalog_not_modified_skips_payload(self, mock_validators, mock_swr):
+        response = APIClient().get(reverse('video_info'), HTTP_IF_NONE_MATCH='"abc-gzip"', HTTP_ACCEPT_ENCODING='gzip')
+
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(response['ETag'], '"abc-gzip"')
+        mock_swr.assert_not_called()
+
+    @patch('videostore.views.get_stale_while_revalidate', return_value=(b'[]', '"abc"', 1700000000))
+    @patch('videostore.views.get_revalidated_validators', return_value=('"abc"', 1700000000))
+    def test_catalog_changed_returns_body_with_validators(self, mock_validators, mock_swr):
+        response = APIClient().get(reverse('video_info'), HTTP_IF_NONE_MATCH='"old"')
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response['ETag'], '"abc"')
+        self.assertIn('Last-Modified', response)
+
+    @patch('videostore.views.redis_client')
+    def test_preview_video_not_modified(self, mock_redis):
+        etag = make_etag(f"https://storage.googleapis.com/{settings.GS_BUCKET_NAME}/hls/intro/720p.m3u8")
+
+        response = self.client.get(reverse('get_preview_video'), {'video_key': 'intro', 'resolution': '720p'}, HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        mock_redis.get.assert_not_called()
+
+
+class SinglePassEncodingTests(TestCase):
+    def test_build_single_pass_command_maps_every_resolution(self):
+        cmd = build_single_pass_command('/media/videos/intro.mp4', '/media/videos/intro', ['360', '720'])
+
+        self.assertEqual(cmd.count('-i'), 1)
+        self.assertIn('[0:v]split=2[v0][v1];[v0]scale=640:360:force_original_aspect_ratio=decrease:force_divisible_by=2[v0out];'
+                      '[v1]scale=1280:720:force_original_aspect_ratio=decrease:force_divisible_by=2[v1out]', cmd)
+        self.assertEqual(cmd[cmd.index('-var_stream_map') + 1], 'v:0,a:0,name:360p v:1,a:1,name:720p')
+        self.assertEqual(cmd[cmd.index('-maxrate:v:1') + 1], '4200k')
+        self.assertEqual(cmd[-1], '/media/videos/intro/%v.m3u8')
+
+    def test_build_single_pass_command_without_audio(self):
+        cmd = build_single_pass_command('/media/videos/intro.mp4', '/media/videos/intro', ['360'], with_audio=False)
+
+        self.assertNotIn('0:a:0', cmd)
+        self.assertEqual(cmd[cmd.index('-var_stream_map') + 1], 'v:0,name:360p')
+
+
+class RenditionFanOutTests(TestCase):
+    @patch('videostore.tasks.django_rq')
+    def test_enqueue_rendition_jobs_adds_finalizer_depending_on_all_jobs(self, mock_django_rq):
+        mock_queue = mock_django_rq.get_queue.return_value
+        mock_queue.enqueue.side_effect = lambda *args, **kwargs: MagicMock(id=kwargs['job_id'])
+
+        enqueue_rendition_jobs(1, "intro", "/media/videos/intro", ['360', '720'])
+
+        calls = mock_queue.enqueue.call_args_list
+        self.assertEqual([call.args[0] for call in calls], [run_poster_stage, encode_rendition, encode_rendition, finalize_hls])
+        self.assertEqual([call.kwargs['job_id'] for call in calls], ['convert-1-poster', 'convert-1-360', 'convert-1-720', 'convert-1-finalize'])
+        self.assertEqual(calls[-1].args[1:], (1, "intro", ['360', '720'], None))
+        dependency = calls[-1].kwargs['depends_on']
+        self.assertEqual(dependency.dependencies, ['convert-1-poster', 'convert-1-360', 'convert-1-720'])
+        self.assertTrue(dependency.allow_failure)
+
+    @patch('videostore.tasks.start_segment_shipper')
+    @patch('videostore.tasks.upload_rendition_playlist')
+    @patch('videostore.tasks.convert_to_resolution', return_value=False)
+    def test_encode_rendition_fails_job_on_ffmpeg_error(self, mock_convert, mock_upload, mock_start_shipper):
+        video = Video.objects.bulk_create([Video(title="Intro", description="", video_file="intro.mp4")])[0]
+        VideoConversion.objects.create(video=video)
+
+        with self.assertRaises(RuntimeError):
+            encode_rendition(video.id, "intro", '720')
+
+        mock_start_shipper.return_value.finish.assert_called_once()
+        mock_upload.assert_not_called()
+        self.assertFalse(video.conversion.is_done('encode:720'))
+
+
+class SourceAwareLadderTests(TestCase):
+    def test_select_resolutions_skips_rungs_above_source(self):
+        self.assertEqual(select_resolutions({'width': 854, 'height': 480}), ['360', '480'])
+        self.assertEqual(select_resolutions({'width': 1920, 'height': 1080}), ['360', '480', '720', '1080'])
+
+    def test_select_resolutions_keeps_full_width_rungs_of_wide_sources(self):
+        self.assertEqual(select_resolutions({'width': 1920, 'height': 800}), ['360', '480', '720', '1080'])
+        self.assertEqual(select_resolutions({'width': 1280, 'height': 536}), ['360', '480', '720'])
+        self.assertEqual(select_resolutions({'width': 1080, 'height': 1920}), ['360', '480', '720', '1080'])
+
+    def test_select_resolutions_keeps_lowest_rung_for_tiny_sources(self):
+        self.assertEqual(select_resolutions({'width': 426, 'height': 240}), ['360'])
+
+    def test_select_resolutions_falls_back_to_full_ladder_without_probe(self):
+        self.assertEqual(select_resolutions({'width': None, 'height': None}), ['360', '480', '720', '1080'])
+
+    @patch('videostore.tasks.probe_streams')
+    def test_create_master_playlist_writes_measured_bandwidth(self, mock_probe_streams):
+        mock_probe_streams.return_value = {
+            'video': {'codec_name': 'h264', 'profile': 'Main', 'level': 31, 'width': 854, 'height': 480},
+            'audio': {'codec_name': 'aac'},
+        }
+        with tempfile.TemporaryDirectory() as output_directory:
+            with open(os.path.join(output_directory, '480p.m3u8'), 'w') as playlist:
+                playlist.write("#EXTM3U\n#EXTINF:4.000000,\n480p_000.ts\n#EXTINF:2.000000,\n480p_001.ts\n#EXT-X-ENDLIST\n")
+            with open(os.path.join(output_directory, '480p_000.ts'), 'wb') as segment:
+                segment.write(b'0' * 400000)
+            with open(os.path.join(output_directory, '480p_001.ts'), 'wb') as segment:
+                segment.write(b'0' * 500000)
+
+            with open(create_master_playlist(output_directory, ['480'], {'fps': 25.0})) as master_playlist:
+                master = master_playlist.read()
+
+        self.assertIn('#EXT-X-STREAM-INF:BANDWIDTH=2000000,AVERAGE-BANDWIDTH=1200000,RESOLUTION=854x480,CODECS="avc1.4d401f,mp4a.40.2",FRAME-RATE=25.000\n480p.m3u8', master)
+
+    @patch('videostore.tasks.probe_streams', return_value={})
+    def test_create_master_playlist_falls_back_to_nominal_bandwidth(self, mock_probe_streams):
+        with tempfile.TemporaryDirectory() as output_directory:
+            with open(create_master_playlist(output_directory, ['720'])) as master_playlist:
+                master = master_playlist.read()
+
+        self.assertIn('#EXT-X-STREAM-INF:BANDWIDTH=2800000,RESOLUTION=1280x720\n720p.m3u8', master)
+
+
+class SegmentShipperTests(TestCase):
+    @patch('videostore.tasks.upload_files')
+    def test_ships_finished_segments_and_skips_in_progress_ones(self, mock_upload_files):
+        mock_upload_files.side_effect = lambda uploads: UploadResult(uploaded=[gcs_path for _, gcs_path in uploads], uploaded_bytes=10, seconds=1.0)
+        with tempfile.TemporaryDirectory() as output_directory:
+            for filename in ('360p_000.ts', '360p_001.ts.tmp', '720p_000.ts', '360p.m3u8'):
+                open(os.path.join(output_directory, filename), 'wb').close()
+            shipper = SegmentShipper("intro", output_directory, ['360p_*.ts'])
+
+            shipper.ship_ready_segments()
+            shipper.ship_ready_segments()
+
+        mock_upload_files.assert_called_once_with([(os.path.join(output_directory, '360p_000.ts'), 'hls/intro/360p_000.ts')])
+        self.assertEqual(shipper.result.as_dict()['uploaded'], 1)
+
+    @patch('videostore.tasks.upload_files')
+    def test_retries_failed_uploads_on_next_scan(self, mock_upload_files):
+        mock_upload_files.side_effect = [
+            UploadResult(failed={'hls/intro/360p_000.ts': 'timeout'}),
+            UploadResult(uploaded=['hls/intro/360p_000.ts'], uploaded_bytes=10, seconds=1.0),
+        ]
+        with tempfile.TemporaryDirectory() as output_directory:
+            open(os.path.join(output_directory, '360p_000.ts'), 'wb').close()
+            shipper = SegmentShipper("intro", output_directory, ['360p_*.ts'])
+            shipper.ship_ready_segments()
+            shipper.start()
+
+            result = shipper.finish()
+
+        self.assertEqual(result.as_dict(), {'uploaded': 1, 'failed': 0, 'bytes': 10, 'seconds': 1.0, 'megabytes_per_second': 0.0})
+        self.assertEqual(mock_upload_files.call_count, 2)
+
+
+class GcsUploadTests(TestCase):
+    def write_segment(self, directory, content=b'segment'):
+        local_path = os.path.join(directory, '360p_000.ts')
+        with open(local_path, 'wb') as segment:
+            segment.write(content)
+        return local_path
+
+    @patch('videostore.gcs.time.sleep')
+    def test_upload_file_retries_until_crc32c_matches(self, mock_sleep):
+        mock_bucket = MagicMock()
+        blobs = [MagicMock(crc32c='wrong'), MagicMock()]
+        mock_bucket.blob.side_effect = blobs
+        with tempfile.TemporaryDirectory() as directory:
+            local_path = self.write_segment(directory)
+            blobs[1].crc32c = file_crc32c(local_path)
+
+            upload_file(mock_bucket, local_path, 'hls/intro/360p_000.ts')
+
+        self.assertEqual(mock_bucket.blob.call_count, 2)
+        blobs[1].upload_from_filename.assert_called_once_with(local_path, checksum='crc32c', timeout=settings.GCS_UPLOAD_TIMEOUT)
+
+    @patch('videostore.gcs.time.sleep')
+    def test_upload_files_reports_failures_and_throughput(self, mock_sleep):
+        mock_bucket = MagicMock()
+        mock_bucket.blob.return_value.upload_from_filename.side_effect = Exception('503 Service Unavailable')
+        with tempfile.TemporaryDirectory() as directory:
+            local_path = self.write_segment(directory)
+
+            result = upload_files([(local_path, 'hls/intro/360p_000.ts')], gcs_bucket=mock_bucket)
+
+        self.assertEqual(result.uploaded, [])
+        self.assertIn('503 Service Unavailable', result.failed['hls/intro/360p_000.ts'])
+        self.assertEqual(mock_bucket.blob.call_count, settings.GCS_UPLOAD_RETRIES + 1)
+        self.assertEqual(mock_sleep.call_count, settings.GCS_UPLOAD_RETRIES)
+
+    def test_upload_result_merge_counts_reuploaded_paths_once(self):
+        result = UploadResult(uploaded=['hls/intro/360p_000.ts'], failed={'hls/intro/360p_001.ts': 'timeout'})
+
+        result.merge(UploadResult(uploaded=['hls/intro/360p_000.ts', 'hls/intro/360p_001.ts']))
+
+        self.assertEqual(result.uploaded, ['hls/intro/360p_000.ts', 'hls/intro/360p_001.ts'])
+        self.assertEqual(result.failed, {})
+
+    @patch('videostore.gcs.storage.Client')
+    def test_get_gcs_client_is_reused_within_a_process(self, mock_client):
+        gcs_clients.clear()
+
+        self.assertIs(get_gcs_client(), get_gcs_client())
+        mock_client.assert_called_once()
+
+
+@override_settings(HLS_ENCODE_MODE='single_pass')
+@patch('videostore.tasks.invalidate_catalog_cache')
+@patch('videostore.tasks.upload_master_playlist', return_value=True)
+@patch('videostore.tasks.create_master_playlist')
+@patch('videostore.tasks.upload_rendition_playlist', return_value=True)
+@patch('videostore.tasks.start_segment_shipper')
+@patch('videostore.tasks.convert_all_resolutions', return_value=True)
+@patch('videostore.tasks.create_output_directory', side_effect=lambda base_path: base_path)
+@patch('videostore.tasks.wait_for_source_file', return_value=True)
+class ConversionCheckpointTests(TestCase):
+    def setUp(self):
+        self.video = Video.objects.bulk_create([Video(title="Intro", description="", video_file="intro.mp4")])[0]
+
+    def create_conversion(self, completed_stages):
+        return VideoConversion.objects.create(
+            video=self.video, completed_stages=completed_stages, resolutions=['360', '720'],
+            source_info={'width': 1280, 'height': 720, 'fps': 25.0, 'has_audio': True},
+        )
+
+    def test_retry_only_encodes_missing_renditions(self, mock_wait, mock_output_directory, mock_convert_all, mock_start_shipper, mock_upload_playlist, mock_create_master, mock_upload_master, mock_invalidate):
+        mock_start_shipper.return_value.finish.return_value = UploadResult()
+        self.create_conversion(['probe', 'poster', 'encode:360', 'upload:360'])
+
+        convert_to_hls(self.video.id, "intro")
+
+        self.assertEqual(mock_convert_all.call_args.args[3], ['720'])
+        mock_upload_playlist.assert_called_once()
+        conversion = VideoConversion.objects.get(video=self.video)
+        self.assertEqual(conversion.status, "finished")
+        self.assertEqual(conversion.attempts, 1)
+        self.assertTrue(conversion.is_done('upload:720'))
+        self.assertTrue(conversion.is_done('master'))
+
+    def test_finished_conversion_is_not_redone(self, mock_wait, mock_output_directory, mock_convert_all, mock_start_shipper, mock_upload_playlist, mock_create_master, mock_upload_master, mock_invalidate):
+        self.create_conversion(['probe', 'poster', 'encode:360', 'upload:360', 'encode:720', 'upload:720', 'master'])
+
+        convert_to_hls(self.video.id, "intro")
+
+        mock_convert_all.assert_not_called()
+        mock_start_shipper.assert_not_called()
+        mock_upload_master.assert_not_called()
+
+    def test_failed_segment_upload_leaves_rendition_for_retry(self, mock_wait, mock_output_directory, mock_convert_all, mock_start_shipper, mock_upload_playlist, mock_create_master, mock_upload_master, mock_invalidate):
+        mock_start_shipper.return_value.finish.return_value = UploadResult(failed={'hls/intro/720p_003.ts': 'timeout'})
+        self.create_conversion(['probe', 'poster', 'encode:360', 'upload:360'])
+
+        with self.assertRaises(RuntimeError):
+            convert_to_hls(self.video.id, "intro")
+
+        conversion = VideoConversion.objects.get(video=self.video)
+        self.assertEqual(conversion.status, "failed")
+        self.assertTrue(conversion.is_done('encode:720'))
+        self.assertFalse(conversion.is_done('upload:720'))
+        mock_upload_master.assert_not_called()
+
+
+class ConversionEnqueueTests(TestCase):
+    @patch('videostore.tasks.Job.fetch_many')
+    @patch('videostore.tasks.django_rq')
+    def test_duplicate_enqueue_collapses_into_running_job(self, mock_django_rq, mock_fetch_many):
+        mock_queue = mock_django_rq.get_queue.return_value
+        running_job = MagicMock()
+        running_job.get_status.return_value = 'started'
+        mock_fetch_many.return_value = [running_job, None, None]
+
+        enqueue_conversion(1, "intro")
+
+        mock_fetch_many.assert_called_once_with(['convert-1', 'convert-1-poster', 'convert-1-finalize'], connection=mock_queue.connection)
+        mock_queue.enqueue.assert_not_called()
+
+    @patch('videostore.tasks.Job.fetch_many')
+    @patch('videostore.tasks.django_rq')
+    def test_duplicate_enqueue_collapses_into_running_rendition_job(self, mock_django_rq, mock_fetch_many):
+        video = Video.objects.bulk_create([Video(title="Intro", description="", video_file="intro.mp4")])[0]
+        VideoConversion.objects.create(video=video, status="running", resolutions=['360', '720'])
+        finished_job, rendition_job = MagicMock(), MagicMock()
+        finished_job.get_status.return_value = 'finished'
+        rendition_job.get_status.return_value = 'started'
+        mock_fetch_many.return_value = [finished_job, finished_job, None, rendition_job, None]
+
+        enqueue_conversion(video.id, "intro")
+
+        job_ids = mock_fetch_many.call_args.args[0]
+        self.assertEqual(job_ids, [f'convert-{video.id}', f'convert-{video.id}-poster', f'convert-{video.id}-360', f'convert-{video.id}-720', f'convert-{video.id}-finalize'])
+        mock_django_rq.get_queue.return_value.enqueue.assert_not_called()
+
+    @patch('videostore.tasks.Job.fetch_many', return_value=[None, None, None])
+    @patch('videostore.tasks.django_rq')
+    def test_enqueue_uses_deterministic_job_id_and_conversion_timeout(self, mock_django_rq, mock_fetch_many):
+        mock_queue = mock_django_rq.get_queue.return_value
+
+        enqueue_conversion(1, "intro")
+
+        kwargs = mock_queue.enqueue.call_args.kwargs
+        self.assertEqual(kwargs['job_id'], 'convert-1')
+        self.assertEqual(kwargs['job_timeout'], settings.HLS_CONVERSION_TIMEOUT)
+
+    def test_wait_for_source_file_requires_a_stable_file(self):
+        with tempfile.TemporaryDirectory() as directory:
+            source = os.path.join(directory, 'intro.mp4')
+            with self.settings(HLS_SOURCE_READY_TIMEOUT=0.05, HLS_SOURCE_POLL_INTERVAL=0.01):
+                self.assertFalse(wait_for_source_file(source))
+                with open(source, 'wb') as source_file:
+                    source_file.write(b'0' * 10)
+                self.assertTrue(wait_for_source_file(source))
+
+
+class TranscodingProgressTests(TestCase):
+    def get_client(self):
+        client = APIClient()
+        client.force_authenticate(get_user_model().objects.create_user('viewer', 'viewer@example.com', 'password'))
+        return client
+
+    def test_summarize_progress_computes_percent_fps_and_speed(self):
+        block = {'fps': '47.5', 'out_time_us': '30000000', 'speed': '1.9x', 'progress': 'continue'}
+
+        progress = summarize_progress(block, duration=120)
+
+        self.assertEqual((progress['state'], progress['percent'], progress['fps'], progress['speed']), ('running', 25.0, 47.5, 1.9))
+
+    def test_summarize_progress_handles_unknown_values(self):
+        progress = summarize_progress({'fps': '0.00', 'out_time_us': 'N/A', 'speed': 'N/A', 'progress': 'end'})
+
+        self.assertEqual((progress['state'], progress['percent'], progress['speed']), ('finished', 100.0, None))
+
+    @patch('videostore.progress.redis_client')
+    @patch('videostore.progress.subprocess.Popen')
+    def test_run_ffmpeg_streams_progress_and_keeps_stderr_tail(self, mock_popen, mock_redis):
+        process = mock_popen.return_value
+        process.stdout = iter(['fps=25.0\n', 'out_time_us=5000000\n', 'speed=2.0x\n', 'progress=continue\n',
+                               'out_time_us=10000000\n', 'progress=end\n'])
+        process.stderr = iter([f'line {i}\n' for i in range(500)])
+        process.wait.return_value = 1
+        pipe = mock_redis.pipeline.return_value
+
+        returncode, stderr = run_ffmpeg(['ffmpeg', '-i', 'in.mp4', 'out.m3u8'], 7, ['360', '720'], duration=10)
+
+        self.assertEqual(mock_popen.call_args.args[0][:4], ['ffmpeg', '-progress', 'pipe:1', '-nostats'])
+        self.assertEqual(returncode, 1)
+        self.assertEqual(stderr.splitlines(), [f'line {i}' for i in range(300, 500)])
+        published = [json.loads(call.kwargs['mapping']['720']) for call in pipe.hset.call_args_list]
+        self.assertEqual([progress['state'] for progress in published], ['running', 'finished', 'failed'])
+        self.assertEqual(published[0]['percent'], 50.0)
+        pipe.hset.assert_called_with('video_progress:7', mapping=ANY)
+
+    @patch('videostore.views.get_progress', return_value={'360': {'state': 'running', 'percent': 40.0, 'fps': 50.0, 'speed': 2.0}})
+    def test_progress_endpoint_returns_conversion_and_renditions(self, mock_get_progress):
+        video = Video.objects.bulk_create([Video(title="Intro", description="", video_file="intro.mp4")])[0]
+        VideoConversion.objects.create(video=video, status="running", completed_stages=['probe'])
+
+        response = self.get_client().get(reverse('video_progress', args=[video.id]))
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['conversion']['status'], "running")
+        self.assertEqual(response.data['renditions']['360']['percent'], 40.0)
+
+    @patch('videostore.views.get_progress', return_value={})
+    def test_progress_endpoint_hides_ffmpeg_errors(self, mock_get_progress):
+        video = Video.objects.bulk_create([Video(title="Intro", description="", video_file="intro.mp4")])[0]
+        VideoConversion.objects.create(video=video, status="failed", error="/srv/media/videos/intro.mp4: Invalid data found")
+
+        response = self.get_client().get(reverse('video_progress', args=[video.id]))
+
+        self.assertEqual(response.data['conversion'], {'status': "failed", 'completed_stages': []})
+        self.assertNotIn('/srv/media', json.dumps(response.data))
+
+    @patch('videostore.views.get_progress', return_value={})
+    def test_progress_endpoint_requires_authentication(self, mock_get_progress):
+        response = APIClient().get(reverse('video_progress', args=[1]))
+
+        self.assertIn(response.status_code, (status.HTTP_401_UNAUTHORIZED, status.HTTP_403_FORBIDDEN))
+        mock_get_progress.assert_not_called()
+
+    @patch('videostore.progress.redis_client')
+    def test_progress_of_many_videos_is_fetched_in_one_pipeline(self, mock_redis):
+        pipe = mock_redis.pipeline.return_value
+        pipe.execute.return_value = [{b'360': b'{"state": "finished"}'}, {}]
+
+        progress = get_progress_many([1, 2])
+
+        self.assertEqual(progress, {1: {'360': {'state': 'finished'}}, 2: {}})
+        self.assertEqual(pipe.hgetall.call_args_list, [call('video_progress:1'), call('video_progress:2')])
+        mock_redis.hgetall.assert_not_called()
+
+    @patch('videostore.admin.get_progress_many')
+    def test_admin_changelist_fetches_progress_once_per_page(self, mock_get_progress_many):
+        videos = Video.objects.bulk_create([Video(title=title, description="", video_file=f"{title}.mp4") for title in ("intro", "outro")])
+        mock_get_progress_many.side_effect = lambda video_ids: {video_id: {'360': {'state': 'running', 'percent': 40.0, 'speed': 2.0}} for video_id in video_ids}
+        request = RequestFactory().get('/admin/videostore/video/')
+        request.user = get_user_model().objects.create_superuser('admin', 'admin@example.com', 'password')
+        video_admin = VideoAdmin(Video, admin.site)
+
+        changelist = video_admin.get_changelist_instance(request)
+
+        mock_get_progress_many.assert_called_once()
+        self.assertCountEqual(mock_get_progress_many.call_args.args[0], [video.id for video in videos])
+        self.assertEqual([video_admin.conversion_progress(video) for video in changelist.result_list], ["360p 40% 2.0x"] * 2)
+
+    @patch('videostore.views.get_progress', return_value={})
+    def test_progress_endpoint_returns_404_for_unknown_video(self, mock_get_progress):
+        response = self.get_client().get(reverse('video_progress', args=[999]))
+
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+
+@override_settings(HLS_SEGMENT_FORMAT='fmp4')
+class Fmp4ByteRangeTests(TestCase):
+    def test_single_pass_command_writes_one_fmp4_file_per_rendition(self):
+        cmd = build_single_pass_command('/media/videos/intro.mp4', '/media/videos/intro', ['360', '720'])
+
+        self.assertEqual(cmd[cmd.index('-hls_segment_type') + 1], 'fmp4')
+        self.assertEqual(cmd[cmd.index('-hls_flags') + 1], 'single_file')
+        self.assertEqual(cmd[cmd.index('-hls_segment_filename') + 1], '/media/videos/intro/%v.mp4')
+
+    @patch('videostore.tasks.probe_streams', return_value={})
+    def test_master_playlist_measures_byte_ranges(self, mock_probe_streams):
+        with tempfile.TemporaryDirectory() as output_directory:
+            with open(os.path.join(output_directory, '360p.m3u8'), 'w') as playlist:
+                playlist.write(
+                    '#EXTM3U\n#EXT-X-VERSION:7\n#EXT-X-MAP:URI="360p.mp4",BYTERANGE="1335@0"\n'
+                    '#EXTINF:4.000000,\n#EXT-X-BYTERANGE:1000000@1335\n360p.mp4\n'
+                    '#EXTINF:2.000000,\n#EXT-X-BYTERANGE:200000@1001335\n360p.mp4\n#EXT-X-ENDLIST\n'
+                )
+
+            with open(create_master_playlist(output_directory, ['360'])) as master_playlist:
+                master = master_playlist.read()
+
+        self.assertIn('#EXT-X-STREAM-INF:BANDWIDTH=2000000,AVERAGE-BANDWIDTH=1600000\n360p.m3u8', master)
+
+    @patch('videostore.tasks.upload_rendition_playlist', return_value=True)
+    @patch('videostore.tasks.upload_files')
+    def test_rendition_file_is_uploaded_before_its_playlist(self, mock_upload_files, mock_upload_playlist):
+        mock_upload_files.return_value = UploadResult(uploaded=['hls/intro/360p.mp4'], uploaded_bytes=10, seconds=1.0)
+        video = Video.objects.bulk_create([Video(title="Intro", description="", video_file="intro.mp4")])[0]
+        conversion = VideoConversion.objects.create(video=video)
+        uploads = UploadResult()
+
+        self.assertTrue(finish_rendition_upload(conversion, "intro", '/media/videos/intro', '360', uploads))
+
+        mock_upload_files.assert_called_once_with([('/media/videos/intro/360p.mp4', 'hls/intro/360p.mp4')])
+        self.assertEqual(uploads.uploaded, ['hls/intro/360p.mp4'])
+        self.assertTrue(conversion.is_done('upload:360'))
+
+
+class EncodingProfileTests(TestCase):
+    def test_gop_follows_source_frame_rate(self):
+        profile = settings.HLS_ENCODING_PROFILES['balanced']
+
+        options = build_encoder_options(59.94, profile)
+
+        self.assertEqual(options[options.index('-g') + 1], '120')
+        self.assertEqual(options[options.index('-keyint_min') + 1], '120')
+        self.assertEqual(options[options.index('-preset') + 1], 'medium')
+
+    def test_capped_crf_sets_vbv_caps_from_ladder_bitrate(self):
+        profile = {'rate_control': 'capped_crf', 'crf': 21, 'maxrate_factor': 1.5, 'bufsize_factor': 2.0}
+
+        options = build_video_encoder_options('720', profile, stream_index=2)
+
+        self.assertEqual(options, ['-crf:v:2', '21', '-maxrate:v:2', '4200k', '-bufsize:v:2', '5600k'])
+
+    def test_vbr_targets_ladder_bitrate(self):
+        profile = {'rate_control': 'vbr', 'maxrate_factor': 1.1, 'bufsize_factor': 1.5}
+
+        options = build_video_encoder_options('360', profile)
+
+        self.assertEqual(options, ['-b:v', '800k', '-maxrate:v', '880k', '-bufsize:v', '1200k'])
+
+
+@override_settings(THUMBNAIL_INTERVAL=10, THUMBNAIL_SPRITE_COLUMNS=2, THUMBNAIL_SPRITE_ROWS=2)
+class TrickplayThumbnailTests(TestCase):
+    def test_poster_input_seeks_before_decoding(self):
+        cmd = build_poster_and_sprite_command('/media/videos/intro.mp4', '/tmp/intro.jpg', '/tmp/thumbs', 10, (160, 90))
+
+        self.assertEqual(cmd[1:7], ['-y', '-ss', '10.000', '-i', '/media/videos/intro.mp4', '-skip_frame'])
+        self.assertEqual(cmd.count('-i'), 2)
+        self.assertIn('fps=1/10,scale=160:90,tile=2x2', cmd)
+
+    def test_vtt_addresses_tiles_across_sheets(self):
+        vtt = build_thumbnail_vtt(['sprite_001.jpg', 'sprite_002.jpg'], 45.5, (160, 90))
+
+        self.assertTrue(vtt.startswith('WEBVTT\n\n00:00:00.000 --> 00:00:10.000\nsprite_001.jpg#xywh=0,0,160,90\n'))
+        self.assertIn('00:00:30.000 --> 00:00:40.000\nsprite_001.jpg#xywh=160,90,160,90\n', vtt)
+        self.assertIn('00:00:40.000 --> 00:00:45.500\nsprite_002.jpg#xywh=0,0,160,90\n', vtt)
+
+    def test_vtt_never_points_past_the_produced_sheets(self):
+        vtt = build_thumbnail_vtt(['sprite_001.jpg'], 3600, (160, 90))
+
+        self.assertEqual(vtt.count('#xywh='), 4)
+
+    @patch('videostore.tasks.upload_files')
+    @patch('videostore.tasks.build_thumbnail_track', return_value=[('/tmp/thumbs/sprite_001.jpg', 'thumbnails/intro/sprite_001.jpg')])
+    @patch('videostore.tasks.os.path.exists', return_value=True)
+    @patch('videostore.tasks.os.makedirs')
+    @patch('videostore.tasks.subprocess.run')
+    def test_only_a_failed_poster_upload_fails_the_stage(self, mock_run, mock_makedirs, mock_exists, mock_build_track, mock_upload_files):
+        mock_run.return_value.returncode = 0
+        source_info = {'width': 1280, 'height': 720, 'duration': 60}
+        mock_upload_files.return_value = UploadResult(uploaded=['video-posters/intro.jpg'], failed={'thumbnails/intro/sprite_001.jpg': 'timeout'})
+        with self.assertLogs('videostore.tasks', level='WARNING'):
+            self.assertEqual(extract_and_upload_poster('/media/videos/intro.mp4', 'intro', source_info), 'video-posters/intro.jpg')
+
+        mock_upload_files.return_value = UploadResult(uploaded=['thumbnails/intro/sprite_001.jpg'], failed={'video-posters/intro.jpg': 'timeout'})
+        self.assertIsNone(extract_and_upload_poster('/media/videos/intro.mp4', 'intro', source_info))
+
+    @patch('videostore.tasks.upload_files')
+    @patch('videostore.tasks.subprocess.run')
+    def test_local_poster_and_sprites_are_removed_after_upload(self, mock_run, mock_upload_files):
+        def write_outputs(cmd, **kwargs):
+            open(os.path.join(media_root, 'videos', 'posters', 'intro.jpg'), 'wb').close()
+            open(os.path.join(media_root, 'videos', 'thumbnails', 'intro', 'sprite_001.jpg'), 'wb').close()
+            return MagicMock(returncode=0)
+
+        mock_run.side_effect = write_outputs
+        mock_upload_files.side_effect = lambda uploads: UploadResult(uploaded=[gcs_path for _, gcs_path in uploads])
+        with tempfile.TemporaryDirectory() as media_root, self.settings(MEDIA_ROOT=media_root):
+            poster_url = extract_and_upload_poster('/media/videos/intro.mp4', 'intro', {'width': 1280, 'height': 720, 'duration': 60})
+
+            self.assertEqual(poster_url, 'video-posters/intro.jpg')
+            self.assertEqual(len(mock_upload_files.call_args.args[0]), 3)
+            self.assertFalse(os.path.exists(os.path.join(media_root, 'videos', 'posters', 'intro.jpg')))
+            self.assertFalse(os.path.exists(os.path.join(media_root, 'videos', 'thumbnails', 'intro')))
+
+
+class QueueRoutingTests(TestCase):
+    @patch('videostore.tasks.Job.fetch_many', return_value=[None, None, None])
+    @patch('videostore.tasks.django_rq')
+    def test_conversion_goes_to_transcode_queue_with_duration_based_timeout(self, mock_django_rq, mock_fetch_many):
+        mock_queue = mock_django_rq.get_queue.return_value
+
+        with self.settings(HLS_CONVERSION_TIMEOUT_FACTOR=3, HLS_CONVERSION_TIMEOUT_MIN=600):
+            enqueue_conversion(1, "intro", duration=parse_duration("01:30:00"))
+
+        mock_django_rq.get_queue.assert_called_once_with('transcode', autocommit=True)
+        self.assertEqual(mock_queue.enqueue.call_args.kwargs['job_timeout'], 16200)
+
+    @override_settings(HLS_CONVERSION_TIMEOUT=7200, HLS_CONVERSION_TIMEOUT_FACTOR=3, HLS_CONVERSION_TIMEOUT_MIN=600)
+    def test_transcode_timeout_has_a_floor_and_a_fallback(self):
+        self.assertEqual(get_transcode_timeout(30), 600)
+        self.assertEqual(get_transcode_timeout(None), 7200)
+        self.assertIsNone(parse_duration(None))
+
+    @patch('videostore.tasks.django_rq')
+    def test_rendition_jobs_are_split_across_queues(self, mock_django_rq):
+        mock_django_rq.get_queue.return_value.enqueue.side_effect = lambda *args, **kwargs: MagicMock(id=kwargs['job_id'])
+
+        with self.settings(HLS_CONVERSION_TIMEOUT_FACTOR=3, HLS_CONVERSION_TIMEOUT_MIN=600):
+            enqueue_rendition_jobs(1, "intro", "/media/videos/intro", ['360'], {'duration': 3600})
+
+        self.assertEqual([call.args[0] for call in mock_django_rq.get_queue.call_args_list], ['metadata', 'transcode', 'upload'])
+        poster_call, rendition_call = mock_django_rq.get_queue.return_value.enqueue.call_args_list[:2]
+        self.assertEqual(poster_call.args[0], run_poster_stage)
+        self.assertEqual(poster_call.kwargs['job_timeout'], 10800)
+        self.assertEqual(rendition_call.kwargs['job_timeout'], 10800)
+
+    @patch('videostore.signals.django_rq')
+    def test_catalog_rebuild_goes_to_metadata_queue(self, mock_django_rq):
+        enqueue_catalog_manifest_rebuild()
+
+        mock_django_rq.get_queue.assert_called_once_with('metadata', autocommit=True)
+
+    @patch('videostore.management.commands.run_worker_pool.call_command')
+    def test_worker_pool_listens_to_its_queues_in_priority_order(self, mock_call_command):
+        with self.settings(RQ_WORKER_POOLS={'io': ['metadata', 'upload', 'maintenance']}):
+            call_command('run_worker_pool', 'io', stdout=MagicMock())
+
+        mock_call_command.assert_called_once_with('rqworker', 'metadata', 'upload', 'maintenance', with_scheduler=False, burst=False)
+
+    @patch('videostore.management.commands.run_worker_pool.call_command')
+    def test_worker_pool_accepts_a_worker_class(self, mock_call_command):
+        with self.settings(RQ_WORKER_POOLS={'transcode': ['transcode']}):
+            call_command('run_worker_pool', 'transcode', worker_class='videoflix.simpleworker.SimpleWorker', stdout=MagicMock())
+
+        mock_call_command.assert_called_once_with('rqworker', 'transcode', with_scheduler=False, burst=False, worker_class='videoflix.simpleworker.SimpleWorker')
+
+
+class PreforkWorkerPoolTests(TestCase):
+    def test_preforked_worker_enforces_job_timeouts(self):
+        self.assertIs(PreforkedWorker.death_penalty_class, UnixSignalDeathPenalty)
+
+    @patch('videoflix.simpleworker.connections')
+    def test_broken_db_connections_are_dropped_between_jobs(self, mock_connections):
+        healthy, broken, in_transaction = MagicMock(errors_occurred=False), MagicMock(errors_occurred=True), MagicMock(errors_occurred=False)
+        healthy.get_autocommit.return_value = True
+        healthy.is_usable.return_value = True
+        in_transaction.get_autocommit.return_value = False
+        mock_connections.all.return_value = [healthy, broken, in_transaction]
+
+        refresh_db_connections()
+
+        healthy.close.assert_not_called()
+        broken.close.assert_called_once()
+        in_transaction.close.assert_called_once()
+
+    @patch('videoflix.simpleworker.PreforkWorkerPool')
+    @patch('videostore.management.commands.run_worker_pool.django_rq')
+    def test_processes_option_starts_a_preforked_pool(self, mock_django_rq, mock_pool_class):
+        with self.settings(RQ_WORKER_POOLS={'io': ['metadata', 'upload']}):
+            call_command('run_worker_pool', 'io', processes=4, burst=True, stdout=MagicMock())
+
+        mock_django_rq.get_connection.assert_called_once_with('metadata')
+        mock_pool_class.assert_called_once_with(['metadata', 'upload'], connection=mock_django_rq.get_connection.return_value, num_workers=4)
+        mock_pool_class.return_value.start.assert_called_once_with(burst=True)
+
+    @patch('videostore.progress.publish_progress')
+    @patch('videostore.progress.subprocess.Popen')
+    def test_ffmpeg_is_killed_when_the_job_times_out(self, mock_popen, mock_publish):
+        process = mock_popen.return_value
+        process.stderr = []
+        process.stdout.__iter__.side_effect = JobTimeoutException("Task exceeded maximum timeout value")
+
+        with self.assertRaises(JobTimeoutException):
+            run_ffmpeg(['ffmpeg', '-i', 'in.mp4', 'out.m3u8'], 1, ['360'])
+
+        process.kill.assert_called_once()
+
+
+class VideoPurgeTests(TestCase):
+    @patch('videostore.signals.django_rq')
+    def test_delete_gcs_video_signal_only_enqueues_the_purge(self, mock_django_rq):
+        video_instance = Video(id=1, title="Intro", video_file="intro.mp4")
+
+        with self.captureOnCommitCallbacks(execute=True):
+            delete_gcs_video(sender=Video, instance=video_instance)
+
+        mock_django_rq.get_queue.assert_called_once_with('maintenance', autocommit=True)
+        enqueue = mock_django_rq.get_queue.return_value.enqueue
+        self.assertEqual(enqueue.call_args.args[:3], (purge_video, "intro", video_instance.video_file.path))
+        self.assertEqual(enqueue.call_args.kwargs['job_id'], 'purge-intro')
+        self.assertNotIn('retry', enqueue.call_args.kwargs)
+
+    def test_deletes_are_batched_and_missing_blobs_count_as_deleted(self):
+        mock_client = MagicMock()
+        batches = []
+
+        def make_batch(client, raise_exception=True):
+            batch = MagicMock()
+            batch.responses = [MagicMock(status_code=404)] + [MagicMock(status_code=204)] * 99
+            batches.append(batch)
+            return batch
+
+        with patch('videostore.gcs.RecordingBatch', side_effect=make_batch):
+            result = delete_blobs([f'hls/intro/{i}.ts' for i in range(250)], gcs_client=mock_client, batch_size=100, retries=0)
+
+        self.assertEqual(len(batches), 3)
+        self.assertEqual(result.requests, 3)
+        self.assertEqual(len(result.deleted), 250)
+        self.assertEqual(result.failed, {})
+
+    @override_settings(GCS_DELETE_BACKOFF=0)
+    def test_failed_deletes_are_retried(self):
+        mock_client = MagicMock()
+        responses = iter([[MagicMock(status_code=204), MagicMock(status_code=503)], [MagicMock(status_code=204)]])
+
+        def make_batch(client, raise_exception=True):
+            batch = MagicMock()
+            batch.responses = next(responses)
+            return batch
+
+        with patch('videostore.gcs.RecordingBatch', side_effect=make_batch):
+            result = delete_blobs(['text/intro/title.txt', 'text/intro/age.txt'], gcs_client=mock_client, retries=1)
+
+        self.assertEqual(result.deleted, ['text/intro/title.txt', 'text/intro/age.txt'])
+        self.assertEqual(result.failed, {})
+        self.assertEqual(result.requests, 2)
+
+    @patch('videostore.purge.get_current_job')
+    @patch('videostore.purge.delete_blobs')
+    @patch('videostore.purge.get_gcs_client')
+    def test_purge_lists_every_prefix_and_records_progress(self, mock_get_gcs_client, mock_delete_blobs, mock_get_current_job):
+        def list_blobs(bucket_name, prefix, fields):
+            blob = MagicMock()
+            blob.name = f'{prefix}a'
+            return [blob]
+        mock_get_gcs_client.return_value.list_blobs.side_effect = list_blobs
+
+        def delete_blobs(blob_names, gcs_client, on_progress):
+            on_progress(MagicMock(as_dict=MagicMock(return_value={'deleted': len(blob_names)})), len(blob_names))
+            return MagicMock(failed={}, as_dict=MagicMock(return_value={'deleted': len(blob_names)}))
+        mock_delete_blobs.side_effect = delete_blobs
+        job = mock_get_current_job.return_value
+        job.meta = {}
+
+        with tempfile.TemporaryDirectory() as media_root:
+            video_path = os.path.join(media_root, 'intro.mp4')
+            open(video_path, 'wb').close()
+            os.makedirs(os.path.join(media_root, 'intro', '360'))
+            os.makedirs(os.path.join(media_root, 'videos', 'posters'))
+            os.makedirs(os.path.join(media_root, 'videos', 'thumbnails', 'intro'))
+            poster_path = os.path.join(media_root, 'videos', 'posters', 'intro.jpg')
+            open(poster_path, 'wb').close()
+            with override_settings(MEDIA_ROOT=media_root):
+                purge_video('intro', video_path)
+
+            self.assertFalse(os.path.exists(video_path))
+            self.assertFalse(os.path.exists(os.path.join(media_root, 'intro')))
+            self.assertFalse(os.path.exists(poster_path))
+            self.assertFalse(os.path.exists(os.path.join(media_root, 'videos', 'thumbnails', 'intro')))
+
+        blob_names = mock_delete_blobs.call_args.args[0]
+        self.assertEqual(blob_names, ['video-posters/intro.jpg', 'hls/intro/a', 'thumbnails/intro/a', 'text/intro/a', 'myFilms/intro/a'])
+        self.assertEqual(job.meta['purge'], {'total': 5, 'deleted': 5})
+        job.save_meta.assert_called()
+
+
+class IngestVideosTests(TestCase):
+    def setUp(self):
+        self.source_directory = tempfile.TemporaryDirectory()
+        self.media_root = tempfile.TemporaryDirectory()
+        for name in ('intro.mp4', 'outro.mp4', 'notes.txt'):
+            with open(os.path.join(self.source_directory.name, name), 'wb') as source:
+                source.write(b'\x00' * 16)
+
+    def tearDown(self):
+        self.source_directory.cleanup()
+        self.media_root.cleanup()
+
+    @patch('videostore.signals.django_rq')
+    @patch('videostore.management.commands.ingest_videos.probe_source')
+    def test_directory_is_ingested_in_bulk_and_rerun_skips_it(self, mock_probe_source, mock_django_rq):
+        mock_probe_source.return_value = {'width': 3840, 'height': 2160, 'fps': 25.0, 'bit_rate': 0, 'duration': 90.4, 'has_audio': True}
+
+        with self.settings(MEDIA_ROOT=self.media_root.name):
+            call_command('ingest_videos', self.source_directory.name, no_convert=True, stdout=MagicMock())
+            call_command('ingest_videos', self.source_directory.name, no_convert=True, stdout=MagicMock())
+
+        videos = Video.objects.order_by('title')
+        self.assertEqual([video.title for video in videos], ["intro", "outro"])
+        self.assertEqual(videos[0].video_duration, "00:01:30")
+        self.assertEqual(videos[0].resolution, "4K")
+        self.assertTrue(videos[0].hls_playlist.endswith('/hls/intro/master.m3u8'))
+        self.assertTrue(os.path.isfile(os.path.join(self.media_root.name, 'videos', 'outro.mp4')))
+        self.assertEqual(mock_probe_source.call_count, 2)
+        enqueued = [call.args[0].__name__ for call in mock_django_rq.get_queue.return_value.enqueue.call_args_list]
+        self.assertEqual(enqueued.count('publish_video_metadata'), 2)
+
+    def test_manifest_with_unknown_fields_is_rejected(self):
+        manifest = os.path.join(self.source_directory.name, 'manifest.json')
+        with open(manifest, 'w') as manifest_file:
+            json.dump([{'file': 'intro.mp4', 'rating': 5}], manifest_file)
+
+        with self.assertRaises(CommandError):
+            call_command('ingest_videos', manifest, stdout=MagicMock())
+
+    @patch('videostore.management.commands.ingest_videos.time.sleep')
+    @patch('videostore.management.commands.ingest_videos.get_conversion_state', return_value="finished")
+    @patch('videostore.management.commands.ingest_videos.enqueue_conversion')
+    def test_conversions_never_exceed_the_concurrency_cap(self, mock_enqueue_conversion, mock_get_conversion_state, mock_sleep):
+        videos = [Video(id=i, title=f"Video {i}", video_file=f"videos/video{i}.mp4", video_duration="00:01:00") for i in range(1, 6)]
+        enqueued_before_sleep = []
+        mock_sleep.side_effect = lambda seconds: enqueued_before_sleep.append(mock_enqueue_conversion.call_count)
+
+        results = schedule_conversions(videos, 2, MagicMock())
+
+        self.assertEqual(results, {'finished': 5, 'failed': 0, 'reused': 0})
+        self.assertEqual(enqueued_before_sleep, [2, 4, 5])
+        mock_enqueue_conversion.assert_any_call(1, "video1", 60)
+
+
+class ContentHashDeduplicationTests(TestCase):
+    def create_converted_video(self, name, content_hash):
+        video = Video.objects.create(title=name, video_file=f"videos/{name}.mp4", video_duration="00:01:30", content_hash=content_hash)
+        VideoConversion.objects.create(video=video, status="finished", resolutions=['360', '720'], completed_stages=['probe', 'poster', 'master'])
+        return video
+
+    def test_text_fallback_shows_the_poster_of_the_shared_outputs(self):
+        poster_index = build_poster_index(['https://storage.googleapis.com/bucket/video-posters/intro.jpg'])
+        texts = {'text/intro_copy/title.txt': "Intro again", 'text/intro_copy/asset_key.txt': "intro\n"}
+
+        video_data = create_video_data_from_texts("intro_copy", texts, poster_index)
+
+        self.assertEqual(video_data.posterUrlGcs, 'https://storage.googleapis.com/bucket/video-posters/intro.jpg')
+        self.assertIsNone(create_video_data_from_texts("outro", {}, poster_index).posterUrlGcs)
+
+    def test_source_is_hashed_in_chunks(self):
+        with tempfile.NamedTemporaryFile() as source:
+            source.write(b'videoflix' * 1000)
+            source.flush()
+
+            self.assertEqual(hash_source(source.name, chunk_size=7), hashlib.sha256(b'videoflix' * 1000).hexdigest())
+
+    @patch('videostore.tasks.enqueue_conversion')
+    @patch('videostore.models.upload_files', return_value=UploadResult())
+    @patch('videostore.signals.get_video_duration')
+    @patch('videostore.tasks.hash_source', return_value='a' * 64)
+    @patch('videostore.tasks.os.path.isfile', return_value=True)
+    def test_identical_upload_reuses_outputs_instead_of_converting(self, mock_isfile, mock_hash_source, mock_get_video_duration, mock_upload_files, mock_enqueue_conversion):
+        original = self.create_converted_video("intro", 'a' * 64)
+        duplicate = Video.objects.create(title="Intro again", video_file="videos/intro_copy.mp4")
+
+        prepare_video(duplicate.id)
+
+        duplicate.refresh_from_db()
+        original.refresh_from_db()
+        mock_enqueue_conversion.assert_not_called()
+        mock_get_video_duration.assert_not_called()
+        self.assertEqual(duplicate.content_hash, 'a' * 64)
+        self.assertEqual(duplicate.asset_key, "intro")
+        self.assertEqual(original.asset_key, "intro")
+        self.assertEqual(duplicate.hls_playlist, original.hls_playlist)
+        self.assertEqual(duplicate.poster_url, original.poster_url)
+        self.assertEqual(duplicate.video_duration, "00:01:30")
+        self.assertEqual(duplicate.conversion.status, "finished")
+        self.assertEqual(duplicate.conversion.resolutions, ['360', '720'])
+        self.assertEqual(duplicate.get_text_metadata()['asset_key.txt'], "intro")
+
+    @patch('videostore.tasks.enqueue_conversion')
+    @patch('videostore.models.upload_files', return_value=UploadResult())
+    @patch('videostore.signals.get_video_duration')
+    @patch('videostore.tasks.hash_source', return_value='b' * 64)
+    @patch('videostore.tasks.os.path.isfile', return_value=True)
+    def test_new_source_is_converted(self, mock_isfile, mock_hash_source, mock_get_video_duration, mock_upload_files, mock_enqueue_conversion):
+        self.create_converted_video("intro", 'a' * 64)
+        video = Video.objects.create(title="Outro", video_file="videos/outro.mp4")
+
+        prepare_video(video.id)
+
+        mock_enqueue_conversion.assert_called_once_with(video.id, "outro", None)
+        self.assertIsNone(Video.objects.get(id=video.id).asset_key)
+
+    @patch('videostore.views.redis_client')
+    def test_duplicate_plays_the_shared_renditions(self, mock_redis):
+        Video.objects.bulk_create([Video(title="Intro again", description="", video_file="videos/intro_copy.mp4", asset_key="intro")])
+        mock_redis.get.return_value = None
+
+        preview = self.client.get(reverse('get_preview_video'), {'video_key': 'intro_copy', 'resolution': '720p'})
+        full = get_full_video(RequestFactory().get('/', {'video_key': 'intro_copy', 'resolution': '720p'}))
+        unknown = get_full_video(RequestFactory().get('/', {'video_key': 'outro', 'resolution': '720p'}))
+
+        expected_url = f"https://storage.googleapis.com/{settings.GS_BUCKET_NAME}/hls/intro/720p.m3u8"
+        self.assertEqual(preview.json()['video_url'], expected_url)
+        self.assertEqual(json.loads(full.content)['video_url'], expected_url)
+        self.assertEqual(json.loads(unknown.content)['video_url'], f"https://storage.googleapis.com/{settings.GS_BUCKET_NAME}/hls/outro/720p.m3u8")
+
+    def test_purge_keeps_outputs_other_videos_still_use(self):
+        self.create_converted_video("intro", 'a' * 64)
+        Video.objects.filter(title="intro").update(asset_key="intro")
+        mock_client = MagicMock()
+        mock_client.list_blobs.return_value = []
+
+        blob_names = list_video_blob_names(mock_client, "intro_copy", "intro")
+
+        self.assertEqual([call.kwargs['prefix'] for call in mock_client.list_blobs.call_args_list], ['text/intro_copy/', 'myFilms/intro_copy/'])
+        self.assertNotIn('video-posters/intro.jpg', blob_names)
+
+    @patch('videostore.management.commands.ingest_videos.time.sleep')
+    @patch('videostore.management.commands.ingest_videos.reuse_duplicate')
+    @patch('videostore.management.commands.ingest_videos.get_conversion_state', return_value="finished")
+    @patch('videostore.management.commands.ingest_videos.enqueue_conversion')
+    def test_identical_sources_in_one_ingest_are_converted_once(self, mock_enqueue_conversion, mock_get_conversion_state, mock_reuse_duplicate, mock_sleep):
+        videos = [
+            Video(id=1, title="A", video_file="videos/a.mp4", content_hash='a' * 64),
+            Video(id=2, title="A copy", video_file="videos/a_copy.mp4", content_hash='a' * 64),
+            Video(id=3, title="B", video_file="videos/b.mp4", content_hash='b' * 64),
+        ]
+        # The copy is only looked at after "a" finished, and then finds its outputs
+        mock_reuse_duplicate.side_effect = lambda video: video.id == 2
+
+        with patch('videostore.management.commands.ingest_videos.enqueue_metadata_publish'):
+            results = schedule_conversions(videos, 4, MagicMock())
 
-        mock_get_video_duration.assert_called_once_with(video_instance)
-
-        mock_queue.enqueue.assert_called_once_with(mock_convert_to_hls, video_instance.id, video_name="test_video")
-        
-        
-    @pytest.fixture
-    def mock_bucket():
-        return mock.Mock()
-
-    @pytest.fixture
-    def mock_blob():
-        return mock.Mock()
-
-    @pytest.fixture
-    def mock_list_blobs(mock_bucket, mock_blob):
-        mock_bucket.list_blobs.return_value = [mock_blob]
-        return mock_bucket.list_blobs
-
-    def test_delete_hls_folder(mock_bucket, mock_list_blobs, mock_blob, caplog):
-        base_path = "test-video"
-        delete_hls_folder(mock_bucket, base_path)
-        mock_bucket.list_blobs.assert_called_once_with(prefix="hls/test-video/")
-        mock_blob.delete.assert_called_once()
-        assert f"Deleted {mock_blob.name} from Google Cloud Storage" in caplog.text
-        assert "Deleted all files in folder hls/test-video/ from Google Cloud Storage" in caplog.text
-
-
-    def test_delete_video_poster(mock_bucket, mock_blob, caplog):
-        base_path = "test-video"
-        mock_blob.exists.return_value = True
-        mock_bucket.blob.return_value = mock_blob
-        delete_video_poster(mock_bucket, base_path)
-        mock_bucket.blob.assert_called_once_with("video-posters/test-video.jpg")
-        mock_blob.delete.assert_called_once()
-        assert "Deleted poster video-posters/test-video.jpg from Google Cloud Storage" in caplog.text
-
-
-    def test_delete_video_poster_not_found(mock_bucket, mock_blob, caplog):
-        base_path = "test-video"
-        mock_blob.exists.return_value = False
-        mock_bucket.blob.return_value = mock_blob
-        delete_video_poster(mock_bucket, base_path)
-        mock_bucket.blob.assert_called_once_with("video-posters/test-video.jpg")
-        mock_blob.delete.assert_not_called()
-        assert "Poster video-posters/test-video.jpg not found in Google Cloud Storage" in caplog.text
-
-
-    def test_delete_text_subfolder(mock_bucket, mock_list_blobs, mock_blob, caplog):
-        base_path = "test-video"
-        delete_text_subfolder(mock_bucket, base_path)
-        mock_bucket.list_blobs.assert_called_once_with(prefix="text/test-video/")
-        mock_blob.delete.assert_called_once()
-        assert f"Deleted {mock_blob.name} from Google Cloud Storage" in caplog.text
-        assert "Deleted all files in subfolder text/test-video/ from Google Cloud Storage" in caplog.text
-
-
-    def test_delete_myfilms_subfolder(mock_bucket, mock_list_blobs, mock_blob, caplog):
-        base_path = "test-video"
-        delete_myfilms_subfolder(mock_bucket, base_path)
-        mock_bucket.list_blobs.assert_called_once_with(prefix="myFilms/test-video/")
-        mock_blob.delete.assert_called_once()
-        assert f"Deleted {mock_blob.name} from Google Cloud Storage" in caplog.text
-        assert "Deleted all files in subfolder myFilms/test-video/ from Google Cloud Storage" in caplog.text
-
-
-    def test_delete_gcs_video_signal(mocker, mock_bucket, caplog):
-        mocker.patch("videostore.signals.storage.Client", return_value=mock.Mock())
-        mocker.patch("videostore.signals.delete_hls_folder")
-        mocker.patch("videostore.signals.delete_video_poster")
-        mocker.patch("videostore.signals.delete_text_subfolder")
-        mocker.patch("videostore.signals.delete_myfilms_subfolder")
-
-        video_instance = mock.Mock(video_file=mock.Mock(name="test-video.mp4"))
-        delete_gcs_video(sender=Video, instance=video_instance)
-
-        assert "Connecting to Google Cloud Storage" in caplog.text
+        self.assertEqual([call.args[0] for call in mock_enqueue_conversion.call_args_list], [1, 3])
+        self.assertEqual(results, {'finished': 2, 'failed': 0, 'reused': 1})
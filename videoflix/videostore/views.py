@@ -1,18 +1,24 @@
+import os
 from dataclasses import dataclass
 from django.conf import settings
 from django.views.decorators.csrf import csrf_exempt
 import redis
 from django.views.decorators.http import require_http_methods
-from google.cloud import storage
 import json
 from rest_framework.response import Response
-from rest_framework.decorators import api_view
-from django.http import JsonResponse, HttpResponseBadRequest
-
-
-redis_client = redis.StrictRedis(host='localhost', port=6379, db=0)
-gcs_client = storage.Client(credentials=settings.GS_CREDENTIALS, project=settings.GS_PROJECT_ID)
-gcs_bucket = gcs_client.bucket(settings.GS_BUCKET_NAME)
+from rest_framework.decorators import api_view, permission_classes
+from rest_framework.permissions import IsAuthenticated
+from rest_framework import generics, filters
+from rest_framework.pagination import CursorPagination
+from django.http import JsonResponse, HttpResponse, HttpResponseBadRequest
+from django.utils.cache import patch_vary_headers, get_conditional_response
+from django.utils.http import http_date
+from .catalog import load_catalog_manifest, get_catalog_queryset
+from .serializers import VideoCatalogSerializer
+from .gcs import fetch_blob_texts, get_gcs_bucket
+from .models import Video, VideoConversion
+from .progress import get_progress
+from .cache import redis_client, get_or_rebuild, get_or_rebuild_raw, get_stale_while_revalidate, get_revalidated_validators, set_revalidated, make_etag
 
 
 @dataclass
@@ -33,99 +39,196 @@ class VideoData:
 @api_view(["GET"])
 def get_poster_and_text(request):
     try:
-        poster_urls = get_poster_urls()
-        gcs_data = get_gcs_video_text_data(poster_urls)
-        return Response([video.__dict__ for video in gcs_data])
+        content_encoding = select_content_encoding(request.META.get('HTTP_ACCEPT_ENCODING', ''))
+        etag, last_modified = get_revalidated_validators('gcs_video_text_data', warm_gcs_video_text_data)
+        if etag is not None:
+            response = conditional_response(request, encoded_etag(etag, content_encoding), last_modified)
+            if response is not None:
+                patch_vary_headers(response, ['Accept-Encoding'])
+                return response
+        body, etag, last_modified = get_gcs_video_text_body(content_encoding)
+        response = build_encoded_response(body, content_encoding)
+        return set_validators(response, encoded_etag(etag, content_encoding), last_modified)
     except Exception as e:
         return Response({'error': str(e)}, status=500)
+
+
+def encoded_etag(etag, content_encoding):
+    if content_encoding == 'identity':
+        return etag
+    return f'{etag[:-1]}-{content_encoding}"'
+
+
+def conditional_response(request, etag, last_modified=None):
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if response is not None:
+        set_validators(response, etag, last_modified)
+    return response
+
+
+def set_validators(response, etag, last_modified=None):
+    response['ETag'] = etag
+    if last_modified is not None:
+        response['Last-Modified'] = http_date(last_modified)
+    return response
+
+
+def select_content_encoding(accept_encoding):
+    accepted = {}
+    for part in accept_encoding.split(','):
+        coding, _, params = part.strip().partition(';')
+        quality = params.strip()[2:] if params.strip().startswith('q=') else '1'
+        try:
+            accepted[coding.strip().lower()] = float(quality)
+        except ValueError:
+            continue
+    for content_encoding in ('br', 'gzip'):
+        if accepted.get(content_encoding, accepted.get('*', 0)) > 0:
+            return content_encoding
+    return 'identity'
+
+
+def build_encoded_response(body, content_encoding):
+    response = HttpResponse(body, content_type='application/json')
+    if content_encoding != 'identity':
+        response['Content-Encoding'] = content_encoding
+    patch_vary_headers(response, ['Accept-Encoding'])
+    return response
     
 def get_poster_urls():
-    poster_cache_key = 'poster_urls'
-    poster_urls = redis_client.get(poster_cache_key)
-    if poster_urls:
-        return json.loads(poster_urls)
-    
     try:
-        prefix = 'video-posters/'
-        blobs = list(gcs_bucket.list_blobs(prefix=prefix))
-        poster_urls = [f'https://storage.googleapis.com/{settings.GS_BUCKET_NAME}/{blob.name}' for blob in blobs]
-        redis_client.setex(poster_cache_key, 3600, json.dumps(poster_urls))
-        return poster_urls
+        return get_or_rebuild('poster_urls', list_poster_urls)
     except Exception as e:
         raise Exception(f'Error fetching poster URLs: {str(e)}')
 
 
-def get_gcs_video_text_data(poster_urls):
-    text_cache_key = 'gcs_video_text_data'
-    gcs_data = redis_client.get(text_cache_key)
-    
-    if gcs_data:
-        return [VideoData(**video) for video in json.loads(gcs_data)]
+def list_poster_urls():
+    prefix = 'video-posters/'
+    blobs = get_gcs_bucket().list_blobs(prefix=prefix)
+    return [f'https://storage.googleapis.com/{settings.GS_BUCKET_NAME}/{blob.name}' for blob in blobs]
+
+
+def get_gcs_video_text_body(content_encoding='identity'):
     try:
-        gcs_data = fetch_video_text_data_from_gcs(poster_urls)
-        cache_gcs_video_text_data(text_cache_key, gcs_data)
-        
-        return gcs_data
+        return get_stale_while_revalidate('gcs_video_text_data', build_gcs_video_text_payload, warm_gcs_video_text_data, content_encoding)
     except Exception as e:
         raise Exception(f'Error fetching GCS video text data: {str(e)}')
 
 
-def create_video_data_from_blob(blob, poster_urls):
-    
-    subfolder = extract_subfolder_from_blob(blob)
-    hlsPlaylistUrl = extract_blob_data(f'text/{subfolder}/hlsPlaylist.txt')
-    title = extract_blob_data(f'text/{subfolder}/title.txt')
-    category = extract_blob_data(f'text/{subfolder}/category.txt')
-    age = extract_blob_data(f'text/{subfolder}/age.txt', default_value='0')
-    resolution = extract_blob_data(f'text/{subfolder}/resolution.txt', default_value='HD')
-    release_date = extract_blob_data(f'text/{subfolder}/release_date.txt', default_value='2020')
-    video_duration = extract_blob_data(f'text/{subfolder}/video_duration.txt', default_value='00:00:00')
-    poster_url = get_poster_url(subfolder, poster_urls)
-    
-    return create_video_data(blob, subfolder, title, category, hlsPlaylistUrl, age, resolution, release_date, video_duration, poster_url)
+def build_gcs_video_text_data():
+    gcs_data = fetch_video_data_from_manifest()
+    if gcs_data is None:
+        gcs_data = fetch_video_text_data_from_gcs(get_poster_urls())
+    return gcs_data
 
 
-def extract_blob_data(blob_path, default_value=''):
-    blob = gcs_bucket.get_blob(blob_path)
-    return blob.download_as_text().strip() if blob else default_value
+def build_gcs_video_text_payload():
+    return json.dumps([video.__dict__ for video in build_gcs_video_text_data()]).encode('utf-8')
 
 
-def get_poster_url(subfolder, poster_urls):
-    return next((url for url in poster_urls if subfolder in url), None)
+def fetch_video_data_from_manifest():
+    manifest = load_catalog_manifest(get_gcs_bucket())
+    if manifest is None:
+        print('Catalog manifest not found, falling back to text/ blobs')
+        return None
+    return [VideoData(**video) for video in manifest['videos']]
 
 
-def create_video_data(blob, subfolder, title, category, hlsPlaylistUrl, age, resolution, release_date, video_duration, poster_url):
-    return VideoData(
-        subfolder=subfolder,
-        title=title,
-        description=blob.download_as_text(),
-        category=category,
-        hlsPlaylistUrl=hlsPlaylistUrl,
-        age=age,
-        resolution=resolution,
-        posterUrlGcs=poster_url,
-        release_date=release_date,
-        video_duration=video_duration
-    )
+TEXT_FIELD_DEFAULTS = {
+    'hlsPlaylistUrl': ('hlsPlaylist.txt', ''),
+    'title': ('title.txt', ''),
+    'description': ('description.txt', ''),
+    'category': ('category.txt', ''),
+    'age': ('age.txt', '0'),
+    'resolution': ('resolution.txt', 'HD'),
+    'release_date': ('release_date.txt', '2020'),
+    'video_duration': ('video_duration.txt', '00:00:00'),
+}
+ASSET_KEY_FILE = 'asset_key.txt'
 
 
-def extract_subfolder_from_blob(blob):
-    return blob.name.split('/')[1]
+def create_video_data_from_texts(subfolder, texts, poster_index):
+    fields = {}
+    for field_name, (filename, default_value) in TEXT_FIELD_DEFAULTS.items():
+        text = texts.get(f'text/{subfolder}/{filename}')
+        fields[field_name] = text.strip() if text is not None else default_value
+    fields['description'] = texts.get(f'text/{subfolder}/description.txt', '')
+    # A deduplicated video shows the poster of the video whose outputs it reuses
+    asset_key = (texts.get(f'text/{subfolder}/{ASSET_KEY_FILE}') or '').strip() or subfolder
+    return VideoData(subfolder=subfolder, posterUrlGcs=get_poster_url(asset_key, poster_index), **fields)
 
 
-def cache_gcs_video_text_data(text_cache_key, gcs_data):
-    redis_client.setex(text_cache_key, 3600, json.dumps([video.__dict__ for video in gcs_data]))
+def build_poster_index(poster_urls):
+    return {os.path.splitext(url.rsplit('/', 1)[-1])[0]: url for url in poster_urls}
+
+
+def get_poster_url(subfolder, poster_index):
+    return poster_index.get(subfolder)
+
+
+def extract_subfolder_from_blob(blob):
+    return blob.name.split('/')[1]
 
 
 def fetch_video_text_data_from_gcs(poster_urls):
     prefix = 'text/'
+    gcs_bucket = get_gcs_bucket()
     blobs = gcs_bucket.list_blobs(prefix=prefix)
-    gcs_data = []
-    for blob in blobs:
-        if blob.name.endswith('/description.txt'):
-            video_data = create_video_data_from_blob(blob, poster_urls)
-            gcs_data.append(video_data)
-    return gcs_data
+    subfolders = [extract_subfolder_from_blob(blob) for blob in blobs if blob.name.endswith('/description.txt')]
+    filenames = [filename for filename, _ in TEXT_FIELD_DEFAULTS.values()] + [ASSET_KEY_FILE]
+    blob_paths = [f'text/{subfolder}/{filename}' for subfolder in subfolders for filename in filenames]
+    result = fetch_blob_texts(gcs_bucket, blob_paths)
+    poster_index = build_poster_index(poster_urls)
+    return [create_video_data_from_texts(subfolder, result.texts, poster_index) for subfolder in subfolders]
+
+
+def warm_gcs_video_text_data():
+    set_revalidated('gcs_video_text_data', build_gcs_video_text_payload())
+
+
+class VideoCatalogPagination(CursorPagination):
+    page_size = 24
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+    ordering = '-id'
+
+    def get_ordering(self, request, queryset, view):
+        # release_date and created_at repeat a lot; without a unique tiebreaker rows shuffle between pages
+        ordering = tuple(super().get_ordering(request, queryset, view))
+        if ordering[-1].lstrip('-') != 'id':
+            ordering += ('-id' if ordering[0].startswith('-') else 'id',)
+        return ordering
+
+
+class VideoCatalogView(generics.ListAPIView):
+    serializer_class = VideoCatalogSerializer
+    pagination_class = VideoCatalogPagination
+    filter_backends = [filters.OrderingFilter]
+    ordering_fields = ['id', 'created_at', 'release_date', 'title']
+    catalog_filter_fields = ['category', 'age', 'resolution', 'release_date']
+
+    def get_queryset(self):
+        queryset = get_catalog_queryset()
+        for field in self.catalog_filter_fields:
+            values = self.request.query_params.get(field)
+            if values:
+                queryset = queryset.filter(**{f'{field}__in': values.split(',')})
+        return queryset
+
+
+@api_view(["GET"])
+@permission_classes([IsAuthenticated])
+def get_video_progress(request, video_id):
+    try:
+        renditions = get_progress(video_id)
+    except redis.RedisError as e:
+        print(f"Error fetching progress of video id {video_id}: {e}")
+        return Response({'error': 'Progress is currently unavailable'}, status=500)
+    # The stored error is raw ffmpeg stderr with server paths; clients only get the status
+    conversion = VideoConversion.objects.filter(video_id=video_id).values('status', 'completed_stages').first()
+    if conversion is None and not renditions:
+        return Response({'error': 'No conversion found for this video'}, status=404)
+    return Response({'video_id': video_id, 'conversion': conversion, 'renditions': renditions})
 
 
 @require_http_methods(["GET"])
@@ -135,12 +238,16 @@ def get_preview_video(request):
         return JsonResponse({'error': 'Video key and resolution are required'}, status=400)
     cache_key = f"{video_key}_{resolution}"  
     try:
+        video_url = generate_video_url(get_output_key(video_key), resolution)
+        etag = make_etag(video_url)
+        not_modified = conditional_response(request, etag)
+        if not_modified is not None:
+            return not_modified
         cached_video_url = get_cached_video_url(cache_key)
         if cached_video_url:
-            return JsonResponse({'video_url': cached_video_url})     
-        video_url = generate_video_url(video_key, resolution)
+            return set_validators(JsonResponse({'video_url': cached_video_url}), etag)
         cache_video_url(cache_key, video_url)     
-        return JsonResponse({'video_url': video_url})
+        return set_validators(JsonResponse({'video_url': video_url}), etag)
     except redis.RedisError as e:
         print(f'Redis error: {str(e)}')
         return JsonResponse({'error': 'Internal server error while accessing cache'}, status=500)
@@ -162,10 +269,14 @@ def get_cached_video_url(cache_key):
     return None
 
 
+def get_output_key(video_key):
+    """Map the client's video key to its hls/ folder; a deduplicated upload plays the original's renditions."""
+    asset_key = Video.objects.filter(video_file__in=[f'videos/{video_key}.mp4', f'{video_key}.mp4']).values_list('asset_key', flat=True).first()
+    return asset_key or video_key
+
+
 def generate_video_url(video_key, resolution):
-    video_url = f'https://storage.googleapis.com/videoflix-storage/hls/{video_key}/{resolution}.m3u8'
-    print('Generated video URL:', video_url)
-    return video_url
+    return f'https://storage.googleapis.com/{settings.GS_BUCKET_NAME}/hls/{video_key}/{resolution}.m3u8'
 
 
 def cache_video_url(cache_key, video_url):
@@ -179,15 +290,19 @@ def get_full_video(request):
     if not video_key or not resolution:
         return HttpResponseBadRequest({'error': 'Video key and resolution are required'})
     cache_key = f"{video_key}_{resolution}"
+    video_url = generate_video_url(get_output_key(video_key), resolution)
+    etag = make_etag(video_url)
+    not_modified = conditional_response(request, etag)
+    if not_modified is not None:
+        return not_modified
     cached_video_url = redis_client.get(cache_key)
     if cached_video_url:
         print('Video URL from cache:', cached_video_url.decode('utf-8'))
-        return JsonResponse({'video_url': cached_video_url.decode('utf-8')})
-    video_url = f'https://storage.googleapis.com/{settings.GS_BUCKET_NAME}/hls/{video_key}/{resolution}.m3u8'
+        return set_validators(JsonResponse({'video_url': cached_video_url.decode('utf-8')}), etag)
     print('Generated video URL:', video_url)
     redis_client.setex(cache_key, 3600, video_url)
 
-    return JsonResponse({'video_url': video_url})
+    return set_validators(JsonResponse({'video_url': video_url}), etag)
 
 
 @csrf_exempt
@@ -200,8 +315,10 @@ def create_gcs_myFilms(request):
             return JsonResponse({'error': 'file_name is required'}, status=400)       
         main_folder = 'myFilms/'
         sub_folder = f'{main_folder}{file_name}/'
+        gcs_bucket = get_gcs_bucket()
         if not gcs_bucket.blob(sub_folder).exists():
             gcs_bucket.blob(sub_folder + 'placeholder.txt').upload_from_string('')
+            redis_client.delete('my_films_subfolders')
             print(f'Unterordner "{sub_folder}" erstellt')
         folder_url = f'https://storage.googleapis.com/{settings.GS_BUCKET_NAME}/{sub_folder}'
         return JsonResponse({'message': f'Ordner "{sub_folder}" erfolgreich erstellt', 'url': folder_url}, status=201)
@@ -211,28 +328,26 @@ def create_gcs_myFilms(request):
 
 @api_view(["GET"])
 def get_myFilms(request):
-    cache_key = 'my_films_subfolders'
-    subfolders = redis_client.get(cache_key)   
-    if subfolders:
-        subfolders = json.loads(subfolders)
-        print('Subfolders from cache:', subfolders)
-    else:
-        try:
-            prefix = 'myFilms/'
-            blobs = gcs_bucket.list_blobs(prefix=prefix)
-            subfolder_names = set()
-            
-            for blob in blobs:
-                if blob.name.endswith('placeholder.txt'):
-                    parts = blob.name.split('/')
-                    if len(parts) > 1:
-                        subfolder_name = parts[1]
-                        subfolder_names.add(subfolder_name)           
-            subfolders = list(subfolder_names)
-            redis_client.setex(cache_key, 3600, json.dumps(subfolders))
-        except Exception as e:
-            return Response({'error': f'Error fetching subfolder names: {str(e)}'}, status=500)   
-    return Response(subfolders)
-
-
-
+    try:
+        subfolders = get_or_rebuild_raw('my_films_subfolders', list_my_films_subfolders)
+    except Exception as e:
+        return Response({'error': f'Error fetching subfolder names: {str(e)}'}, status=500)   
+    etag = make_etag(subfolders)
+    not_modified = conditional_response(request, etag)
+    if not_modified is not None:
+        return not_modified
+    return set_validators(Response(json.loads(subfolders)), etag)
+
+
+def list_my_films_subfolders():
+    prefix = 'myFilms/'
+    blobs = get_gcs_bucket().list_blobs(prefix=prefix)
+    subfolder_names = set()
+    
+    for blob in blobs:
+        if blob.name.endswith('placeholder.txt'):
+            parts = blob.name.split('/')
+            if len(parts) > 1:
+                subfolder_name = parts[1]
+                subfolder_names.add(subfolder_name)           
+    return list(subfolder_names)